@@ -0,0 +1,225 @@
+"""Deterministic synthetic MBOX generator for the benchmark suite.
+
+The same arguments always produce a byte-identical file, so benchmark results of
+different runs and revisions are comparable.
+"""
+import argparse
+import base64
+import datetime
+import random
+import textwrap
+
+# Share of each kind in a generated file
+DEFAULT_MIX = {'plain': 50, 'multilingual': 20, 'nested': 15, 'attachment': 10, 'malformed': 5}
+
+DEFAULT_MESSAGES = 2000
+DEFAULT_ATTACHMENT_SIZE = 512 * 1024
+DEFAULT_NESTING_DEPTH = 12
+
+START_DATE = datetime.datetime(2024, 1, 1, 8, 0, 0, tzinfo=datetime.timezone.utc)
+
+WORDS = (
+    'archive', 'message', 'report', 'meeting', 'invoice', 'schedule', 'update', 'review',
+    'release', 'budget', 'project', 'customer', 'support', 'deadline', 'draft', 'summary',
+)
+
+# (charset, text) pairs used for encoded-word headers and bodies
+MULTILINGUAL = (
+    ('utf-8', 'Grüße aus München – Überprüfung'),
+    ('iso-8859-1', 'Réunion prévue à Genève'),
+    ('utf-8', 'Отчёт за квартал'),
+    ('utf-8', '会議の議事録について'),
+    ('utf-8', 'Ελέγξτε το συνημμένο'),
+    ('utf-8', '季度报告已更新'),
+    ('iso-8859-2', 'Zażółć gęślą jaźń'),
+)
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def paragraph(rng, sentences=6):
+    return '\n'.join(textwrap.wrap(' '.join(sentence(rng) for _ in range(sentences)), 72))
+
+
+def encoded_word(charset, text, rng):
+    """Encode a header value as a RFC 2047 encoded word, in B or Q encoding."""
+    data = text.encode(charset)
+    if rng.random() < 0.5:
+        return '=?%s?B?%s?=' % (charset, base64.b64encode(data).decode('ascii'))
+    quoted = ''.join(
+        '_' if byte == 0x20 else chr(byte) if 0x30 <= byte < 0x7f and byte != 0x3d and byte != 0x3f
+        else '=%02X' % byte
+        for byte in data
+    )
+    return '=?%s?Q?%s?=' % (charset, quoted)
+
+
+def headers(index, rng, sender=None, subject=None, extra=()):
+    date = START_DATE + datetime.timedelta(minutes=17 * index)
+    lines = [
+        'From: %s' % (sender or 'User %d <user%d@example%d.com>' % (index % 97, index % 97, index % 7)),
+        'To: team%d@example.org' % (index % 11),
+        'Subject: %s' % (subject or sentence(rng, 6)),
+        'Date: %s' % date.strftime('%a, %d %b %Y %H:%M:%S +0000'),
+        'Message-ID: <bench-%d@example.com>' % index,
+        'MIME-Version: 1.0',
+    ]
+    lines.extend(extra)
+    return lines
+
+
+def plain_message(index, rng, options):
+    lines = headers(index, rng, extra=['Content-Type: text/plain; charset="us-ascii"'])
+    body = '\n\n'.join(paragraph(rng) for _ in range(rng.randint(1, 4)))
+    return '\n'.join(lines) + '\n\n' + body + '\n'
+
+
+def multilingual_message(index, rng, options):
+    charset, text = rng.choice(MULTILINGUAL)
+    name_charset, name = rng.choice(MULTILINGUAL)
+    sender = '%s <intl%d@example.jp>' % (encoded_word(name_charset, name[:12], rng), index % 13)
+    lines = headers(index, rng, sender=sender, subject=encoded_word(charset, text, rng), extra=[
+        'Content-Type: text/plain; charset="%s"' % charset,
+        'Content-Transfer-Encoding: base64',
+    ])
+    body = (text + '\n') * rng.randint(5, 40)
+    encoded = base64.encodebytes(body.encode(charset)).decode('ascii')
+    return '\n'.join(lines) + '\n\n' + encoded
+
+
+def nested_message(index, rng, options):
+    depth = options.nesting_depth
+
+    def part(level):
+        if level == depth:
+            return 'Content-Type: text/plain; charset="utf-8"\n\n' + paragraph(rng, 2) + '\n'
+        boundary = 'nest-%d-%d' % (index, level)
+        children = [part(level + 1), 'Content-Type: text/html; charset="utf-8"\n\n<p>%s</p>\n' % sentence(rng)]
+        return (
+            'Content-Type: multipart/mixed; boundary="%s"\n\n' % boundary
+            + ''.join('--%s\n%s' % (boundary, child) for child in children)
+            + '--%s--\n' % boundary
+        )
+
+    lines = headers(index, rng)
+    return '\n'.join(lines) + '\n' + part(0)
+
+
+def attachment_message(index, rng, options):
+    boundary = 'att-%d' % index
+    size = options.attachment_size
+    payload = bytes(rng.getrandbits(8) for _ in range(min(size, 4096)))
+    payload = (payload * (size // len(payload) + 1))[:size] if payload else b''
+    encoded = base64.encodebytes(payload).decode('ascii')
+    lines = headers(index, rng, extra=['Content-Type: multipart/mixed; boundary="%s"' % boundary])
+    return (
+        '\n'.join(lines) + '\n\n'
+        + '--%s\nContent-Type: text/plain; charset="utf-8"\n\n%s\n' % (boundary, paragraph(rng, 2))
+        + '--%s\nContent-Type: application/octet-stream\n'
+          'Content-Disposition: attachment; filename="data-%d.bin"\n'
+          'Content-Transfer-Encoding: base64\n\n%s' % (boundary, index, encoded)
+        + '--%s--\n' % boundary
+    )
+
+
+def malformed_message(index, rng, options):
+    variant = index % 5
+    if variant == 0:
+        # Boundary that never appears in the body
+        lines = headers(index, rng, extra=['Content-Type: multipart/mixed; boundary="missing"'])
+        return '\n'.join(lines) + '\n\n--other\nContent-Type: text/plain\n\n' + sentence(rng) + '\n'
+    if variant == 1:
+        # Invalid base64 payload
+        lines = headers(index, rng, extra=['Content-Type: text/plain', 'Content-Transfer-Encoding: base64'])
+        return '\n'.join(lines) + '\n\n' + 'not*base64!' * 20 + '\nQUJD\n'
+    if variant == 2:
+        # Unknown declared charset with Latin-1 bytes
+        lines = headers(index, rng, extra=['Content-Type: text/plain; charset="x-unknown-charset"'])
+        return '\n'.join(lines) + '\n\n' + 'Caf\udce9 cr\udce8me br\udcfbl\udce9e\n' * 5
+    if variant == 3:
+        # Unterminated encoded word and a header without a value
+        lines = headers(index, rng, subject='=?utf-8?B?SGVsbG8gV29y', extra=['X-Empty:'])
+        return '\n'.join(lines) + '\n\n' + sentence(rng) + '\n'
+    # No headers besides a broken date and no body
+    return 'Date: not a date\nSubject: %s\n\n' % sentence(rng, 3)
+
+
+GENERATORS = {
+    'plain': plain_message,
+    'multilingual': multilingual_message,
+    'nested': nested_message,
+    'attachment': attachment_message,
+    'malformed': malformed_message,
+}
+
+
+def message_kinds(count, mix):
+    """Returns the kind of every message, spreading each kind evenly through the file."""
+    total = sum(mix.values())
+    kinds = []
+    credit = dict.fromkeys(mix, 0.0)
+    for _ in range(count):
+        for kind, weight in mix.items():
+            credit[kind] += weight / total
+        kind = max(credit, key=credit.get)
+        credit[kind] -= 1
+        kinds.append(kind)
+    return kinds
+
+
+def escape_from_lines(text):
+    """Quote body lines that would otherwise start a new message (mboxrd style)."""
+    return '\n'.join('>' + line if line.startswith('From ') else line for line in text.split('\n'))
+
+
+def generate_mbox(path, messages=DEFAULT_MESSAGES, seed=0, mix=None, attachment_size=DEFAULT_ATTACHMENT_SIZE,
+                  nesting_depth=DEFAULT_NESTING_DEPTH):
+    """Write a synthetic MBOX file and return the number of messages of each kind."""
+    options = argparse.Namespace(attachment_size=attachment_size, nesting_depth=nesting_depth)
+    rng = random.Random(seed)
+    counts = dict.fromkeys(GENERATORS, 0)
+
+    with open(path, 'wb') as f:
+        for index, kind in enumerate(message_kinds(messages, mix or DEFAULT_MIX)):
+            date = START_DATE + datetime.timedelta(minutes=17 * index)
+            text = escape_from_lines(GENERATORS[kind](index, rng, options))
+            f.write(('From bench@example.com %s\n' % date.strftime('%a %b %d %H:%M:%S %Y')).encode('ascii'))
+            f.write(text.encode('utf-8', 'surrogateescape'))
+            f.write(b'\n')
+            counts[kind] += 1
+    return counts
+
+
+def parse_mix(value):
+    """Parse a KIND=WEIGHT,... message mix."""
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in GENERATORS:
+            raise argparse.ArgumentTypeError(f"Unknown message kind: {kind}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a deterministic synthetic MBOX file')
+    parser.add_argument('output', help='MBOX file to write')
+    parser.add_argument('-n', '--messages', type=int, default=DEFAULT_MESSAGES, help='Number of messages')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help='Share of each message kind, e.g. plain=50,multilingual=20,nested=15,'
+                             'attachment=10,malformed=5')
+    parser.add_argument('--attachment-size', type=int, default=DEFAULT_ATTACHMENT_SIZE,
+                        help='Size in bytes of each base64 attachment')
+    parser.add_argument('--nesting-depth', type=int, default=DEFAULT_NESTING_DEPTH,
+                        help='Depth of the nested multipart messages')
+    args = parser.parse_args()
+
+    counts = generate_mbox(args.output, args.messages, args.seed, args.mix, args.attachment_size, args.nesting_depth)
+    print(', '.join(f'{count} {kind}' for kind, count in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Startup benchmark of the MBOX converter.
+
+Measures, each in fresh interpreter processes, the time to import the command line
+module and the library package, and the wall time of `--help` and of converting a small
+MBOX file, which is what dominates runs over many small per-user mailboxes. Importing
+must not load any of HEAVY_MODULES; they are only loaded by the code paths that need
+them. The script exits with status 1 when a heavy module is loaded at import or, with
+--max-import-ms, when an import is slower than the limit, so it can guard against
+startup regressions.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+SRC_DIR = os.path.join(REPO_DIR, 'src')
+
+from generate_mbox import generate_mbox  # noqa: E402
+
+# Modules that must not be loaded just by importing the converter
+HEAVY_MODULES = ('pandas', 'alive_progress', 'charset_normalizer', 'pyarrow', 'multiprocessing', 'cProfile', 'pstats')
+
+# Code run in a fresh interpreter: time one import and report which heavy modules it loaded
+IMPORT_PROBE = '''
+import json, sys, time
+sys.path.insert(0, {path!r})
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+IMPORTS = {
+    'cli': (SRC_DIR, 'main'),
+    'library': (REPO_DIR, 'src'),
+}
+
+
+def time_import(path, module, runs):
+    timings = []
+    heavy = set()
+    for _ in range(runs):
+        code = IMPORT_PROBE.format(path=path, module=module, heavy=HEAVY_MODULES)
+        output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        timings.append(result['seconds'])
+        heavy.update(result['heavy'])
+    return timings, sorted(heavy)
+
+
+def time_command(command, runs, cwd):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, check=True, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def slowest_imports(path, module, count):
+    """Returns the modules with the largest cumulative import time, from python -X importtime."""
+    code = f'import sys; sys.path.insert(0, {path!r}); import {module}'
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            check=True, capture_output=True, text=True).stderr
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        entries.append((int(cumulative), name.strip()))
+    return [{'module': name, 'cumulative_ms': micros / 1000} for micros, name in sorted(entries, reverse=True)[:count]]
+
+
+def summarize(timings):
+    return {
+        'median_ms': statistics.median(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'max_ms': max(timings) * 1000,
+        'runs': len(timings),
+    }
+
+
+def parse_options(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of the MBOX converter')
+    parser.add_argument('-r', '--runs', type=int, default=10, help='Fresh processes per measurement (default: 10)')
+    parser.add_argument('-n', '--messages', type=int, default=20,
+                        help='Messages of the small MBOX file converted end to end (default: 20)')
+    parser.add_argument('--top', type=int, default=15, help='Slowest imports to list (default: 15)')
+    parser.add_argument('--max-import-ms', type=float, default=None,
+                        help='Fail when the median time of an import exceeds this many milliseconds')
+    parser.add_argument('-o', '--output', default=None, help='Write the results to this JSON file')
+    return parser.parse_args(args)
+
+
+def main():
+    options = parse_options()
+    failures = []
+    results = {'python': sys.version.split()[0], 'imports': {}, 'commands': {}}
+
+    for name, (path, module) in IMPORTS.items():
+        timings, heavy = time_import(path, module, options.runs)
+        results['imports'][name] = dict(summarize(timings), heavy_modules=heavy,
+                                        slowest=slowest_imports(path, module, options.top))
+        print(f'import {module:<5} ({name}): {results["imports"][name]["median_ms"]:.1f}ms median')
+        if heavy:
+            failures.append(f'importing {module} loads {", ".join(heavy)}')
+        if options.max_import_ms is not None and results['imports'][name]['median_ms'] > options.max_import_ms:
+            failures.append(f'importing {module} takes {results["imports"][name]["median_ms"]:.1f}ms '
+                            f'(limit {options.max_import_ms}ms)')
+
+    with tempfile.TemporaryDirectory(prefix='mbox-startup-') as workdir:
+        mbox = os.path.join(workdir, 'small.mbox')
+        generate_mbox(mbox, options.messages, attachment_size=4096)
+        main_py = os.path.join(SRC_DIR, 'main.py')
+        commands = {
+            'help': [sys.executable, main_py, '--help'],
+            'convert_ndjson': [sys.executable, main_py, mbox, '-f', 'ndjson', '-o', os.path.join(workdir, 'out.ndjson')],
+            'convert_json': [sys.executable, main_py, mbox, '-o', os.path.join(workdir, 'out.json')],
+        }
+        for name, command in commands.items():
+            results['commands'][name] = summarize(time_command(command, options.runs, workdir))
+            print(f'{name:<15} {results["commands"][name]["median_ms"]:.1f}ms median')
+
+    print('\nSlowest imports of main:')
+    for entry in results['imports']['cli']['slowest']:
+        print(f'  {entry["cumulative_ms"]:8.1f}ms  {entry["module"]}')
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved results to {options.output}')
+
+    for failure in failures:
+        print(f'FAIL: {failure}', file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+"""Per-stage benchmarks of the MBOX converter.
+
+Every stage runs in a fresh process, so that its peak RSS is not inflated by earlier
+stages. The input is parsed and prepared before the timer starts, so each figure only
+covers its own stage:
+
+    scan         splitting the MBOX file into raw messages (see --reader)
+    parse        parsing raw messages into email.message.Message objects
+    headers      decoding the MIME encoded headers of every message
+    body         extracting and decoding the text body of every message
+    attachments  extracting attachments to disk
+    serialize    writing the records to the output format (see --format)
+    convert      the whole conversion, as run by main.py
+
+In parallel mode the stages run on message-aligned shards of the file in separate
+worker processes that start their timed section together; `convert` uses the
+--workers option of main.py instead. Results are written as JSON and can be compared
+with an earlier run with --compare.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing as mp
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), 'src'))
+
+from generate_mbox import DEFAULT_ATTACHMENT_SIZE, DEFAULT_MESSAGES, DEFAULT_NESTING_DEPTH, generate_mbox  # noqa: E402
+
+STAGE_NAMES = ('scan', 'parse', 'headers', 'body', 'attachments', 'serialize', 'convert')
+
+MODES = ('serial', 'parallel')
+
+SERIALIZE_FORMATS = ('json', 'ndjson', 'csv')
+
+
+def peak_rss_mb():
+    """Peak resident set size in MB of this process or its largest finished child, None when unknown."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def read_messages(path, start, end):
+    from scanner import scan_mbox
+    # Memory-mapped messages are only valid until the next one is read
+    return [bytes(raw) for _, _, raw in scan_mbox(path, start, end)]
+
+
+def prepare_scan(path, start, end, options):
+    from scanner import scan_mbox
+
+    def run():
+        messages = 0
+        for _ in scan_mbox(path, start, end, reader=options.reader):
+            messages += 1
+        return messages, end - start
+    return run
+
+
+def prepare_parse(path, start, end, options):
+    from scanner import parse_message
+    raws = read_messages(path, start, end)
+
+    def run():
+        for raw in raws:
+            parse_message(raw)
+        return len(raws), sum(len(raw) for raw in raws)
+    return run
+
+
+def prepare_headers(path, start, end, options):
+    from records import decode_mime_header
+    from scanner import header_block, parse_headers
+    raws = read_messages(path, start, end)
+    headers = [parse_headers(raw) for raw in raws]
+    size = sum(len(header_block(raw)) for raw in raws)
+
+    def run():
+        for msg in headers:
+            for value in msg.values():
+                decode_mime_header(value)
+        return len(headers), size
+    return run
+
+
+def prepare_body(path, start, end, options):
+    from records import getBody
+    from scanner import parse_message
+    raws = read_messages(path, start, end)
+    messages = [parse_message(raw) for raw in raws]
+
+    def run():
+        for msg in messages:
+            getBody(msg, charset_detection=options.charset_detection)
+        return len(messages), sum(len(raw) for raw in raws)
+    return run
+
+
+def prepare_attachments(path, start, end, options):
+    import extract
+    from scanner import parse_message
+    raws = read_messages(path, start, end)
+    messages = [parse_message(raw) for raw in raws]
+    output = os.path.join(options.workdir, 'attachments', str(start), '')
+    extractor = extract.Extractor(extract.parse_options(['-i', path, '-o', output]))
+
+    def run():
+        for i, msg in enumerate(messages):
+            extract.process_message(extractor, i, msg)
+        extractor.save_extraction_map()
+        return len(messages), sum(len(raw) for raw in raws)
+    return run
+
+
+def prepare_serialize(path, start, end, options):
+    from records import message_to_record
+    from scanner import parse_message
+    from writers import create_writer
+    records = [
+        message_to_record(parse_message(raw), i, charset_detection=options.charset_detection)
+        for i, raw in enumerate(read_messages(path, start, end))
+    ]
+    output = os.path.join(options.workdir, f'serialize-{start}.{options.format}')
+
+    def run():
+        writer = create_writer(output, options.format, stream=True)
+        for i, record in enumerate(records):
+            writer.write(i, record)
+        writer.close()
+        return len(records), os.path.getsize(output)
+    return run
+
+
+def prepare_convert(path, start, end, options):
+    import main as converter
+    output = os.path.join(options.workdir, f'convert.{options.format}')
+    argv = ['main.py', path, '-o', output, '-f', options.format, '--checkpoint-every', '0']
+    if options.mode == 'parallel':
+        argv += ['--workers', str(options.workers), '--enable-parallel']
+
+    def run():
+        saved_argv = sys.argv
+        sys.argv = argv
+        try:
+            converter.main()
+        finally:
+            sys.argv = saved_argv
+        return options.messages, end - start
+    return run
+
+
+STAGES = {
+    'scan': prepare_scan,
+    'parse': prepare_parse,
+    'headers': prepare_headers,
+    'body': prepare_body,
+    'attachments': prepare_attachments,
+    'serialize': prepare_serialize,
+    'convert': prepare_convert,
+}
+
+# Stages that run their own worker processes in parallel mode
+SELF_PARALLEL = ('convert',)
+
+
+def run_shard(stage, path, start, end, options, barrier=None):
+    """Prepare a stage for a byte range of the input, then time it."""
+    run = STAGES[stage](path, start, end, options)
+    baseline = peak_rss_mb()
+    if barrier is not None:
+        barrier.wait()
+    started = time.perf_counter()
+    messages, size = run()
+    seconds = time.perf_counter() - started
+    return {
+        'seconds': seconds,
+        'messages': messages,
+        'bytes': size,
+        'peak_rss_mb': peak_rss_mb(),
+        'baseline_rss_mb': baseline,
+    }
+
+
+def shard_process(stage, path, start, end, options, barrier, results):
+    results.put(run_shard(stage, path, start, end, options, barrier))
+
+
+def run_parallel(stage, path, size, options):
+    """Run a stage on one shard per worker process and combine their results."""
+    from scanner import compute_shards
+    shards = compute_shards(path, options.workers)
+    barrier = mp.Barrier(len(shards))
+    results = mp.Queue()
+    processes = [
+        mp.Process(target=shard_process, args=(stage, path, start, end, options, barrier, results))
+        for start, end in shards
+    ]
+    for process in processes:
+        process.start()
+    shard_results = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Worker process failed with exit code {process.exitcode}")
+
+    def largest(key):
+        values = [result[key] for result in shard_results if result[key] is not None]
+        return max(values) if values else None
+
+    # Workers start timing together, so the slowest one gives the wall time
+    return {
+        'seconds': max(result['seconds'] for result in shard_results),
+        'messages': sum(result['messages'] for result in shard_results),
+        'bytes': sum(result['bytes'] for result in shard_results),
+        'peak_rss_mb': largest('peak_rss_mb'),
+        'baseline_rss_mb': largest('baseline_rss_mb'),
+        'processes': len(shards),
+    }
+
+
+def run_stage(options):
+    """Entry point of the per-stage subprocess."""
+    size = os.path.getsize(options.input)
+    if options.mode == 'parallel' and options.stage not in SELF_PARALLEL:
+        result = run_parallel(options.stage, options.input, size, options)
+    else:
+        result = run_shard(options.stage, options.input, 0, size, options)
+    seconds = result['seconds']
+    result['msgs_per_s'] = result['messages'] / seconds if seconds else None
+    result['mb_per_s'] = result['bytes'] / (1024 * 1024) / seconds if seconds else None
+    with open(options.result_file, 'w') as f:
+        json.dump(result, f)
+
+
+def count_messages(path):
+    from scanner import scan_mbox
+    return sum(1 for _ in scan_mbox(path))
+
+
+def benchmark(options, path, workdir, messages):
+    """Run every selected stage in every selected mode in its own subprocess."""
+    results = {}
+    for stage in options.stages:
+        results[stage] = {}
+        for mode in options.modes:
+            result_file = os.path.join(workdir, f'{stage}-{mode}.json')
+            command = [
+                sys.executable, os.path.abspath(__file__), '--run-stage', stage, '--mode', mode,
+                '--input', path, '--result-file', result_file, '--workdir', workdir,
+                '--workers', str(options.workers), '--format', options.format,
+                '--charset-detection', options.charset_detection, '--messages-count', str(messages),
+                '--reader', options.reader,
+            ]
+            # The converter logs every message to stdout
+            completed = subprocess.run(command, cwd=workdir, stdout=subprocess.DEVNULL)
+            if completed.returncode != 0:
+                results[stage][mode] = {'error': f'exit code {completed.returncode}'}
+            else:
+                with open(result_file) as f:
+                    results[stage][mode] = json.load(f)
+            print(format_row(stage, mode, results[stage][mode]), flush=True)
+    return results
+
+
+def format_value(value, digits=1):
+    return '-' if value is None else f'{value:,.{digits}f}'
+
+
+def format_row(stage, mode, result):
+    if 'error' in result:
+        return f'{stage:<12} {mode:<9} failed: {result["error"]}'
+    return (
+        f'{stage:<12} {mode:<9} {format_value(result["seconds"], 3):>10} {format_value(result["msgs_per_s"]):>12} '
+        f'{format_value(result["mb_per_s"]):>10} {format_value(result["peak_rss_mb"]):>10}'
+    )
+
+
+def compare(current, previous):
+    """Print the throughput of this run relative to an earlier one."""
+    print(f'\n{"stage":<12} {"mode":<9} {"msgs/s":>12} {"previous":>12} {"change":>8}')
+    for stage, modes in current['results'].items():
+        for mode, result in modes.items():
+            before = previous.get('results', {}).get(stage, {}).get(mode)
+            if not before or 'error' in result or 'error' in before:
+                continue
+            change = result['msgs_per_s'] / before['msgs_per_s'] if before['msgs_per_s'] else None
+            print(
+                f'{stage:<12} {mode:<9} {format_value(result["msgs_per_s"]):>12} '
+                f'{format_value(before["msgs_per_s"]):>12} {format_value(change, 2):>7}x'
+            )
+
+
+def parse_list(choices):
+    def parse(value):
+        items = tuple(item.strip() for item in value.split(',') if item.strip())
+        unknown = [item for item in items if item not in choices]
+        if unknown or not items:
+            raise argparse.ArgumentTypeError(f"Expected a comma separated list of {', '.join(choices)}")
+        return items
+    return parse
+
+
+def parse_options(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the MBOX converter')
+    parser.add_argument('-i', '--input', default=None,
+                        help='MBOX file to benchmark (default: generate a synthetic one)')
+    parser.add_argument('-n', '--messages', type=int, default=DEFAULT_MESSAGES,
+                        help='Number of messages of the generated MBOX file')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated MBOX file')
+    parser.add_argument('--attachment-size', type=int, default=DEFAULT_ATTACHMENT_SIZE,
+                        help='Size in bytes of each attachment of the generated MBOX file')
+    parser.add_argument('--nesting-depth', type=int, default=DEFAULT_NESTING_DEPTH,
+                        help='Multipart nesting depth of the generated MBOX file')
+    parser.add_argument('--stages', type=parse_list(STAGE_NAMES), default=STAGE_NAMES,
+                        help=f"Comma separated stages to run (default: {','.join(STAGE_NAMES)})")
+    parser.add_argument('--modes', type=parse_list(MODES), default=MODES,
+                        help='Comma separated modes to run (default: serial,parallel)')
+    parser.add_argument('--workers', type=int, default=max(2, os.cpu_count() or 1),
+                        help='Worker processes in parallel mode (default: CPU count, at least 2)')
+    parser.add_argument('--format', choices=SERIALIZE_FORMATS, default='ndjson',
+                        help='Output format of the serialize and convert stages (default: ndjson)')
+    parser.add_argument('--charset-detection', default='auto', help='Charset detection policy (default: auto)')
+    parser.add_argument('--reader', choices=('mmap', 'stream'), default='mmap',
+                        help='How the scan stage reads the MBOX file (default: mmap)')
+    parser.add_argument('-o', '--output', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='Results JSON file of an earlier run to compare with')
+    parser.add_argument('--keep', action='store_true', help='Keep the working directory with the generated files')
+    # Used internally to run one stage in a subprocess
+    parser.add_argument('--run-stage', choices=STAGE_NAMES, help=argparse.SUPPRESS)
+    parser.add_argument('--mode', choices=MODES, default='serial', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--messages-count', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+def main():
+    options = parse_options()
+    if options.run_stage:
+        options.stage = options.run_stage
+        options.messages = options.messages_count
+        run_stage(options)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='mbox-bench-')
+    try:
+        generated = None
+        if options.input:
+            path = os.path.abspath(options.input)
+        else:
+            path = os.path.join(workdir, 'bench.mbox')
+            kinds = generate_mbox(path, options.messages, options.seed, attachment_size=options.attachment_size,
+                                  nesting_depth=options.nesting_depth)
+            generated = {
+                'seed': options.seed,
+                'attachment_size': options.attachment_size,
+                'nesting_depth': options.nesting_depth,
+                'kinds': kinds,
+            }
+
+        messages = count_messages(path)
+        size = os.path.getsize(path)
+        print(f'Input: {path} ({messages} messages, {size / (1024 * 1024):.1f}MB), {options.workers} workers')
+        print(f'{"stage":<12} {"mode":<9} {"seconds":>10} {"msgs/s":>12} {"MB/s":>10} {"peak MB":>10}')
+
+        results = {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'workers': options.workers,
+            'format': options.format,
+            'input': {
+                'path': options.input,
+                'bytes': size,
+                'messages': messages,
+                'generated': generated,
+            },
+            'results': benchmark(options, path, workdir, messages),
+        }
+    finally:
+        if options.keep:
+            print(f'Working directory: {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved results to {options.output}')
+
+    if options.compare:
+        with open(options.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import logging
+
+from .filters import MessageFilter
+from .records import BODY_FIELDS, iter_records
+
+__all__ = ['BODY_FIELDS', 'MessageFilter', 'iter_records']
+
+# Log records are left to the embedding application's logging configuration
+logging.getLogger(__name__).addHandler(logging.NullHandler())
@@ -0,0 +1,142 @@
+"""Finds and schedules the inputs of a batch run over many MBOX files and Maildir folders."""
+import glob
+import json
+import logging
+import os
+
+try:
+    from .compression import open_input, split_compression_suffix
+    from .scanner import FROM_LINE, MAILDIR_FOLDERS, is_maildir, maildir_size
+except ImportError:
+    from compression import open_input, split_compression_suffix
+    from scanner import FROM_LINE, MAILDIR_FOLDERS, is_maildir, maildir_size
+
+logger = logging.getLogger(__name__)
+
+# Name of the run summary written to the output folder of a batch run
+SUMMARY_NAME = 'batch_summary.json'
+
+# Maildir subfolders that are part of the Maildir itself rather than folders of their own
+MAILDIR_PARTS = MAILDIR_FOLDERS + ('tmp',)
+
+GLOB_CHARACTERS = '*?['
+
+
+def is_pattern(path):
+    return any(character in path for character in GLOB_CHARACTERS)
+
+
+def is_batch(paths):
+    """A run is a batch run unless it has exactly one input that is a file or a Maildir folder."""
+    if len(paths) != 1:
+        return True
+    path = paths[0]
+    return (is_pattern(path) and not os.path.exists(path)) or (os.path.isdir(path) and not is_maildir(path))
+
+
+def is_mbox_file(path):
+    """Checks whether a file starts with a "From " line, after decompressing it if needed."""
+    try:
+        with open_input(path) as f:
+            return f.read(len(FROM_LINE)) == FROM_LINE
+    except (OSError, EOFError, ValueError):
+        return False
+
+
+def walk_inputs(directory):
+    """Yield the MBOX files and Maildir folders in a directory tree, in name order.
+
+    Maildir++ folders, the dot-named Maildirs inside a Maildir, are inputs of their own.
+    Hidden files and files that do not look like MBOX files, such as earlier outputs,
+    are left out.
+    """
+    for current, folders, files in os.walk(directory):
+        folders.sort()
+        if is_maildir(current):
+            yield current
+            folders[:] = [folder for folder in folders if folder not in MAILDIR_PARTS]
+            continue
+        for name in sorted(files):
+            path = os.path.join(current, name)
+            if not name.startswith('.') and is_mbox_file(path):
+                yield path
+
+
+def find_inputs(paths):
+    """Expand files, directories, glob patterns and Maildir folders into (input, root) pairs.
+
+    `root` is the folder the input was found in, whose layout is kept below the output
+    folder of the batch run.
+    """
+    inputs = []
+    seen = set()
+    for argument in paths:
+        if is_pattern(argument) and not os.path.exists(argument):
+            matches = sorted(glob.glob(argument, recursive=True))
+            if not matches:
+                logger.warning(f"No input matches {argument}")
+        else:
+            matches = [argument]
+        for match in matches:
+            if os.path.isdir(match) and not is_maildir(match):
+                found = [(path, match) for path in walk_inputs(match)]
+            elif os.path.isfile(match) and not is_mbox_file(match) and is_pattern(argument):
+                # Patterns such as "mail/*" also match files that are not MBOX files
+                continue
+            else:
+                found = [(match, os.path.dirname(match))]
+            for path, root in found:
+                key = os.path.abspath(path)
+                if key not in seen:
+                    seen.add(key)
+                    inputs.append((path, root))
+    return inputs
+
+
+def output_name(path, fmt):
+    """The output file name of an input: its name without compression suffix and extension, with `fmt`'s."""
+    name, _ = split_compression_suffix(os.path.normpath(path))
+    return os.path.splitext(name)[0] + '.' + fmt
+
+
+def batch_outputs(inputs, output_folder, fmt):
+    """Map every input to its output path.
+
+    Outputs are written next to their input, or below `output_folder` at the input's
+    path relative to its root. Raises ValueError when two inputs would share an output.
+    """
+    outputs = {}
+    sources = {}
+    for path, root in inputs:
+        if output_folder is None:
+            output = output_name(path, fmt)
+        else:
+            output = os.path.join(output_folder, output_name(os.path.relpath(path, root or os.curdir), fmt))
+        if output in sources:
+            raise ValueError(f"{sources[output]} and {path} would both be written to {output}")
+        sources[output] = path
+        outputs[path] = output
+    return outputs
+
+
+def input_bytes(path):
+    """Returns the size of an input on disk, which the scheduler uses as its cost."""
+    try:
+        return maildir_size(path) if os.path.isdir(path) else os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def schedule(paths):
+    """Order inputs largest first with their sizes.
+
+    Handing the largest remaining input to the next idle worker (longest processing
+    time first) keeps a big file from starting last and leaving the other workers idle.
+    """
+    return sorted(((path, input_bytes(path)) for path in paths), key=lambda item: -item[1])
+
+
+def save_summary(path, summary):
+    """Write the JSON summary of a batch run."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
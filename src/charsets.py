@@ -0,0 +1,142 @@
+import codecs
+import logging
+from collections import OrderedDict
+from email.utils import parseaddr
+
+try:
+    from .stats import get_stats
+except ImportError:
+    from stats import get_stats
+
+logger = logging.getLogger(__name__)
+
+# Charset detection policies selectable from the command line:
+#   auto   - trust the declared charset, then UTF-8, and only detect when both fail
+#   always - run charset detection on every text part
+#   never  - never run charset detection, fall back to UTF-8 with replacement characters
+DETECTION_POLICIES = ('auto', 'always', 'never')
+
+# Number of bytes handed to charset-normalizer when detection is needed
+DEFAULT_DETECTION_SAMPLE_SIZE = 64 * 1024
+
+# Number of detection results remembered per process
+DEFAULT_CACHE_SIZE = 1024
+
+
+def normalize_charset(charset):
+    """Return the canonical codec name for a declared charset, or None if Python doesn't know it."""
+    if not charset:
+        return None
+    try:
+        return codecs.lookup(charset.strip().strip('"\'')).name
+    except (LookupError, ValueError):
+        return None
+
+
+def sender_domain(msg):
+    """Return the lower-cased domain of the message sender, used as a detection cache hint."""
+    try:
+        address = parseaddr(str(msg.get('From', '')))[1]
+    except Exception:
+        return None
+    _, _, domain = address.rpartition('@')
+    return domain.lower() or None
+
+
+class PayloadDecoder:
+    """Decodes text payloads, running charset detection only when cheaper checks fail."""
+
+    def __init__(self, policy='auto', sample_size=DEFAULT_DETECTION_SAMPLE_SIZE, cache_size=DEFAULT_CACHE_SIZE):
+        if policy not in DETECTION_POLICIES:
+            raise ValueError(f"Unknown charset detection policy: {policy}")
+        self.policy = policy
+        self.sample_size = sample_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def decode(self, raw_payload, declared_charset=None, hint=None):
+        """Decode a payload to text.
+
+        `declared_charset` is the charset the part declares and `hint` is an extra cache
+        key, such as the sender domain, under which detection results are remembered.
+        """
+        if raw_payload is None:
+            return ""
+
+        if self.policy == 'always':
+            return self._decode_detected(raw_payload)
+
+        # Tier 1: the declared charset, strictly
+        declared = normalize_charset(declared_charset)
+        if declared:
+            try:
+                return raw_payload.decode(declared)
+            except (UnicodeDecodeError, LookupError):
+                pass
+
+        # Tier 2: ASCII / UTF-8 validation
+        if raw_payload.isascii():
+            return raw_payload.decode('ascii')
+        try:
+            return raw_payload.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+
+        if self.policy == 'never':
+            return raw_payload.decode('utf-8', errors='replace')
+
+        # Tier 3: a charset detected earlier for the same sender and declared charset
+        cache_key = (hint, declared)
+        cached = self.cache.get(cache_key)
+        if cached:
+            try:
+                text = raw_payload.decode(cached)
+                self.cache.move_to_end(cache_key)
+                get_stats().count('charset_cache_hits')
+                return text
+            except (UnicodeDecodeError, LookupError):
+                pass
+
+        # Tier 4: detection on a bounded sample
+        detected_encoding = self.detect(raw_payload)
+        if detected_encoding:
+            self.cache[cache_key] = detected_encoding
+            self.cache.move_to_end(cache_key)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return self._decode_with(raw_payload, detected_encoding)
+
+    def detect(self, raw_payload):
+        """Detect the encoding of a payload from its first `sample_size` bytes."""
+        try:
+            # charset-normalizer is slow to import and most runs never need to detect an encoding
+            from charset_normalizer import from_bytes
+
+            with get_stats().timer('charset_detection'):
+                best = from_bytes(raw_payload[:self.sample_size]).best()
+            return best.encoding if best else None
+        except Exception as e:
+            logger.warning(f"Encoding detection failed: {e}")
+            return None
+
+    def _decode_detected(self, raw_payload):
+        return self._decode_with(raw_payload, self.detect(raw_payload))
+
+    def _decode_with(self, raw_payload, encoding):
+        if encoding:
+            try:
+                return raw_payload.decode(encoding, errors='replace')
+            except (UnicodeDecodeError, LookupError, TypeError) as e:
+                logger.warning(f"Failed to decode with {encoding}, error: {e}")
+        return raw_payload.decode('utf-8', errors='replace')
+
+
+_decoders = {}
+
+
+def get_decoder(policy='auto'):
+    """Return the process-wide decoder for a policy, so its detection cache is shared by all messages."""
+    decoder = _decoders.get(policy)
+    if decoder is None:
+        decoder = _decoders[policy] = PayloadDecoder(policy)
+    return decoder
@@ -0,0 +1,43 @@
+import datetime
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SUFFIX = '.checkpoint.json'
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(output):
+    """Returns the path of the checkpoint file kept next to an output file."""
+    return output + CHECKPOINT_SUFFIX
+
+
+def load_checkpoint(output):
+    """Load the checkpoint of a previous run, or None when there is none."""
+    path = checkpoint_path(output)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        logger.warning(f"Ignoring checkpoint {path} written by an incompatible version")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(output, checkpoint):
+    """Atomically replace the checkpoint next to an output file."""
+    checkpoint = dict(checkpoint, version=CHECKPOINT_VERSION, updated=datetime.datetime.now().isoformat())
+    path = checkpoint_path(output)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,149 @@
+import bz2
+import gzip
+import io
+import lzma
+import queue
+import threading
+import zlib
+
+# Compression formats of MBOX inputs and of JSON/NDJSON/CSV outputs
+COMPRESSION_FORMATS = ('gzip', 'bz2', 'xz')
+
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+# Leading bytes that identify each compression format
+MAGIC_BYTES = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+)
+
+# Amount of output collected before it is handed to the compression thread
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Blocks waiting for the compression thread before writers block
+DEFAULT_QUEUE_SIZE = 8
+
+
+def detect_compression(path):
+    """Returns the compression format of a file from its magic bytes, or None when it is not compressed."""
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, compression in MAGIC_BYTES:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def decompressing_reader(raw, compression):
+    """Wrap an open binary file in a reader that decompresses it on the fly."""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(raw, mode='rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(raw, mode='rb')
+    return raw
+
+
+def open_input(path):
+    """Open an MBOX file for binary reading, decompressing it when it is compressed."""
+    return decompressing_reader(open(path, 'rb'), detect_compression(path))
+
+
+def split_compression_suffix(path):
+    """Split a path into its name and compression suffix, e.g. ("out.json", ".gz")."""
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if path.endswith(suffix):
+            return path[:-len(suffix)], suffix
+    return path, ''
+
+
+def compression_from_path(path):
+    """Returns the compression format implied by the suffix of an output path."""
+    _, suffix = split_compression_suffix(path)
+    for compression, compression_suffix in COMPRESSION_SUFFIXES.items():
+        if suffix == compression_suffix:
+            return compression
+    return None
+
+
+def new_compressor(compression):
+    if compression == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == 'bz2':
+        return bz2.BZ2Compressor()
+    if compression == 'xz':
+        return lzma.LZMACompressor(format=lzma.FORMAT_XZ)
+    raise ValueError(f"Unknown compression format: {compression}")
+
+
+class CompressingWriter(io.BufferedIOBase):
+    """A binary output file whose content is compressed on a background thread.
+
+    Writes are collected into blocks of `block_size` bytes, and at most `queue_size`
+    blocks wait for the compression thread, so compression overlaps parsing without
+    unbounded buffering.
+    """
+
+    def __init__(self, path, compression, block_size=DEFAULT_BLOCK_SIZE, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__()
+        self.path = path
+        self.compressor = new_compressor(compression)
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.raw = open(path, 'wb')
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._raise_error()
+        self.buffer += data
+        if len(self.buffer) >= self.block_size:
+            self.queue.put(bytes(self.buffer))
+            self.buffer = bytearray()
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer:
+                self.queue.put(bytes(self.buffer))
+                self.buffer = bytearray()
+            self.queue.put(None)
+            self.thread.join()
+            self.raw.close()
+        finally:
+            super().close()
+        self._raise_error()
+
+    def _run(self):
+        try:
+            while True:
+                block = self.queue.get()
+                if block is None:
+                    self.raw.write(self.compressor.flush())
+                    return
+                self.raw.write(self.compressor.compress(block))
+        except BaseException as e:
+            self.error = e
+            # Keep consuming, so that writers never block on a full queue
+            while self.queue.get() is not None:
+                pass
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise OSError(f"Failed to write {self.path}: {self.error}") from self.error
+
+
+def open_output(path, compression=None):
+    """Open an output file for binary writing, compressing it on a background thread when requested."""
+    if compression:
+        return CompressingWriter(path, compression)
+    return open(path, 'wb')
@@ -0,0 +1,196 @@
+"""Identifies repeated messages and reconstructs threads in a single pass over an MBOX file.
+
+Both work from the header block of each message, before its body is parsed, and keep a
+bounded number of keys in memory: the rest spill to a temporary SQLite file, so merged
+exports of any size can be processed.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+from collections import namedtuple
+
+try:
+    from .scanner import header_block
+except ImportError:
+    from scanner import header_block
+
+# Keys kept in memory per map before they are moved to disk
+DEFAULT_MEMORY_KEYS = 1000000
+
+# Headers that, with the body, identify a message that has no Message-ID
+CONTENT_HEADERS = ('Date', 'From', 'To', 'Cc', 'Subject')
+
+MESSAGE_ID = re.compile(r'<[^<>]+>')
+
+_MISSING = object()
+
+# `key` identifies the message for deduplication, `message_id` and `references` (oldest
+# first, ending with the parent) place it in its thread. `duplicate` tells whether the
+# tracker that identified the message had seen its key before.
+MessageIdentity = namedtuple('MessageIdentity', 'key message_id references duplicate')
+
+
+class SpillingMap:
+    """A mapping of bytes keys that keeps at most `memory_keys` entries in memory.
+
+    When the limit is exceeded all in-memory entries are moved to a temporary SQLite
+    file, which is deleted by close().
+    """
+
+    def __init__(self, memory_keys=DEFAULT_MEMORY_KEYS):
+        self.memory_keys = memory_keys
+        self.memory = {}
+        self.connection = None
+        self.path = None
+        self.spilled = 0
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.connection is not None:
+            row = self.connection.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                return row[0]
+        return default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key, value):
+        self.memory[key] = value
+        if len(self.memory) > self.memory_keys:
+            self.spill()
+
+    def spill(self):
+        if self.connection is None:
+            fd, self.path = tempfile.mkstemp(prefix='mbox-keys-', suffix='.sqlite')
+            os.close(fd)
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute('PRAGMA journal_mode = OFF')
+            self.connection.execute('PRAGMA synchronous = OFF')
+            self.connection.execute('CREATE TABLE entries (key BLOB PRIMARY KEY, value) WITHOUT ROWID')
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?)', self.memory.items())
+        self.spilled += len(self.memory)
+        self.memory.clear()
+
+    def close(self):
+        self.memory.clear()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+            os.remove(self.path)
+
+
+def _digest(*parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.digest()
+
+
+def _text(value):
+    return str(value).encode('utf-8', 'surrogateescape')
+
+
+def message_ids(value):
+    """Return the <...> message ids in a Message-ID, In-Reply-To or References header value."""
+    if value is None:
+        return []
+    value = str(value)
+    ids = MESSAGE_ID.findall(value)
+    if not ids and value.strip():
+        # Some mailers leave out the angle brackets
+        ids = ['<' + value.strip() + '>']
+    return ids
+
+
+def message_key(headers, raw):
+    """Return the deduplication key of a message: its Message-ID, or a hash of its content without one.
+
+    The content hash covers CONTENT_HEADERS and the body, but not the From_ line and
+    trace headers such as Received, which differ between copies of the same message
+    exported from different accounts.
+    """
+    ids = message_ids(headers.get('Message-ID'))
+    if ids:
+        return _digest(b'id', _text(ids[0]))
+    body = raw[len(header_block(raw)):]
+    # Trailing line breaks depend on how the copy was exported
+    end = len(body)
+    while end and body[end - 1] in b'\r\n':
+        end -= 1
+    return _digest(b'content', *(_text(headers.get(name, '')) for name in CONTENT_HEADERS), body[:end])
+
+
+def thread_references(headers):
+    """Return the Message-ID of a message and the ids it replies to, oldest first."""
+    ids = message_ids(headers.get('Message-ID'))
+    references = message_ids(headers.get('References'))
+    for parent in message_ids(headers.get('In-Reply-To')):
+        if parent not in references:
+            references.append(parent)
+    return (ids[0] if ids else None), tuple(references)
+
+
+class MessageTracker:
+    """Drops repeated messages with `dedup` and assigns thread ids with `threads`.
+
+    identify() is called in file order on the header block of each message. Its first
+    copy is kept; every later message with the same message_key() is a duplicate. A
+    message's thread id is the Message-ID of the first message of its thread. It is
+    taken from the earliest id in References, so replies get the same thread id
+    whether or not the root message was seen before them. Records already written are
+    never revisited, so a reply that comes before its parent and lacks References may
+    start a thread of its own.
+    """
+
+    def __init__(self, dedup=False, threads=False, memory_keys=DEFAULT_MEMORY_KEYS):
+        self.dedup = dedup
+        self.threads = threads
+        self.memory_keys = memory_keys
+        self.seen = SpillingMap(memory_keys) if dedup else None
+        self.thread_ids = None
+
+    def identify(self, headers, raw):
+        key = message_key(headers, raw) if self.dedup else None
+        message_id, references = thread_references(headers) if self.threads else (None, ())
+        return MessageIdentity(key, message_id, references, self.dedup and self.seen_before(key))
+
+    def seen_before(self, key):
+        """Record `key` and return whether it was recorded before."""
+        if key in self.seen:
+            return True
+        self.seen[key] = True
+        return False
+
+    def is_duplicate(self, identity):
+        """Return whether a message identified by a shard-local tracker is a duplicate within the whole file."""
+        return identity.duplicate or (self.dedup and self.seen_before(identity.key))
+
+    def thread_id(self, identity):
+        if self.thread_ids is None:
+            self.thread_ids = SpillingMap(self.memory_keys)
+        ids = ((identity.message_id,) if identity.message_id else ()) + identity.references
+        keys = [_digest(b'id', _text(message_id)) for message_id in ids]
+        thread = None
+        for key in keys:
+            thread = self.thread_ids.get(key)
+            if thread is not None:
+                break
+        if thread is None:
+            thread = identity.references[0] if identity.references else identity.message_id
+        if thread is not None:
+            for key in keys:
+                if key not in self.thread_ids:
+                    self.thread_ids[key] = thread
+        return thread
+
+    def close(self):
+        for keys in (self.seen, self.thread_ids):
+            if keys is not None:
+                keys.close()
@@ -1,27 +1,48 @@
 import errno
-import mailbox
 import os
 import pathlib  # since Python 3.4
 import re
 import traceback
 import logging
 import sys
+import json
+import queue
+import shutil
+import tempfile
+import threading
 from email.header import decode_header
-from alive_progress import alive_bar
 import argparse
 
-# Configure logging for extract module
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('mbox_extract.log', mode='a')
-    ]
-)
+try:
+    from .scanner import scan_mbox, parse_message
+    from .compression import detect_compression
+    from .mbox_index import load_index
+    from .writers import LazyJsonArrayWriter
+    from .payloads import write_payload
+    from .stats import get_stats
+except ImportError:
+    from scanner import scan_mbox, parse_message
+    from compression import detect_compression
+    from mbox_index import load_index
+    from writers import LazyJsonArrayWriter
+    from payloads import write_payload
+    from stats import get_stats
+
 logger = logging.getLogger(__name__)
 
 
+def configure_logging():
+    """Configure logging when extract.py is run on its own."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler('mbox_extract.log', mode='a')
+        ]
+    )
+
+
 def parse_options(args=[]):
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-i', '--input', default='all.mbox', help='Input file')
@@ -33,9 +54,25 @@ def parse_options(args=[]):
     parser.add_argument('--stop',
                         type=message_id_type, default=100000000000,
                         help='On which message to stop, not included')
+    parser.add_argument('--index', action='store_true',
+                        help='Use a sidecar offset index (<input>.idx) to seek straight to --start')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Store each unique attachment once under its SHA-256 digest in a "blobs" folder')
+    parser.add_argument('--writer-threads', type=int, default=0,
+                        help='Number of background threads writing attachments while parsing continues '
+                             '(0 writes them synchronously)')
+    parser.add_argument('--writer-queue-size', type=int, default=DEFAULT_WRITER_QUEUE_SIZE,
+                        help='Maximum number of attachments waiting for a writer thread')
+    parser.add_argument('--consolidated-metadata', action='store_true',
+                        help='Write the metadata of all attachments to one metadata.json instead of a '
+                             '.metadata.json file next to each attachment')
     return parser.parse_args(args)
 
 
+# Attachments waiting for a writer thread before parsing blocks
+DEFAULT_WRITER_QUEUE_SIZE = 64
+
+
 def message_id_type(arg):
     try:
         i = int(arg)
@@ -47,28 +84,85 @@ def message_id_type(arg):
 
 
 class Extractor:
-    def __init__(self, options):
+    def __init__(self, options, defer_metadata=False):
         self.__total = 0
         self.__failed = 0
         self.__extraction_map = []  # Track all extractions
+        self.__pending_metadata = []  # Metadata files not written yet when deferred
+        self.__map_writer = None  # Set when the extraction map is streamed to disk
+        self.__metadata_writer = None  # Set when metadata goes to one consolidated file
+        self.__blob_stats = {'references': 0, 'unique': 0, 'bytes_referenced': 0, 'bytes_stored': 0}
+        self.__kept_blobs = set()  # Digests referenced by the messages merged from parallel workers
+        self.__dropped_blobs = {}  # Blobs stored for messages the parent dropped, by digest
+        self.__writers = None  # Set when attachments are written by background threads
 
-        self.options = options
+        # Guards the counters, the extraction map and the metadata against concurrent writer threads
+        self.lock = threading.Lock()
 
-        assert os.path.isfile(options.input)
-        self.mbox = mailbox.mbox(options.input)
+        self.options = options
+        self.defer_metadata = defer_metadata
+        # Parallel workers share the blob store of the final output folder
+        self.blob_folder = getattr(options, 'blob_folder', None) or os.path.join(options.output, BLOB_FOLDER)
 
         if not os.path.exists(options.output):
             os.makedirs(options.output)
+
+        if getattr(options, 'consolidated_metadata', False) and not defer_metadata:
+            self.stream_metadata()
+
+        if getattr(options, 'writer_threads', 0) > 0:
+            self.__writers = AttachmentWriterPool(self, options.writer_threads, options.writer_queue_size)
  
         self.inline_image_folder = os.path.join(options.output, 'inline_images/')
         if (not options.no_inline_images) and (not os.path.exists(self.inline_image_folder)):
             os.makedirs(self.inline_image_folder)
 
-    def increment_total(self):
-        self.__total += 1
+    def increment_total(self, count=1):
+        self.__total += count
+
+    def increment_failed(self, count=1):
+        with self.lock:
+            self.__failed += count
+
+    def add_blob_reference(self, size, stored):
+        with self.lock:
+            self.__blob_stats['references'] += 1
+            self.__blob_stats['bytes_referenced'] += size
+            if stored:
+                self.__blob_stats['unique'] += 1
+                self.__blob_stats['bytes_stored'] += size
+
+    def merge_blob_stats(self, stats):
+        for key, value in stats.items():
+            self.__blob_stats[key] += value
 
-    def increment_failed(self):
-        self.__failed += 1
+    def keep_blob_reference(self, record):
+        self.__kept_blobs.add(record["sha256"])
+
+    def drop_blob_reference(self, record):
+        """Take back a merged blob reference of a message that is not part of the output.
+        
+        A blob it stored is removed by remove_dropped_blobs() unless a kept message
+        references it as well.
+        """
+        self.__blob_stats['references'] -= 1
+        self.__blob_stats['bytes_referenced'] -= record["size_bytes"]
+        if not record["deduplicated"]:
+            self.__dropped_blobs[record["sha256"]] = record
+
+    def remove_dropped_blobs(self):
+        for digest, record in self.__dropped_blobs.items():
+            if digest not in self.__kept_blobs:
+                self.__blob_stats['unique'] -= 1
+                self.__blob_stats['bytes_stored'] -= record["size_bytes"]
+                try:
+                    os.remove(record["full_path"])
+                except OSError as e:
+                    logger.warning(f"Could not remove blob {record['full_path']}: {e}")
+        self.__dropped_blobs = {}
+
+    def get_blob_stats(self):
+        return dict(self.__blob_stats)
 
     def get_total(self):
         return self.__total
@@ -78,14 +172,113 @@ class Extractor:
     
     def add_extraction_record(self, record):
         """Add an extraction record to the mapping."""
-        self.__extraction_map.append(record)
+        with self.lock:
+            if self.__map_writer is not None:
+                self.__map_writer.write([record])
+            else:
+                self.__extraction_map.append(record)
+
+    def submit_write(self, func, *args):
+        """Run `func(*args)` on a writer thread, or right away when there are none.
+        
+        Writer threads count failures themselves; without them exceptions propagate.
+        """
+        if self.__writers is None:
+            func(*args)
+        else:
+            self.__writers.submit(func, *args)
+
+    def wait_for_writes(self):
+        """Block until every submitted attachment is written."""
+        if self.__writers is not None:
+            self.__writers.join()
+
+    def stop_writers(self):
+        """Finish the pending writes and stop the writer threads."""
+        if self.__writers is not None:
+            self.__writers.close()
+            self.__writers = None
+
+    def stream_extraction_map(self, resume_state=None):
+        """Write extraction records to extraction_map.json as they are added instead of keeping them in memory.
+        
+        `resume_state` continues the map of an earlier run from its last checkpoint.
+        """
+        self.__map_writer = LazyJsonArrayWriter(self.extraction_map_path(), resume_state)
+        self.__map_writer.write(self.__extraction_map)
+        self.__extraction_map = []
+
+    def extraction_map_state(self):
+        """Flush the streamed extraction map and return its position for a checkpoint."""
+        if self.__map_writer is None:
+            return None
+        self.wait_for_writes()
+        self.__map_writer.flush()
+        return self.__map_writer.state()
+
+    def extraction_map_path(self):
+        return os.path.join(self.options.output, 'extraction_map.json')
+
+    def get_extraction_records(self):
+        return self.__extraction_map
+
+    def add_pending_metadata(self, file_path, metadata):
+        """Keep a metadata file to be written later, once the final file path is known."""
+        self.__pending_metadata.append((file_path, metadata))
+
+    def get_pending_metadata(self):
+        return self.__pending_metadata
+
+    def add_metadata(self, file_path, metadata):
+        """Record the metadata of an extracted file, in its side file or the consolidated metadata file."""
+        if self.defer_metadata:
+            with self.lock:
+                self.add_pending_metadata(file_path, metadata)
+        elif self.__metadata_writer is not None:
+            with self.lock:
+                self.__metadata_writer.write([dict(metadata, saved_path=file_path)])
+        else:
+            write_metadata(file_path, metadata)
+
+    def stream_metadata(self, resume_state=None):
+        """Write attachment metadata to one metadata.json file, continuing from `resume_state` if given."""
+        self.__metadata_writer = LazyJsonArrayWriter(self.metadata_path(), resume_state)
+
+    def metadata_state(self):
+        """Flush the consolidated metadata file and return its position for a checkpoint."""
+        if self.__metadata_writer is None:
+            return None
+        self.wait_for_writes()
+        self.__metadata_writer.flush()
+        return self.__metadata_writer.state()
+
+    def metadata_path(self):
+        return os.path.join(self.options.output, 'metadata.json')
+
+    def save_metadata(self):
+        """Close the consolidated metadata file, if metadata is consolidated."""
+        if self.__metadata_writer is None:
+            return
+        try:
+            if self.__metadata_writer.close():
+                logger.info(f"Saved attachment metadata: {self.metadata_path()}")
+        except Exception as e:
+            logger.error(f"Failed to save attachment metadata: {e}")
     
     def save_extraction_map(self):
         """Save the complete extraction mapping to a JSON file."""
-        if self.__extraction_map:
-            map_file = os.path.join(self.options.output, 'extraction_map.json')
+        self.stop_writers()
+        # Every worker's blobs are merged by now
+        self.remove_dropped_blobs()
+        map_file = self.extraction_map_path()
+        if self.__map_writer is not None:
+            try:
+                if self.__map_writer.close():
+                    logger.info(f"Saved extraction mapping: {map_file}")
+            except Exception as e:
+                logger.error(f"Failed to save extraction map: {e}")
+        elif self.__extraction_map:
             try:
-                import json
                 with open(map_file, 'w', encoding='utf-8') as f:
                     json.dump(self.__extraction_map, f, indent=2, ensure_ascii=False)
                 logger.info(f"Saved extraction mapping: {map_file}")
@@ -93,6 +286,121 @@ class Extractor:
                 logger.error(f"Failed to save extraction map: {e}")
 
 
+class AttachmentWriterPool:
+    """Background threads that write attachments while the next messages are parsed.
+    
+    At most `queue_size` writes wait for a thread; submit() blocks beyond that, which
+    bounds the number of open files and messages kept alive by pending writes.
+    """
+
+    def __init__(self, extractor, threads, queue_size=DEFAULT_WRITER_QUEUE_SIZE):
+        self.extractor = extractor
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, func, *args):
+        self.queue.put((func, args))
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                func, args = job
+                func(*args)
+            except:
+                traceback.print_exc()
+                self.extractor.increment_failed()
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        self.queue.join()
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+# Folder of the content-addressed attachment store, relative to the output folder
+BLOB_FOLDER = 'blobs'
+
+
+def blob_path(blob_folder, digest):
+    return os.path.join(blob_folder, digest[:2], digest)
+
+
+def claim_blob(tmp_path, path):
+    """Move `tmp_path` to the blob at `path` unless it exists, and return whether it was stored.
+    
+    Creating the blob is atomic, so of the threads and worker processes storing the same
+    payload at once exactly one stores it and the others count a deduplicated copy.
+    `tmp_path` is gone afterwards either way.
+    """
+    try:
+        os.link(tmp_path, path)
+        stored = True
+    except FileExistsError:
+        stored = False
+    except OSError:
+        # The file system has no hard links: claim the name, then move the complete blob over it
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            stored = False
+        else:
+            os.replace(tmp_path, path)
+            return True
+    os.remove(tmp_path)
+    return stored
+
+
+def save_blob(extractor, mid, part, attachment_number, inline_image):
+    """Store an attachment once under its SHA-256 digest and record the reference to it.
+    
+    Returns the size and digest of the payload, which is decoded only this once.
+    """
+    os.makedirs(extractor.blob_folder, exist_ok=True)
+    # The payload is hashed while it is written to a temporary file, which then becomes
+    # the blob or is dropped when the blob already exists; concurrent writers never see a partial blob
+    with tempfile.NamedTemporaryFile(dir=extractor.blob_folder, prefix='.tmp-', delete=False) as f:
+        tmp_path = f.name
+        try:
+            size, digest = write_payload(part, f, digest=True)
+        except BaseException:
+            f.close()
+            os.remove(tmp_path)
+            raise
+    path = blob_path(extractor.blob_folder, digest)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    stored = claim_blob(tmp_path, path)
+    if stored:
+        get_stats().count('attachment_bytes', size)
+    extractor.add_blob_reference(size, stored)
+
+    extractor.add_extraction_record({
+        "message_id": mid,
+        "attachment_number": attachment_number,
+        "original_filename": part.get_filename(),
+        "saved_filename": digest,
+        "full_path": path,
+        "sha256": digest,
+        "size_bytes": size,
+        "deduplicated": not stored,
+        "content_type": part.get_content_type(),
+        "is_inline_image": inline_image,
+        "extracted_with": "mbox-to-json v2.0.0",
+        "extraction_date": __import__('datetime').datetime.now().isoformat()
+    })
+    return size, digest
+
+
 def to_file_path(save_to, name):
     return os.path.join(save_to, name)
 
@@ -102,20 +410,33 @@ def get_extension(name):
     return extension if len(extension) <= 20 else ''
 
 
-def resolve_name_conflicts(save_to, name, file_paths, attachment_number):
+class NameRegistry:
+    """File paths already used within one message, with O(1) lookups."""
+
+    def __init__(self):
+        self.paths = set()
+
+    def __contains__(self, file_path):
+        return os.path.normcase(file_path) in self.paths
+
+    def add(self, file_path):
+        self.paths.add(os.path.normcase(file_path))
+
+
+def resolve_name_conflicts(save_to, name, registry, attachment_number):
     file_path = to_file_path(save_to, name)
 
     START = 1
     iteration_number = START
 
-    while os.path.normcase(file_path) in file_paths:
+    while file_path in registry:
         extension = get_extension(name)
         iteration = '' if iteration_number <= START else ' (%s)' % iteration_number
         new_name = '%s attachment %s%s%s' % (name, attachment_number, iteration, extension)
         file_path = to_file_path(save_to, new_name)
         iteration_number += 1
 
-    file_paths.append(os.path.normcase(file_path))
+    registry.add(file_path)
     return file_path
 
 
@@ -148,14 +469,30 @@ def decode_filename(part, fallback_filename, mid):
                 return fallback_filename
 
 
-def write_to_disk(part, file_path, message_id=None, attachment_number=None):
-    """Write attachment to disk with optional metadata file."""
-    with open(file_path, 'wb') as f:
-        f.write(part.get_payload(decode=True))
+def write_metadata(file_path, metadata):
+    """Write the metadata file that sits next to an extracted attachment."""
+    metadata_path = file_path + '.metadata.json'
+    try:
+        with open(metadata_path, 'w', encoding='utf-8') as meta_file:
+            json.dump(metadata, meta_file, indent=2, ensure_ascii=False)
+    except Exception as e:
+        logger.warning(f"Could not create metadata file for {file_path}: {e}")
+
+
+def write_to_disk(part, file_path, message_id=None, attachment_number=None, extractor=None, f=None):
+    """Write attachment to disk with optional metadata file.
+    
+    The payload is decoded in chunks while it is written, so it is never held in memory
+    as a whole. `f` is the destination file when the caller already opened it. The
+    metadata is handed to the extractor, which decides where it is written, when one
+    is given.
+    """
+    with f or open(file_path, 'wb') as f:
+        file_size, _ = write_payload(part, f)
+    get_stats().count('attachment_bytes', file_size)
     
     # Create metadata file
     if message_id is not None:
-        metadata_path = file_path + '.metadata.json'
         metadata = {
             "original_filename": part.get_filename(),
             "content_type": part.get_content_type(),
@@ -163,15 +500,19 @@ def write_to_disk(part, file_path, message_id=None, attachment_number=None):
             "attachment_number": attachment_number,
             "extracted_with": "mbox-to-json v2.0.0",
             "extraction_date": __import__('datetime').datetime.now().isoformat(),
-            "file_size": len(part.get_payload(decode=True)) if part.get_payload(decode=True) else 0
+            "file_size": file_size
         }
         
-        try:
-            import json
-            with open(metadata_path, 'w', encoding='utf-8') as meta_file:
-                json.dump(metadata, meta_file, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logger.warning(f"Could not create metadata file for {file_path}: {e}")
+        if extractor is not None:
+            extractor.add_metadata(file_path, metadata)
+        else:
+            write_metadata(file_path, metadata)
+
+
+def write_attachment(extractor, f, part, file_path, mid, attachment_number, extraction_record):
+    """Write an opened attachment file and its metadata, then record the extraction."""
+    write_to_disk(part, file_path, mid, attachment_number, extractor, f)
+    extractor.add_extraction_record(extraction_record)
 
 
 def save(extractor, mid, part, attachments_counter, inline_image=False):
@@ -187,6 +528,12 @@ def save(extractor, mid, part, attachments_counter, inline_image=False):
             attachment_number_string = str(attachments_counter['value'])
             destination_folder = extractor.options.output
 
+        if extractor.options.dedup:
+            # Blobs are stored right away: the record of the message carries their digests
+            attachments_counter['digests'][id(part)] = save_blob(
+                extractor, mid, part, attachment_number_string, inline_image)
+            return
+
         filename = decode_filename(part, attachment_number_string, mid)
         filename = filter_fn_characters(filename)
         filename = '%s %s' % (mid, filename)
@@ -198,8 +545,10 @@ def save(extractor, mid, part, attachments_counter, inline_image=False):
             previous_file_paths,
             attachment_number_string)
 
+        # Files are opened here, so that a name that is too long is still handled in message
+        # order; only writing their content is left to the writer threads
         try:
-            write_to_disk(part, resolved_path, mid, attachment_number_string)
+            f = open(resolved_path, 'wb')
             
             # Record extraction information
             extraction_record = {
@@ -213,7 +562,6 @@ def save(extractor, mid, part, attachments_counter, inline_image=False):
                 "extracted_with": "mbox-to-json v2.0.0",
                 "extraction_date": __import__('datetime').datetime.now().isoformat()
             }
-            extractor.add_extraction_record(extraction_record)
             
         except OSError as e:
             if e.errno == errno.ENAMETOOLONG:
@@ -222,7 +570,8 @@ def save(extractor, mid, part, attachments_counter, inline_image=False):
                     destination_folder, short_name,
                     previous_file_paths,
                     attachment_number_string)
-                write_to_disk(part, short_path, mid, attachment_number_string)
+                resolved_path = short_path
+                f = open(short_path, 'wb')
                 
                 # Record extraction information for short name
                 extraction_record = {
@@ -237,9 +586,11 @@ def save(extractor, mid, part, attachments_counter, inline_image=False):
                     "extracted_with": "mbox-to-json v2.0.0",
                     "extraction_date": __import__('datetime').datetime.now().isoformat()
                 }
-                extractor.add_extraction_record(extraction_record)
             else:
                 raise
+        
+        extractor.submit_write(write_attachment, extractor, f, part, resolved_path,
+                               mid, attachment_number_string, extraction_record)
     except:
         traceback.print_exc()
         extractor.increment_failed()
@@ -267,40 +618,158 @@ def check_part(extractor, mid, part, attachments_counter):
         save(extractor, mid, part, attachments_counter, True)
 
 
-def process_message(extractor, mid):
-    msg = extractor.mbox.get_message(mid)
+def process_message(extractor, mid, msg):
+    """Extract the attachments of a message.
+    
+    Returns the (size, SHA-256) of the parts stored in the attachment store, by the id()
+    of the part, for records.message_to_record() to use instead of decoding them again.
+    """
+    attachments_counter = {
+        'value': 0,
+        'inline_image': 0,
+        'file_paths': NameRegistry(),
+        'digests': {}
+    }
     if msg.is_multipart():
-        attachments_counter = {
-            'value': 0,
-            'inline_image': 0,
-            'file_paths': []
-        }
         for part in msg.get_payload():
             check_part(extractor, mid, part, attachments_counter)
+    return attachments_counter['digests']
+
+
+def shard_output_folder(output, shard_start):
+    """Staging folder used by a parallel worker for the shard starting at `shard_start`."""
+    return os.path.join(output, '.shard-%d' % shard_start, '')
+
+
+def merge_shard_extraction(extractor, shard_output, records, pending_metadata, total, failed, blob_stats, index_offset,
+                           dropped=()):
+    """Move the files a parallel worker extracted into place.
+    
+    Workers only know the position of a message within their shard, so files are
+    renamed to the global message index (`index_offset` + local index) here. The
+    attachments of `dropped`, the local indexes of messages the parent leaves out of the
+    output such as duplicates of messages in earlier shards, are not kept. Names that
+    become too long with the global index are shortened like in save().
+    """
+    moved_paths = {}
+    registry = None
+    registry_mid = None
+    extractor.merge_blob_stats(blob_stats)
+
+    for record in records:
+        local_mid = record["message_id"]
+        if local_mid in dropped:
+            # Their files are removed with the shard folder; blobs may be shared with kept messages
+            total -= 1
+            if "sha256" in record:
+                extractor.drop_blob_reference(record)
+            continue
+        mid = local_mid + index_offset
+        if "sha256" in record:
+            # Blobs are already stored under their final, content-addressed name
+            record["message_id"] = mid
+            extractor.keep_blob_reference(record)
+            extractor.add_extraction_record(record)
+            continue
+        folder = extractor.inline_image_folder if record["is_inline_image"] else extractor.options.output
+        attachment_number = record["attachment_number"]
+        # The records of a message are contiguous, and its shortened names must not collide
+        if mid != registry_mid:
+            registry = NameRegistry()
+            registry_mid = mid
+
+        # Every saved name starts with the message index followed by a space
+        saved_filename = '%s%s' % (mid, record["saved_filename"][len(str(local_mid)):])
+        full_path = resolve_name_conflicts(folder, saved_filename, registry, attachment_number)
+        try:
+            try:
+                os.replace(record["full_path"], full_path)
+            except OSError as e:
+                if e.errno != errno.ENAMETOOLONG:
+                    raise
+                short_name = '%s %s%s' % (mid, attachment_number, get_extension(saved_filename))
+                full_path = resolve_name_conflicts(folder, short_name, registry, attachment_number)
+                os.replace(record["full_path"], full_path)
+                record["filename_truncated"] = True
+        except OSError as e:
+            logger.error(f"Could not move extracted attachment {record['full_path']}: {e}")
+            failed += 1
+            continue
+        moved_paths[record["full_path"]] = full_path
+
+        record["message_id"] = mid
+        record["saved_filename"] = os.path.basename(full_path)
+        record["full_path"] = full_path
+        extractor.add_extraction_record(record)
+
+    for file_path, metadata in pending_metadata:
+        # Files of dropped messages and files that could not be moved are gone with the shard folder
+        if file_path not in moved_paths:
+            continue
+        metadata["source_message_id"] += index_offset
+        extractor.add_metadata(moved_paths[file_path], metadata)
+
+    extractor.increment_total(total)
+    extractor.increment_failed(failed)
+    shutil.rmtree(shard_output, ignore_errors=True)
+
+
+def report_extraction(extractor):
+    logger.info(f'Extraction completed:')
+    logger.info(f'Total files:  {extractor.get_total()}')
+    logger.info(f'Failed:       {extractor.get_failed()}')
+    if extractor.options.dedup:
+        stats = extractor.get_blob_stats()
+        ratio = stats['references'] / stats['unique'] if stats['unique'] else 0
+        saved = stats['bytes_referenced'] - stats['bytes_stored']
+        logger.info(f'Unique blobs: {stats["unique"]} of {stats["references"]} attachments (dedup ratio {ratio:.2f}:1)')
+        logger.info(f'Bytes stored: {stats["bytes_stored"]} of {stats["bytes_referenced"]} ({saved} bytes saved)')
+    logger.info(f'Files are available in: {extractor.options.output}')
 
 
 def extract_mbox_file(options):
+    from alive_progress import alive_bar
+
+    assert os.path.isfile(options.input)
+    compression = detect_compression(options.input)
+    if options.index and compression:
+        logger.error('--index is not supported with compressed input')
+        return
     extractor = Extractor(options)
-    message_count = extractor.mbox.__len__()
-    logger.info(f'Starting attachment extraction from {message_count} messages...')
+    # The decompressed size of compressed input is not known up front
+    file_size = None if compression else os.path.getsize(options.input)
+    logger.info(f'Starting attachment extraction from {options.input}...')
     
-    with alive_bar(message_count) as bar:
-        for i in range(options.start, options.stop):
-            try:
-                process_message(extractor, i)
-            except KeyError:
-                logger.info('The whole mbox file was processed.')
+    if options.index:
+        index = load_index(options.input)
+        logger.info(f'Found {len(index)} messages in MBOX index')
+        with alive_bar(max(0, min(options.stop, len(index)) - options.start)) as bar:
+            for i, offset, length, raw in index.iter_messages(options.start, options.stop):
+                process_message(extractor, i, parse_message(raw))
+                bar()
+        
+        extractor.save_extraction_map()
+        extractor.save_metadata()
+        report_extraction(extractor)
+        return
+    
+    with alive_bar(file_size, unit='B', scale='SI') as bar:
+        for i, (offset, length, raw) in enumerate(scan_mbox(options.input)):
+            if i >= options.stop:
                 break
-            bar()
+            bar(length)
+            if i < options.start:
+                continue
+            process_message(extractor, i, parse_message(raw))
+        else:
+            logger.info('The whole mbox file was processed.')
 
     # Save extraction mapping
     extractor.save_extraction_map()
-    
-    logger.info(f'Extraction completed:')
-    logger.info(f'Total files:  {extractor.get_total()}')
-    logger.info(f'Failed:       {extractor.get_failed()}')
-    logger.info(f'Files are available in: {options.output}')
+    extractor.save_metadata()
+    report_extraction(extractor)
 
 
 if __name__ == "__main__":
+    configure_logging()
     extract_mbox_file(parse_options(sys.argv[1:]))
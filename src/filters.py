@@ -0,0 +1,82 @@
+import argparse
+import datetime
+import re
+from email.header import decode_header, make_header
+from email.utils import parsedate_to_datetime
+
+
+def filter_date(arg):
+    """argparse type for --since/--until: an ISO date or date and time, taken as UTC when no offset is given."""
+    try:
+        value = datetime.datetime.fromisoformat(arg)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Not an ISO date (YYYY-MM-DD[THH:MM[:SS]]): {arg}")
+    return as_utc(value)
+
+
+def header_pattern(arg):
+    """argparse type for --header-match: NAME=REGEX."""
+    name, separator, pattern = arg.partition('=')
+    if not separator or not name.strip():
+        raise argparse.ArgumentTypeError(f"Expected NAME=REGEX: {arg}")
+    try:
+        return name.strip(), re.compile(pattern)
+    except re.error as e:
+        raise argparse.ArgumentTypeError(f"Invalid regular expression {pattern!r}: {e}")
+
+
+def as_utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def header_text(value):
+    """Decode a MIME encoded header value for matching, falling back to its raw text."""
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return str(value)
+
+
+class MessageFilter:
+    """Header predicates that decide whether a message is converted at all.
+
+    They are evaluated on the header block alone, as returned by scanner.parse_headers(),
+    so messages that are filtered out never have their body parsed. A message must match
+    every given criterion: a Date in [`since`, `until`), a From header containing one of
+    `senders` (case-insensitive), and every (name, regex) pair of `header_patterns`.
+    Messages without a valid Date are skipped when a date range is given.
+    """
+
+    def __init__(self, since=None, until=None, senders=(), header_patterns=()):
+        self.since = since
+        self.until = until
+        self.senders = tuple(sender.lower() for sender in senders)
+        self.header_patterns = tuple(header_patterns)
+
+    def __bool__(self):
+        return bool(self.since or self.until or self.senders or self.header_patterns)
+
+    def matches(self, headers):
+        if self.since is not None or self.until is not None:
+            try:
+                date = as_utc(parsedate_to_datetime(headers['Date']))
+            except Exception:
+                return False
+            if self.since is not None and date < self.since:
+                return False
+            if self.until is not None and date >= self.until:
+                return False
+
+        if self.senders:
+            sender = header_text(headers.get('From', '')).lower()
+            if not any(candidate in sender for candidate in self.senders):
+                return False
+
+        for name, pattern in self.header_patterns:
+            values = headers.get_all(name) or []
+            if not any(pattern.search(header_text(value)) for value in values):
+                return False
+
+        return True
@@ -1,280 +1,107 @@
 import os
-import pandas as pd
-import mailbox
 import argparse
-import subprocess
+import copy
 import logging
 import sys
-import json
 import gc
-import multiprocessing as mp
+import glob
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
 from functools import partial
-from alive_progress import alive_bar
-from charset_normalizer import from_bytes  # Import charset-normalizer for encoding detection
-from email.header import decode_header
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('mbox_to_json.log', mode='a')
-    ]
-)
-logger = logging.getLogger(__name__)
-
-
-def getBody(msg, max_payload_mb=10, max_body_part_mb=1, max_depth=50):
-    """Extracts the body from the email, handling different encodings and errors."""
-    body_parts = []
-    max_payload_bytes = max_payload_mb * 1000000
-    max_body_part_bytes = max_body_part_mb * 1000000
-    
-    def extract_text_parts(part, depth=0):
-        """Recursively extract text parts from multipart messages."""
-        if depth > max_depth:
-            logger.warning(f"Maximum recursion depth reached ({max_depth}). Truncating email parsing.")
-            return
-        
-        if part.is_multipart():
-            try:
-                payload = part.get_payload()
-                if payload:
-                    for subpart in payload:
-                        extract_text_parts(subpart, depth + 1)
-            except (TypeError, AttributeError) as e:
-                logger.warning(f"Error processing multipart payload at depth {depth}: {e}")
-        else:
-            content_type = part.get_content_type()
-            # Extract text/plain and text/html parts
-            if content_type in ['text/plain', 'text/html']:
-                try:
-                    raw_payload = part.get_payload(decode=True)
-                    if raw_payload:
-                        decoded_body = decode_payload(raw_payload)
-                        if decoded_body:
-                            # Limit body part size to prevent memory issues
-                            if len(decoded_body) > max_body_part_bytes:
-                                decoded_body = decoded_body[:max_body_part_bytes] + f"\n[TRUNCATED - Content too large (>{max_body_part_mb}MB)]"
-                            body_parts.append(f"[{content_type}]: {decoded_body}")
-                except Exception as e:
-                    logger.warning(f"Error extracting text part: {e}")
-    
-    def decode_payload(raw_payload):
-        """Helper function to decode payload with proper encoding detection."""
-        if raw_payload is None:
-            return ""
-        
-        # Limit payload size to prevent memory issues
-        if len(raw_payload) > max_payload_bytes:
-            logger.warning(f"Payload too large ({len(raw_payload)} bytes), truncating to {max_payload_mb}MB")
-            raw_payload = raw_payload[:max_payload_bytes]
-        
-        # Attempt to detect encoding using charset-normalizer
-        try:
-            result = from_bytes(raw_payload)
-            detected_encoding = result.best().encoding if result.best() else None
-        except Exception as e:
-            logger.warning(f"Encoding detection failed: {e}")
-            detected_encoding = None
-        
-        if detected_encoding:
-            try:
-                return raw_payload.decode(detected_encoding, errors='replace')
-            except (UnicodeDecodeError, TypeError) as e:
-                logger.warning(f"Failed to decode with {detected_encoding}, error: {e}")
-                return raw_payload.decode('utf-8', errors='replace')
-        else:
-            return raw_payload.decode('utf-8', errors='replace')
-    
-    # Handle both multipart and single part messages
-    try:
-        if msg.is_multipart():
-            extract_text_parts(msg)
-            return "\n\n".join(body_parts) if body_parts else ""
-        else:
-            # Single part message
-            raw_payload = msg.get_payload(decode=True)
-            if raw_payload is None:
-                logger.warning(f"No payload for message {msg}")
-                return ""
-            return decode_payload(raw_payload)
-    except RecursionError:
-        logger.error("Maximum recursion depth exceeded while parsing email body")
-        return "[ERROR: Email structure too complex to parse]"
-    except MemoryError:
-        logger.error("Out of memory while parsing email body")
-        return "[ERROR: Email too large to parse]"
-    except Exception as e:
-        logger.error(f"Unexpected error parsing email body: {e}")
-        return "[ERROR: Failed to parse email body]"
-
-
-def extract_attachments_info(msg, message_id):
-    """Extract attachment information without saving files."""
-    attachments = []
-    
-    def process_part(part):
-        if part.is_multipart():
-            for subpart in part.get_payload():
-                process_part(subpart)
-        else:
-            # Check if this part is an attachment
-            content_disposition = part.get_content_disposition()
-            content_type = part.get_content_type()
-            filename = part.get_filename()
-            
-            is_attachment = False
-            
-            # Determine if this is an attachment
-            if content_disposition == 'attachment':
-                is_attachment = True
-            elif filename is not None and content_disposition != 'inline':
-                is_attachment = True
-            elif (content_type.startswith('application/') and content_type != 'application/javascript') \
-                    or content_type.startswith('model/') \
-                    or content_type.startswith('audio/') \
-                    or content_type.startswith('video/'):
-                is_attachment = True
-            
-            if is_attachment and filename:
-                # Decode filename if needed
-                try:
-                    decoded_name = decode_header(filename)
-                    if isinstance(decoded_name[0][0], bytes):
-                        name_encoding = decoded_name[0][1] or 'utf-8'
-                        filename = decoded_name[0][0].decode(name_encoding)
-                    else:
-                        filename = decoded_name[0][0]
-                except:
-                    # Keep original filename if decoding fails
-                    pass
-                
-                # Get file size
-                try:
-                    payload = part.get_payload(decode=True)
-                    file_size = len(payload) if payload else 0
-                except:
-                    file_size = 0
-                
-                attachment_info = {
-                    'filename': filename,
-                    'content_type': content_type,
-                    'content_disposition': content_disposition,
-                    'size_bytes': file_size,
-                    'message_id': message_id
-                }
-                attachments.append(attachment_info)
-    
-    if msg.is_multipart():
-        process_part(msg)
-    
-    return attachments
-
-
-def process_message_worker(args_tuple):
-    """Worker function to process a single message in parallel."""
-    msg_data, msg_index, extract_attachments, skip_metadata, max_payload_mb, max_body_part_mb, max_depth = args_tuple
-    
-    try:
-        # Recreate message object from string data
-        import email
-        msg = email.message_from_string(msg_data)
-        
-        result = {"index": msg_index}
-        
-        # Extract headers with MIME decoding
-        for header in msg.keys():
-            raw_header_value = msg[header]
-            decoded_header_value = decode_mime_header(raw_header_value)
-            result[header] = decoded_header_value
-        
-        # Extract body
-        result["Body"] = getBody(msg, max_payload_mb, max_body_part_mb, max_depth)
-        
-        # Extract attachments if needed
-        if extract_attachments and not skip_metadata:
-            attachments = extract_attachments_info(msg, msg_index)
-            result["Attachments"] = attachments
-            result["Attachment_Count"] = len(attachments)
-            
-            # Add metadata to attachments
-            for att in attachments:
-                att["source_message_index"] = msg_index
-                att["extracted_with"] = "mbox-to-json v2.0.0"
-        else:
-            result["Attachments"] = []
-            result["Attachment_Count"] = 0
-            
-        return result
-        
-    except Exception as e:
-        logger.error(f"Error processing message {msg_index}: {e}")
-        return {
-            "index": msg_index,
-            "Body": "",
-            "Attachments": [],
-            "Attachment_Count": 0,
-            "Error": str(e)
-        }
-
-
-def decode_mime_header(header_value):
-    """Decode MIME-encoded email headers."""
-    if not header_value:
-        return header_value
-    
-    try:
-        decoded_parts = decode_header(header_value)
-        decoded_string = ""
-        
-        for part, encoding in decoded_parts:
-            if isinstance(part, bytes):
-                if encoding:
-                    try:
-                        decoded_string += part.decode(encoding, errors='replace')
-                    except (UnicodeDecodeError, LookupError):
-                        # Fallback to utf-8 if encoding fails
-                        decoded_string += part.decode('utf-8', errors='replace')
-                else:
-                    # No encoding specified, try utf-8
-                    decoded_string += part.decode('utf-8', errors='replace')
-            else:
-                # Already a string
-                decoded_string += part
-        
-        return decoded_string
-    except (ValueError, TypeError) as e:
-        logger.warning(f"Failed to decode MIME header '{header_value[:50]}...': {e}")
-        return header_value  # Return original if decoding fails
 
+try:
+    from . import extract
+    from .batch import SUMMARY_NAME, batch_outputs, find_inputs, is_batch, save_summary, schedule
+    from .charsets import DETECTION_POLICIES
+    from .mbox_index import load_index
+    from .checkpoint import load_checkpoint, save_checkpoint, checkpoint_path
+    from .dedup import DEFAULT_MEMORY_KEYS, MessageTracker
+    from .compression import (
+        COMPRESSION_FORMATS, COMPRESSION_SUFFIXES, compression_from_path, detect_compression,
+        split_compression_suffix,
+    )
+    from .scanner import (
+        scan_mbox, estimate_message_count, compute_shards, is_message_start, input_size, is_maildir,
+        maildir_messages, maildir_size, scan_maildir,
+    )
+    from .filters import MessageFilter, filter_date, header_pattern
+    from .records import (
+        BODY_FIELDS, DEFAULT_SHARD_SIZE_MB, INFLIGHT_SHARDS_PER_WORKER, convert_messages, imap_bounded,
+        parse_fields, process_shard_worker, renumber_record, shard_duplicates,
+    )
+    from .stats import DEFAULT_SLOWEST, get_stats, merge_profiles, profiled, reset_stats, save_stats
+    from .tuning import AUTO, DEFAULT_SAMPLE_MESSAGES, Sample, describe_costs, plan_parallelism, worker_count
+    from .writers import (
+        BINARY_FORMATS, COLUMNAR_FORMATS, DEFAULT_ROW_GROUP_SIZE, STREAMING_FORMATS, LazyJsonArrayWriter,
+        create_writer, manifest_path, split_output_path,
+    )
+except ImportError:
+    import extract
+    from batch import SUMMARY_NAME, batch_outputs, find_inputs, is_batch, save_summary, schedule
+    from charsets import DETECTION_POLICIES
+    from mbox_index import load_index
+    from checkpoint import load_checkpoint, save_checkpoint, checkpoint_path
+    from dedup import DEFAULT_MEMORY_KEYS, MessageTracker
+    from compression import (
+        COMPRESSION_FORMATS, COMPRESSION_SUFFIXES, compression_from_path, detect_compression,
+        split_compression_suffix,
+    )
+    from scanner import (
+        scan_mbox, estimate_message_count, compute_shards, is_message_start, input_size, is_maildir,
+        maildir_messages, maildir_size, scan_maildir,
+    )
+    from filters import MessageFilter, filter_date, header_pattern
+    from records import (
+        BODY_FIELDS, DEFAULT_SHARD_SIZE_MB, INFLIGHT_SHARDS_PER_WORKER, convert_messages, imap_bounded,
+        parse_fields, process_shard_worker, renumber_record, shard_duplicates,
+    )
+    from stats import DEFAULT_SLOWEST, get_stats, merge_profiles, profiled, reset_stats, save_stats
+    from tuning import AUTO, DEFAULT_SAMPLE_MESSAGES, Sample, describe_costs, plan_parallelism, worker_count
+    from writers import (
+        BINARY_FORMATS, COLUMNAR_FORMATS, DEFAULT_ROW_GROUP_SIZE, STREAMING_FORMATS, LazyJsonArrayWriter,
+        create_writer, manifest_path, split_output_path,
+    )
 
-def sanitize_string(value):
-    """Sanitize the string to avoid potential encoding issues."""
-    if isinstance(value, str):
-        return value.replace('\x00', '')  # Remove null byte
-    return value
+logger = logging.getLogger(__name__)
 
 
-def split_dataframe(df, num_splits):
-    """Splits the DataFrame into a given number of parts."""
-    chunk_size = max(1, len(df) // num_splits)  # Ensure at least 1 row per chunk
-    chunks = []
-    for i in range(0, len(df), chunk_size):
-        chunk = df.iloc[i:i + chunk_size].copy()  # Use copy to free memory
-        chunks.append(chunk)
-    return chunks
+def configure_logging():
+    """Configure logging for a command line run; importing this module configures nothing."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.FileHandler('mbox_to_json.log', mode='a')
+        ]
+    )
 
 
 def main():
+    configure_logging()
     parser = argparse.ArgumentParser(description="Converts MBOX file to JSON")
-    parser.add_argument("filename", help="Input MBOX file path")
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        metavar="filename",
+        help="Input MBOX file path or Maildir folder. Several files, directories or glob patterns start a batch "
+             "run, which converts every MBOX file and Maildir folder found",
+    )
     parser.add_argument(
         "-o",
         "--output",
         required=False,
-        help="Output JSON file path and name. Defaults to same location and name as input file.",
+        help="Output JSON file path and name. Defaults to same location and name as input file. "
+             "In batch runs, the folder the outputs are written to, mirroring the input folders",
+    )
+    parser.add_argument(
+        "--summary",
+        default=None,
+        metavar="PATH",
+        help=f"Write the JSON summary of a batch run to PATH (default: {SUMMARY_NAME} in the -o folder "
+             "or the current folder)",
     )
     parser.add_argument(
         "-a",
@@ -282,12 +109,126 @@ def main():
         action="store_true",
         help='Extracts Attachments from the MBOX. Stored to the same location as input file in a folder "attachments"',
     )
+    parser.add_argument(
+        "--dedup-attachments",
+        action="store_true",
+        help='With -a, store each unique attachment once under its SHA-256 digest in "attachments/blobs" '
+             "and reference it by digest from extraction_map.json and the attachments manifest",
+    )
+    parser.add_argument(
+        "--consolidated-metadata",
+        action="store_true",
+        help="With -a, write the metadata of every extracted attachment to one attachments/metadata.json "
+             "instead of a .metadata.json file next to each attachment",
+    )
+    parser.add_argument(
+        "--attachment-writers",
+        type=int,
+        default=0,
+        help="With -a, number of background threads writing attachment files while parsing continues; "
+             "useful on network storage (default: 0, write synchronously)",
+    )
+    parser.add_argument(
+        "--attachment-queue-size",
+        type=int,
+        default=extract.DEFAULT_WRITER_QUEUE_SIZE,
+        help=f"Maximum number of attachments waiting for a writer thread (default: {extract.DEFAULT_WRITER_QUEUE_SIZE})",
+    )
     parser.add_argument(
         "-c",
         "--csv",
         action="store_true",
         help="Saves as CSV instead of JSON. Defaults to same location and name as input file.",
     )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=["json", "ndjson", "csv", "sqlite"] + list(COLUMNAR_FORMATS),
+        default=None,
+        help="Output format (default: json). ndjson writes one JSON object per line as messages are processed; "
+             "parquet and arrow (Arrow IPC) write columnar files in row groups and require pyarrow; "
+             "sqlite writes messages, headers and attachments tables with an FTS5 index over Subject and Body.",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=COMPRESSION_FORMATS,
+        default=None,
+        help="Compress JSON/NDJSON/CSV output, split parts and the attachments manifest on a background "
+             "thread. Also enabled by an output name ending in .gz, .bz2 or .xz",
+    )
+    parser.add_argument(
+        "--fields",
+        default=None,
+        help="Comma separated list of headers (and Body, Attachments, Attachment_Count) to output, e.g. "
+             "From,To,Date,Subject,Message-ID. Only the header block is parsed when no body field is listed",
+    )
+    parser.add_argument(
+        "--headers-only",
+        action="store_true",
+        help="Output every header but no body, parsing only the header block of each message",
+    )
+    parser.add_argument(
+        "--since",
+        type=filter_date,
+        default=None,
+        help="Only convert messages dated on or after this ISO date/time (UTC unless an offset is given)",
+    )
+    parser.add_argument(
+        "--until",
+        type=filter_date,
+        default=None,
+        help="Only convert messages dated before this ISO date/time (UTC unless an offset is given)",
+    )
+    parser.add_argument(
+        "--from",
+        dest="senders",
+        action="append",
+        default=[],
+        metavar="SENDER",
+        help="Only convert messages whose From header contains SENDER, e.g. alice@example.com or "
+             "@example.com (case-insensitive, repeat to allow several senders)",
+    )
+    parser.add_argument(
+        "--header-match",
+        type=header_pattern,
+        action="append",
+        default=[],
+        metavar="NAME=REGEX",
+        help="Only convert messages with a NAME header matching REGEX, e.g. List-Id=python-dev "
+             "(repeat to require several headers)",
+    )
+    parser.add_argument(
+        "--dedup-messages",
+        action="store_true",
+        help="Convert only the first copy of messages sharing a Message-ID, or for messages without one the same "
+             "Date, From, To, Cc, Subject and body. Duplicates are dropped before their body is parsed",
+    )
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="Add a Thread_Id field holding the Message-ID of the first message of each thread, resolved from "
+             "In-Reply-To and References as messages are processed",
+    )
+    parser.add_argument(
+        "--dedup-memory",
+        type=int,
+        default=DEFAULT_MEMORY_KEYS,
+        metavar="KEYS",
+        help="Message keys --dedup-messages and --threads keep in memory before spilling to a temporary "
+             f"SQLite file (default: {DEFAULT_MEMORY_KEYS})",
+    )
+    parser.add_argument(
+        "--row-group-size",
+        type=int,
+        default=DEFAULT_ROW_GROUP_SIZE,
+        help=f"Messages per row group of parquet/arrow output and per insert transaction of sqlite output "
+             f"(default: {DEFAULT_ROW_GROUP_SIZE})",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write JSON output incrementally instead of building a DataFrame, keeping memory use constant",
+    )
     parser.add_argument(
         "-s",
         "--split",
@@ -318,6 +259,13 @@ def main():
         default=50,
         help="Maximum recursion depth for nested emails (default: 50)",
     )
+    parser.add_argument(
+        "--charset-detection",
+        choices=DETECTION_POLICIES,
+        default="auto",
+        help="When to run charset detection on text parts: auto (only when the declared charset and UTF-8 "
+             "both fail), always, or never (default: auto)",
+    )
     parser.add_argument(
         "--batch-size",
         type=int,
@@ -326,31 +274,284 @@ def main():
     )
     parser.add_argument(
         "--workers",
-        type=int,
+        type=worker_count,
         default=1,
-        help="Number of parallel workers for processing (default: 1, max: CPU cores)"
+        help="Maximum number of parallel workers for processing (default: 1, max: CPU cores), or auto for up to "
+             "all CPU cores. A sample of the file decides whether, and with how many of them, it is converted in "
+             "parallel. Batch runs convert this many inputs at once"
+    )
+    parser.add_argument(
+        "--sample-messages",
+        type=int,
+        default=DEFAULT_SAMPLE_MESSAGES,
+        help="Number of messages converted to measure the costs that choose between serial and parallel "
+             f"processing, the worker count and the shard size (default: {DEFAULT_SAMPLE_MESSAGES})"
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=None,
+        help="Size in MB of the MBOX byte range each parallel worker task reads (default: sized from the sample to "
+             f"take about half a second to parse, or {DEFAULT_SHARD_SIZE_MB}MB with --enable-parallel)"
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Use a sidecar offset index (<input>.idx) for exact message counts and shard boundaries. "
+             "It is built on first use and extended when the MBOX file grows",
+    )
+    parser.add_argument(
+        "--resume",
+        "--incremental",
+        dest="resume",
+        action="store_true",
+        help="Continue from the checkpoint of a previous run: only messages after the last committed one are "
+             "processed and appended to the existing outputs. Use it after a crash or when the MBOX file has grown",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=1000,
+        help="Number of messages between checkpoints of streaming outputs with --resume "
+             "(default: 1000, 0 disables checkpoints)",
     )
     parser.add_argument(
         "--enable-parallel",
         action="store_true",
-        help="Force enable parallel processing regardless of file size or message count"
+        help="Force enable parallel processing with all --workers, without sampling the file"
+    )
+    parser.add_argument(
+        "--stats",
+        default=None,
+        metavar="PATH",
+        help="Write a JSON report of per-stage timers and counters, the slowest messages and the bytes "
+             "read and written to PATH when the run ends",
+    )
+    parser.add_argument(
+        "--stats-slowest",
+        type=int,
+        default=DEFAULT_SLOWEST,
+        help=f"Number of slowest messages listed in the --stats report (default: {DEFAULT_SLOWEST})",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="PATH",
+        help="Run under cProfile and write the profile of the main process merged with those of all "
+             "parallel workers to PATH, for python -m pstats or snakeviz",
     )
 
     args = parser.parse_args()
     
+    if args.stats_slowest < 1:
+        logger.error("--stats-slowest must be at least 1")
+        sys.exit(1)
+    
+    args.progress = True
+    args.attachments_dir = None
+    if is_batch(args.inputs):
+        if args.stats or args.profile:
+            logger.error("--stats and --profile are not supported in batch runs, which write their own summary")
+            sys.exit(1)
+        run_batch(args)
+        return
+    args.filename = args.inputs[0]
+    
+    stats = reset_stats(args.stats_slowest if args.stats else None)
+    # Workers write their profiles next to the main one, to be merged when the run ends
+    args.profile_dir = tempfile.mkdtemp(prefix="mbox-profile-") if args.profile else None
+    started = time.perf_counter()
+    try:
+        with profiled(os.path.join(args.profile_dir, "main.prof") if args.profile_dir else None):
+            convert(args)
+    finally:
+        if args.profile:
+            merge_profiles(args.profile, sorted(glob.glob(os.path.join(args.profile_dir, "*.prof"))))
+            shutil.rmtree(args.profile_dir, ignore_errors=True)
+            logger.info(f"Saved profile to {args.profile} (inspect it with: python -m pstats {args.profile})")
+        if args.stats:
+            stats.describe(wall_seconds=round(time.perf_counter() - started, 6))
+            save_stats(args.stats, stats)
+            logger.info(f"Saved stats to {args.stats}")
+
+
+def output_size(output, split, manifest):
+    """Returns the total size of the output files of a run."""
+    paths = [split_output_path(output, part) for part in range(1, split + 1)] if split > 1 else [output]
+    if manifest is not None:
+        paths.append(manifest.output)
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+@contextmanager
+def progress_bar(enabled, total, **options):
+    """An alive_progress bar, or a stand-in that shows nothing when `enabled` is false."""
+    if not enabled:
+        yield lambda *args, **kwargs: None
+        return
+    # The progress bar is only loaded once there is something to process
+    from alive_progress import alive_bar
+    
+    with alive_bar(total, **options) as bar:
+        yield bar
+
+
+class ErrorLog(logging.Handler):
+    """Keeps the errors logged while a batch input is converted, for the run summary."""
+    
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages = []
+    
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def init_batch_worker():
+    # The parent logs one line per input; workers only log warnings and errors
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def convert_batch_input(task):
+    """Convert one input of a batch run, serially, and return its entry of the run summary."""
+    args, path, output, size = task
+    args = copy.copy(args)
+    args.filename = path
+    args.output = output
+    args.workers = 1
+    args.progress = False
+    # Outputs that share a folder get an attachments folder each
+    output_stem = os.path.splitext(os.path.basename(output))[0]
+    args.attachments_dir = os.path.join(os.path.dirname(output), 'attachments', output_stem, '')
+    
+    errors = ErrorLog()
+    logging.getLogger().addHandler(errors)
+    started = time.perf_counter()
+    try:
+        summary = convert(args) or {}
+        status = "converted"
+    except SystemExit:
+        # convert() logs why it gives up before exiting
+        summary = {}
+        status = "failed"
+    except Exception as e:
+        logger.error(f"Unexpected error converting {path}: {e}")
+        summary = {}
+        status = "failed"
+    finally:
+        logging.getLogger().removeHandler(errors)
+    
+    entry = {
+        "input": path,
+        "output": args.output,
+        "status": status,
+        "seconds": round(time.perf_counter() - started, 6),
+        "input_bytes": size,
+        "messages": summary.get("messages", 0),
+        "skipped": summary.get("skipped", 0),
+        "duplicates": summary.get("duplicates", 0),
+        "bytes_out": summary.get("bytes_out", 0),
+    }
+    if status == "failed":
+        entry["error"] = errors.messages[-1] if errors.messages else "unknown error"
+    return entry
+
+
+def run_batch(args):
+    """Convert every MBOX file and Maildir folder of a batch run on one shared pool of worker processes.
+    
+    Each input is converted serially by one worker, and inputs are handed out largest
+    first so that the run ends as early as possible. One output is written per input and
+    the results of all inputs are collected in a JSON run summary.
+    """
+    inputs = find_inputs(args.inputs)
+    if not inputs:
+        logger.error("No MBOX files or Maildir folders found")
+        sys.exit(1)
+    
+    fmt = args.format or ("csv" if args.csv else "json")
+    if args.output is not None:
+        try:
+            os.makedirs(args.output, exist_ok=True)
+        except OSError as e:
+            logger.error(f"Cannot create output directory {args.output}: {e}")
+            sys.exit(1)
+    try:
+        outputs = batch_outputs(inputs, args.output, fmt)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    summary_path = args.summary or os.path.join(args.output or os.curdir, SUMMARY_NAME)
+    
+    tasks = [(args, path, outputs[path], size) for path, size in schedule(outputs)]
+    total_bytes = sum(task[3] for task in tasks)
+    workers = (os.cpu_count() or 1) if args.workers == AUTO else args.workers
+    workers = max(1, min(workers, os.cpu_count() or 1, len(tasks)))
+    logger.info(f"Converting {len(tasks)} inputs ({total_bytes / (1024 * 1024):.1f}MB) "
+                f"with {workers} workers, largest first")
+    
+    import multiprocessing as mp
+    
+    started = time.perf_counter()
+    files = []
+    with mp.Pool(processes=workers, initializer=init_batch_worker) as pool:
+        with progress_bar(True, total_bytes or None, unit='B', scale='SI') as bar:
+            for entry in pool.imap_unordered(convert_batch_input, tasks):
+                files.append(entry)
+                bar(entry["input_bytes"])
+                if entry["status"] == "failed":
+                    logger.error(f"Failed to convert {entry['input']}: {entry['error']}")
+                else:
+                    logger.info(f"Converted {entry['input']}: {entry['messages']} messages in {entry['seconds']:.1f}s")
+    
+    files.sort(key=lambda entry: entry["input"])
+    failed = sum(1 for entry in files if entry["status"] == "failed")
+    summary = {
+        "inputs": len(files),
+        "converted": len(files) - failed,
+        "failed": failed,
+        "format": fmt,
+        "workers": workers,
+        "wall_seconds": round(time.perf_counter() - started, 6),
+        "messages": sum(entry["messages"] for entry in files),
+        "skipped": sum(entry["skipped"] for entry in files),
+        "duplicates": sum(entry["duplicates"] for entry in files),
+        "input_bytes": total_bytes,
+        "bytes_out": sum(entry["bytes_out"] for entry in files),
+        "files": files,
+    }
+    save_summary(summary_path, summary)
+    logger.info(f"Converted {summary['converted']} of {len(files)} inputs ({summary['messages']} messages) "
+                f"in {summary['wall_seconds']:.1f}s. Saved run summary to {summary_path}")
+    if failed:
+        sys.exit(1)
+
+
+def convert(args):
+    """Convert the MBOX file or Maildir folder named by the parsed command line arguments.
+    
+    Returns a summary of the run, or None when there was nothing to convert.
+    """
+    stats = get_stats()
+    
     # Input validation
     if not os.path.exists(args.filename):
         logger.error(f"Input file does not exist: {args.filename}")
         sys.exit(1)
     
-    if not os.path.isfile(args.filename):
-        logger.error(f"Input path is not a file: {args.filename}")
+    # A Maildir folder holds one file per message
+    maildir = is_maildir(args.filename)
+    if not os.path.isfile(args.filename) and not maildir:
+        logger.error(f"Input path is not a file or Maildir folder: {args.filename}")
         sys.exit(1)
     
     # Check if input file is readable
     try:
-        with open(args.filename, 'rb') as test_file:
-            test_file.read(1)
+        if maildir:
+            maildir_messages(args.filename)
+        else:
+            with open(args.filename, 'rb') as test_file:
+                test_file.read(1)
     except PermissionError:
         logger.error(f"Permission denied reading file: {args.filename}")
         sys.exit(1)
@@ -358,11 +559,23 @@ def main():
         logger.error(f"Cannot read input file {args.filename}: {e}")
         sys.exit(1)
     
+    if args.format is None:
+        args.format = 'csv' if args.csv else 'json'
+    elif args.csv and args.format != 'csv':
+        logger.error(f"--csv cannot be combined with --format {args.format}")
+        sys.exit(1)
+    
     if args.output is None:
-        if args.csv:
-            args.output = os.path.splitext(args.filename)[0] + '.csv'
-        else:
-            args.output = os.path.splitext(args.filename)[0] + '.json'
+        input_name, _ = split_compression_suffix(os.path.normpath(args.filename))
+        args.output = os.path.splitext(input_name)[0] + '.' + args.format
+    
+    # Compressed output is requested with --compress or implied by a .gz/.bz2/.xz output name
+    if args.compress:
+        suffix = COMPRESSION_SUFFIXES[args.compress]
+        if not args.output.endswith(suffix):
+            args.output += suffix
+    else:
+        args.compress = compression_from_path(args.output)
     
     # Check if output directory exists and is writable
     output_dir = os.path.dirname(os.path.abspath(args.output))
@@ -383,6 +596,76 @@ def main():
         logger.error("Split value must be greater than 0")
         sys.exit(1)
     
+    if args.split > 1 and (args.format in STREAMING_FORMATS or args.stream):
+        logger.error("--split is not supported with streaming output")
+        sys.exit(1)
+    
+    if args.dedup_attachments and not args.attachments:
+        logger.error("--dedup-attachments requires -a/--attachments")
+        sys.exit(1)
+    
+    if args.consolidated_metadata and not args.attachments:
+        logger.error("--consolidated-metadata requires -a/--attachments")
+        sys.exit(1)
+    
+    if args.attachment_writers < 0 or args.attachment_queue_size < 1:
+        logger.error("--attachment-writers must be 0 or more and --attachment-queue-size at least 1")
+        sys.exit(1)
+    
+    if args.stream and args.format == 'csv':
+        logger.error("--stream is only supported for JSON output")
+        sys.exit(1)
+    
+    if args.checkpoint_every < 0:
+        logger.error("Checkpoint interval must be 0 or greater")
+        sys.exit(1)
+    
+    if args.resume and args.split > 1:
+        logger.error("--resume is not supported with --split")
+        sys.exit(1)
+    
+    if args.resume and args.format in BINARY_FORMATS:
+        logger.error(f"--resume is not supported with --format {args.format}")
+        sys.exit(1)
+    
+    fields = parse_fields(args.fields) if args.fields is not None else None
+    if fields is not None and not fields:
+        logger.error("--fields needs at least one field name")
+        sys.exit(1)
+    
+    if args.headers_only and args.attachments:
+        logger.error("--headers-only cannot be combined with -a/--attachments, which needs the message bodies")
+        sys.exit(1)
+    
+    if args.headers_only and fields is not None and any(field in BODY_FIELDS for field in fields):
+        logger.error(f"--headers-only cannot output the body fields {', '.join(BODY_FIELDS)}")
+        sys.exit(1)
+    
+    if args.since and args.until and args.since >= args.until:
+        logger.error("--since must be earlier than --until")
+        sys.exit(1)
+    
+    if args.row_group_size < 1:
+        logger.error("Row group size must be at least 1")
+        sys.exit(1)
+    
+    if args.dedup_memory < 1:
+        logger.error("--dedup-memory must be at least 1")
+        sys.exit(1)
+    
+    # The keys of the messages before a checkpoint are not part of it
+    if args.resume and (args.dedup_messages or args.threads):
+        logger.error("--resume is not supported with --dedup-messages or --threads")
+        sys.exit(1)
+    
+    if args.compress and args.format in BINARY_FORMATS:
+        logger.error(f"--compress is not supported with --format {args.format}")
+        sys.exit(1)
+    
+    if args.compress and args.resume:
+        logger.error("--resume is not supported with compressed output")
+        sys.exit(1)
+    
     if args.max_payload_size < 1:
         logger.error("Max payload size must be at least 1MB")
         sys.exit(1)
@@ -398,35 +681,97 @@ def main():
     if args.batch_size < 1:
         logger.error("Batch size must be at least 1")
         sys.exit(1)
+    
+    if args.shard_size is not None and args.shard_size < 1:
+        logger.error("Shard size must be at least 1MB")
+        sys.exit(1)
+    
+    if args.sample_messages < 1:
+        logger.error("--sample-messages must be at least 1")
+        sys.exit(1)
+    
+    if maildir and (args.index or args.resume):
+        logger.error("--index and --resume are not supported with Maildir input")
+        sys.exit(1)
 
+    MBOX = args.filename
+    
+    # Compressed input is decompressed on the fly by the scanner
+    input_compression = None if maildir else detect_compression(MBOX)
+    if input_compression:
+        logger.info(f"Reading {input_compression}-compressed MBOX file")
+        if args.index:
+            logger.error("--index is not supported with compressed input")
+            sys.exit(1)
+    
+    # Get file size for logging and progress reporting
+    file_size = maildir_size(MBOX) if maildir else os.path.getsize(MBOX)
+    file_size_mb = file_size / (1024 * 1024)
+    
+    # Pick up where the previous run committed its last message
+    checkpoint = None
+    start_offset = 0
+    start_index = 0
+    if args.resume:
+        checkpoint = load_checkpoint(args.output)
+        if checkpoint is None:
+            logger.info(f"No checkpoint found at {checkpoint_path(args.output)}, starting from the beginning")
+        else:
+            start_offset = checkpoint["offset"]
+            start_index = checkpoint["next_index"]
+            if checkpoint["input"] != os.path.abspath(MBOX) or checkpoint["format"] != args.format:
+                logger.error(f"Checkpoint {checkpoint_path(args.output)} belongs to a different input file or output format")
+                sys.exit(1)
+            if not os.path.exists(args.output):
+                logger.error(f"Cannot resume, output file is missing: {args.output}")
+                sys.exit(1)
+            # Checkpoint offsets of compressed input refer to the decompressed data
+            data_size = input_size(MBOX) if input_compression else file_size
+            if start_offset > data_size or (start_offset < data_size and not is_message_start(MBOX, start_offset)):
+                logger.error("MBOX file was modified before the last checkpoint, cannot resume")
+                sys.exit(1)
+            if start_offset == data_size:
+                logger.info("No new messages since the last checkpoint")
+                return
+            logger.info(f"Resuming at message {start_index} (byte offset {start_offset})")
+    
+    # Attachments are extracted in the same pass that converts the messages
+    extractor = None
+    extract_options = None
     if args.attachments:
-        # Run extract.py safely without shell=True
-        output_directory = os.path.join(os.path.dirname(args.output), 'attachments', '')
-        extract_script = os.path.join(os.path.dirname(__file__), "extract.py")
-        
+        output_directory = args.attachments_dir or os.path.join(os.path.dirname(args.output), 'attachments', '')
+        extract_args = ["-i", args.filename, "-o", output_directory]
+        if args.dedup_attachments:
+            extract_args.append("--dedup")
+        if args.consolidated_metadata:
+            extract_args.append("--consolidated-metadata")
+        extract_args += ["--writer-threads", str(args.attachment_writers),
+                         "--writer-queue-size", str(args.attachment_queue_size)]
+        extract_options = extract.parse_options(extract_args)
         try:
-            # Use subprocess.run with a list of arguments instead of shell=True
-            result = subprocess.run([
-                sys.executable, extract_script, 
-                "-i", args.filename, 
-                "-o", output_directory
-            ], capture_output=True, text=True, check=True)
-            logger.info("Attachment extraction completed successfully")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error extracting attachments: {e}")
-            logger.error(f"Output: {e.stdout}")
-            logger.error(f"Error: {e.stderr}")
-        except FileNotFoundError:
-            logger.error(f"Extract script not found: {extract_script}")
-            return
+            extractor = extract.Extractor(extract_options)
+            extractor.stream_extraction_map(checkpoint["extraction_map"] if checkpoint else None)
+            if args.consolidated_metadata and checkpoint:
+                extractor.stream_metadata(checkpoint.get("attachment_metadata"))
+        except OSError as e:
+            logger.error(f"Cannot create attachments directory {output_directory}: {e}")
+            sys.exit(1)
 
     logger.info('Initializing MBOX processing...')
-    MBOX = args.filename
     
+    mbox_index = None
     try:
-        mbox = mailbox.mbox(MBOX)
-        msg_count = mbox.__len__()
-        logger.info(f"Found {msg_count} messages in MBOX file")
+        if maildir:
+            msg_count = len(maildir_messages(MBOX))
+            logger.info(f"Found {msg_count} messages in Maildir folder")
+        elif args.index:
+            mbox_index = load_index(MBOX)
+            msg_count = len(mbox_index)
+            logger.info(f"Found {msg_count} messages in MBOX index")
+        else:
+            # Estimate from a sample instead of scanning the whole file for a table of contents
+            msg_count = estimate_message_count(MBOX)
+            logger.info(f"Found approximately {msg_count} messages in MBOX file")
         
         if msg_count == 0:
             logger.warning("MBOX file contains no messages")
@@ -435,189 +780,307 @@ def main():
     except Exception as e:
         logger.error(f"Failed to open MBOX file {MBOX}: {e}")
         sys.exit(1)
-
-    mbox_dict = {}
-    all_attachments = []  # Track all attachments across messages
-    
-    # Get file size for logging
-    file_size_mb = os.path.getsize(args.filename) / (1024 * 1024)
-    
-    # Determine if parallel processing should be used
-    use_parallel = (
-        args.workers > 1 and 
-        (
-            args.enable_parallel or 
-            (msg_count >= 1000 and file_size_mb >= 200.0)
+    
+    # Filters run on the header block before any body parsing or attachment extraction
+    message_filter = MessageFilter(args.since, args.until, args.senders, args.header_match) or None
+    
+    # Duplicates are found and threads resolved on the header block as well, in file order
+    tracker = None
+    if args.dedup_messages or args.threads:
+        tracker = MessageTracker(args.dedup_messages, args.threads, args.dedup_memory)
+    
+    record_options = {
+        "extract_attachments": args.attachments,
+        "skip_metadata": args.skip_attachment_metadata,
+        "max_payload_mb": args.max_payload_size,
+        "max_body_part_mb": args.max_body_part_size,
+        "max_depth": args.max_recursion_depth,
+        "charset_detection": args.charset_detection,
+        "attachment_digests": args.dedup_attachments,
+        "fields": fields,
+        # Only the header block is parsed when no body field is needed
+        "headers_only": not args.attachments and (
+            args.headers_only or (fields is not None and not any(field in BODY_FIELDS for field in fields))
+        ),
+    }
+    
+    try:
+        writer = create_writer(
+            args.output, args.format, stream=args.stream, split=args.split,
+            resume_state=checkpoint["writer"] if checkpoint else None,
+            row_group_size=args.row_group_size, compression=args.compress,
         )
-    )
+    except ImportError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    except OSError as e:
+        logger.error(f"Cannot open output file {args.output}: {e}")
+        sys.exit(1)
     
-    # Log the decision with detailed reasoning
-    if args.workers > 1:
-        if use_parallel:
-            if args.enable_parallel:
-                logger.info(f"Parallel processing force-enabled: {file_size_mb:.1f}MB, {msg_count} messages")
-            else:
-                logger.info(f"File qualifies for parallel processing: {file_size_mb:.1f}MB, {msg_count} messages")
+    # Attachment metadata is streamed to its manifest as each message is processed
+    manifest = None
+    if args.attachments and not args.skip_attachment_metadata:
+        manifest = LazyJsonArrayWriter(
+            manifest_path(args.output),
+            resume_state=checkpoint["manifest"] if checkpoint else None,
+            compression=args.compress,
+        )
+    
+    # Checkpoints are only kept for runs that ask to be resumable; outputs that cannot be
+    # appended to were rejected with --resume above
+    use_checkpoints = args.resume and args.checkpoint_every > 0
+    
+    def build_checkpoint(offset, next_index, writer_state):
+        return {
+            "input": os.path.abspath(MBOX),
+            "format": args.format,
+            "offset": offset,
+            "next_index": next_index,
+            "writer": writer_state,
+            "manifest": manifest.state() if manifest is not None else None,
+            "extraction_map": extractor.extraction_map_state() if extractor is not None else None,
+            "attachment_metadata": extractor.metadata_state() if extractor is not None else None,
+        }
+    
+    def commit(offset, next_index):
+        """Flush every output and record the last fully written message."""
+        if not use_checkpoints or not writer.resumable:
+            return
+        writer.flush()
+        if manifest is not None:
+            manifest.flush()
+        save_checkpoint(args.output, build_checkpoint(offset, next_index, writer.state()))
+    
+    # Determine if parallel processing should be used, and with how many workers
+    requested_workers = (os.cpu_count() or 1) if args.workers == AUTO else args.workers
+    max_workers = min(requested_workers, os.cpu_count() or 1, msg_count)
+    shard_bytes = (args.shard_size or DEFAULT_SHARD_SIZE_MB) * 1024 * 1024
+    use_parallel = False
+    sampling = False
+    if max_workers > 1:
+        if input_compression:
+            logger.info("Using serial processing: compressed input cannot be split into shards")
+        elif maildir:
+            logger.info("Using serial processing: Maildir messages are read one file at a time")
+        elif args.enable_parallel:
+            use_parallel = True
+            logger.info(f"Parallel processing force-enabled: {file_size_mb:.1f}MB, {msg_count} messages")
         else:
-            reasons = []
-            if msg_count < 1000:
-                reasons.append(f"message count too low ({msg_count} < 1000)")
-            if file_size_mb < 200.0:
-                reasons.append(f"file size too small ({file_size_mb:.1f}MB < 200.0MB)")
-            logger.info(f"Using serial processing: {', '.join(reasons)}. Use --enable-parallel to override.")
-    
-    # Determine number of workers
-    max_workers = min(args.workers, mp.cpu_count(), msg_count) if use_parallel else 1
-    
-    if use_parallel:
-        logger.info(f"Using parallel processing with {max_workers} workers for {msg_count} messages ({file_size_mb:.1f}MB file)")
-        # Prepare message data for parallel processing
-        message_data = []
-        for i, msg in enumerate(mbox):
-            msg_str = str(msg)  # Convert message to string for pickling
-            message_data.append((
-                msg_str, i, args.attachments, args.skip_attachment_metadata,
-                args.max_payload_size, args.max_body_part_size, args.max_recursion_depth
-            ))
-        
-        # Process in parallel using multiprocessing
-        with mp.Pool(processes=max_workers) as pool:
-            with alive_bar(msg_count) as bar:
-                # Process messages in batches to manage memory
-                batch_size = args.batch_size
-                for batch_start in range(0, len(message_data), batch_size):
-                    batch_end = min(batch_start + batch_size, len(message_data))
-                    batch_data = message_data[batch_start:batch_end]
-                    
-                    # Process batch in parallel
-                    batch_results = pool.map(process_message_worker, batch_data)
-                    
-                    # Collect results
-                    for result in batch_results:
-                        msg_idx = result.pop("index")
-                        mbox_dict[msg_idx] = result
-                        
-                        # Collect attachments
-                        if "Attachments" in result and result["Attachments"]:
-                            all_attachments.extend(result["Attachments"])
-                        
-                        bar()
-                    
-                    # Memory cleanup after each batch
-                    gc.collect()
-                    logger.info(f"Completed batch {batch_start//batch_size + 1}/{(len(message_data) + batch_size - 1)//batch_size}")
+            sampling = True
     
-    else:
-        # Serial processing for small files or when parallel processing is disabled
-        logger.info(f"Using serial processing for {msg_count} messages ({file_size_mb:.1f}MB file)")
-        process_batch_size = args.batch_size
-        
-        with alive_bar(msg_count) as bar:
-            for i, msg in enumerate(mbox):
-                mbox_dict[i] = {}
-                bar()
+    def choose_parallelism(sample, remaining_bytes):
+        """Decide from the messages converted so far how to convert the rest, returning a tuning.ParallelPlan."""
+        costs = sample.costs(remaining_bytes)
+        plan = plan_parallelism(costs, remaining_bytes, max_workers)
+        stats.describe(sample=costs._asdict(), plan=plan._asdict())
+        logger.info(describe_costs(costs))
+        if plan.parallel_seconds is None:
+            logger.info(f"Using serial processing: the remaining {remaining_bytes / (1024 * 1024):.1f}MB take an "
+                        f"estimated {plan.serial_seconds:.2f}s, less than starting workers")
+        else:
+            estimate = (f"estimated {plan.serial_seconds:.2f}s serial, "
+                        f"{plan.parallel_seconds:.2f}s with {plan.workers} workers")
+            if plan.parallel:
+                logger.info(f"Using parallel processing for the rest: {estimate}")
+            else:
+                logger.info(f"Using serial processing: {estimate}. Use --enable-parallel to override.")
+        return plan
+    
+    msg_idx = start_index
+    committed_offset = start_offset
+    last_commit_idx = start_index
+    skipped = 0
+    duplicates = 0
+    
+    # The decompressed size of compressed input is not known up front
+    progress_total = None if input_compression else file_size - start_offset
+    with progress_bar(args.progress, progress_total, unit='B', scale='SI') as bar:
+        if not use_parallel:
+            if sampling:
+                # The first messages are converted and written serially while measuring what they cost
+                logger.info(f"Converting the first {args.sample_messages} messages serially to choose between "
+                            f"serial and parallel processing")
+            else:
+                logger.info(f"Using serial processing for {msg_count} messages ({file_size_mb:.1f}MB file)")
+            process_batch_size = args.batch_size
+            
+            messages = scan_maildir(MBOX) if maildir else scan_mbox(MBOX, start=start_offset)
+            results = convert_messages(messages, record_options, extractor, message_filter, tracker, start_index)
+            sample = Sample(results, args.sample_messages) if sampling else None
+            for i, (offset, length, record, identity) in enumerate(sample or results, start_index):
+                bar(length)
                 
                 # Memory cleanup every batch
-                if i > 0 and i % process_batch_size == 0:
+                if i > start_index and i % process_batch_size == 0:
                     gc.collect()  # Force garbage collection
                     logger.info(f"Processed {i} messages, running garbage collection")
                 
-                for header in msg.keys():
-                    # Decode MIME-encoded headers
-                    raw_header_value = msg[header]
-                    decoded_header_value = decode_mime_header(raw_header_value)
-                    mbox_dict[i][header] = decoded_header_value
-                try:
-                    mbox_dict[i]["Body"] = getBody(
-                        msg, 
-                        max_payload_mb=args.max_payload_size,
-                        max_body_part_mb=args.max_body_part_size,
-                        max_depth=args.max_recursion_depth
-                    )
-                    
-                    # Extract attachment information only if attachments flag is used and not skipping metadata
-                    if args.attachments and not args.skip_attachment_metadata:
-                        attachments = extract_attachments_info(msg, i)
-                        mbox_dict[i]["Attachments"] = attachments
-                        mbox_dict[i]["Attachment_Count"] = len(attachments)
-                        
-                        # Add to global attachment list with message reference
-                        for att in attachments:
-                            att["source_message_index"] = i
-                            att["extracted_with"] = "mbox-to-json v2.0.0"
-                            all_attachments.append(att)
-                        
-                except Exception as e:
-                    logger.error(f"Error occurred at message {i}: {e}")
-                    mbox_dict[i]["Body"] = ""  # Set empty body on error
-                    if args.attachments and not args.skip_attachment_metadata:
-                        mbox_dict[i]["Attachments"] = []
-                        mbox_dict[i]["Attachment_Count"] = 0
-
-    # Convert mbox_dict to DataFrame
-    df = pd.DataFrame.from_dict(mbox_dict, orient="index")
-
-    # Sanitize the DataFrame values - apply to all elements
-    try:
-        # Use map() for element-wise application on the entire DataFrame
-        for col in df.columns:
-            df[col] = df[col].apply(lambda x: sanitize_string(x) if isinstance(x, str) else x)
-        logger.info("DataFrame sanitization completed")
-    except Exception as e:
-        logger.error(f"Error during DataFrame sanitization: {e}")
-        # Continue without sanitization if it fails
-
-    # Split DataFrame if needed
-    if args.split > 1:
-        df_chunks = split_dataframe(df, args.split)
-        for idx, chunk in enumerate(df_chunks):
-            chunk_output = f"{os.path.splitext(args.output)[0]}_part{idx + 1}{os.path.splitext(args.output)[1]}"
-            try:
-                if args.csv:
-                    chunk.to_csv(chunk_output, index=False)
+                if record is None:
+                    if identity is not None and identity.duplicate:
+                        duplicates += 1
+                        stats.count("messages_duplicate")
+                    else:
+                        skipped += 1
                 else:
-                    chunk.to_json(chunk_output, orient="records", index=False, force_ascii=False)
-                logger.info(f"Saved: {chunk_output}")
-            except Exception as e:
-                logger.error(f"Failed to save chunk {idx + 1}: {e}")
-        
-        # Save attachments manifest for split files
-        if all_attachments and args.attachments and not args.skip_attachment_metadata:
-            attachments_file = f"{os.path.splitext(args.output)[0]}_attachments_manifest.json"
-            try:
-                with open(attachments_file, 'w', encoding='utf-8') as f:
-                    json.dump(all_attachments, f, indent=2, ensure_ascii=False)
-                logger.info(f"Saved attachments manifest: {attachments_file}")
-            except Exception as e:
-                logger.error(f"Failed to save attachments manifest: {e}")
+                    if args.threads and identity is not None:
+                        record["Thread_Id"] = tracker.thread_id(identity)
+                    with stats.timer("write"):
+                        writer.write(i, record)
+                    
+                    if manifest is not None:
+                        manifest.write(record.get("Attachments"))
                 
-    else:
-        # Save to the appropriate output format
-        try:
-            if args.csv:
-                df.to_csv(args.output, index=False)
+                msg_idx = i + 1
+                committed_offset = offset + length
+                if msg_idx - last_commit_idx >= args.checkpoint_every:
+                    commit(committed_offset, msg_idx)
+                    last_commit_idx = msg_idx
+                
+                if sampling and sample.full():
+                    sampling = False
+                    plan = choose_parallelism(sample, file_size - committed_offset)
+                    if plan.parallel:
+                        use_parallel = True
+                        max_workers = plan.workers
+                        if args.shard_size is None:
+                            shard_bytes = plan.shard_bytes
+                        break
+            results.close()
+            if sampling:
+                logger.info(f"Converted all {msg_idx - start_index} messages serially while sampling")
+        
+        if use_parallel:
+            logger.info(f"Using parallel processing with {max_workers} workers for "
+                        f"{(file_size - committed_offset) / (1024 * 1024):.1f}MB of the {file_size_mb:.1f}MB file")
+            window = max_workers * INFLIGHT_SHARDS_PER_WORKER
+            
+            # Only message-aligned byte offsets are computed here; workers read the file themselves
+            shard_count = max(window, -(-(file_size - committed_offset) // shard_bytes))
+            if mbox_index is not None:
+                shard_ranges = mbox_index.shards(shard_count, start=committed_offset)
             else:
-                df.to_json(args.output, orient="records", index=False, force_ascii=False)
-            logger.info(f"Successfully saved output to: {args.output}")
+                shard_ranges = compute_shards(MBOX, shard_count, start=committed_offset)
+            # Workers drop the duplicates within their shard; those across shards and threads are resolved here
+            tracking = {"dedup": tracker.dedup, "threads": tracker.threads} if tracker is not None else None
+            instrumentation = {
+                "slowest": args.stats_slowest if stats.enabled else None,
+                "profile_dir": args.profile_dir,
+            }
+            shards = [
+                (MBOX, start, end, record_options, extract_options, message_filter, tracking, instrumentation)
+                for start, end in shard_ranges
+            ]
+            logger.info(f"Split MBOX file into {len(shards)} shards of about {shard_bytes / (1024 * 1024):.1f}MB")
+            
+            # Process in parallel using multiprocessing, writing results while later shards are still parsing
+            import multiprocessing as mp
             
-            # Save separate attachments manifest
-            if all_attachments and args.attachments and not args.skip_attachment_metadata:
-                attachments_file = f"{os.path.splitext(args.output)[0]}_attachments_manifest.json"
-                try:
-                    with open(attachments_file, 'w', encoding='utf-8') as f:
-                        json.dump(all_attachments, f, indent=2, ensure_ascii=False)
-                    logger.info(f"Saved attachments manifest: {attachments_file}")
-                except Exception as e:
-                    logger.error(f"Failed to save attachments manifest: {e}")
+            with mp.Pool(processes=max_workers) as pool:
+                results = imap_bounded(pool, process_shard_worker, shards, window)
+                for shard, (shard_results, extraction, shard_stats) in zip(shards, results):
+                    # Duplicates of messages in earlier shards are found before their attachments are merged
+                    shard_dropped = shard_duplicates(shard_results, tracker)
+                    if extraction is not None:
+                        extract.merge_shard_extraction(extractor, index_offset=msg_idx, dropped=shard_dropped,
+                                                       **extraction)
+                    if shard_stats is not None:
+                        stats.merge(shard_stats, index_offset=msg_idx)
                     
+                    for local_index, (length, result, identity) in enumerate(shard_results):
+                        if local_index in shard_dropped:
+                            duplicates += 1
+                            stats.count("messages_duplicate")
+                            msg_idx += 1
+                            bar(length)
+                            continue
+                        if result is None:
+                            skipped += 1
+                            msg_idx += 1
+                            bar(length)
+                            continue
+                        renumber_record(result, msg_idx)
+                        if args.threads and identity is not None:
+                            result["Thread_Id"] = tracker.thread_id(identity)
+                        with stats.timer("write"):
+                            writer.write(msg_idx, result)
+                        
+                        if manifest is not None:
+                            manifest.write(result.get("Attachments"))
+                        
+                        msg_idx += 1
+                        bar(length)
+                    
+                    committed_offset = shard[2]
+                    if msg_idx - last_commit_idx >= args.checkpoint_every:
+                        commit(committed_offset, msg_idx)
+                        last_commit_idx = msg_idx
+    
+    if not use_parallel:
+        max_workers = 1
+    
+    if message_filter:
+        logger.info(f"Skipped {skipped} of {msg_idx - start_index} messages that did not match the filters")
+    
+    if tracker is not None:
+        if args.dedup_messages:
+            logger.info(f"Dropped {duplicates} duplicate messages")
+        tracker.close()
+    
+    # Streaming outputs are checkpointed before their closing brackets are written
+    final_checkpoint = None
+    if use_checkpoints:
+        writer.flush()
+        if manifest is not None:
+            manifest.flush()
+        final_checkpoint = build_checkpoint(committed_offset, msg_idx, writer.state() if writer.resumable else None)
+    
+    if extractor is not None:
+        extractor.save_extraction_map()
+        extractor.save_metadata()
+        extract.report_extraction(extractor)
+    
+    if manifest is not None:
+        try:
+            if manifest.close():
+                logger.info(f"Saved attachments manifest: {manifest.output}")
         except Exception as e:
-            logger.error(f"Failed to save output file {args.output}: {e}")
-            sys.exit(1)
+            logger.error(f"Failed to save attachments manifest: {e}")
+    
+    # Save to the appropriate output format
+    try:
+        with stats.timer("finalize"):
+            writer.close()
+        if args.split <= 1:
+            logger.info(f"Successfully saved output to: {args.output}")
+    except Exception as e:
+        logger.error(f"Failed to save output file {args.output}: {e}")
+        sys.exit(1)
+    
+    if final_checkpoint is not None:
+        if not writer.resumable:
+            final_checkpoint["writer"] = writer.state()
+        save_checkpoint(args.output, final_checkpoint)
+    
+    summary = {
+        "input": os.path.abspath(MBOX),
+        "input_bytes": file_size,
+        "output": os.path.abspath(args.output),
+        "format": args.format,
+        "mode": "parallel" if use_parallel else "serial",
+        "workers": max_workers,
+        "messages": msg_idx - start_index,
+        "skipped": skipped,
+        "duplicates": duplicates,
+        "bytes_out": output_size(args.output, args.split, manifest),
+    }
+    stats.describe(**summary)
+    return summary
 
 
 if __name__ == "__main__":
     # Set multiprocessing start method for cross-platform compatibility
     if sys.platform == 'win32':
+        import multiprocessing as mp
         mp.set_start_method('spawn', force=True)
     # Calling the main function
     main()
\ No newline at end of file
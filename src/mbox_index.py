@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import math
+import os
+import struct
+from email.utils import parsedate_to_datetime
+
+try:
+    from .scanner import scan_mbox, parse_message, parse_headers, is_message_start
+except ImportError:
+    from scanner import scan_mbox, parse_message, parse_headers, is_message_start
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'MBXIDX1\0'
+
+# magic, mbox size, mbox mtime (ns), number of entries
+HEADER = struct.Struct('<8sQqQ')
+# byte offset, length, Message-ID hash, Date as a POSIX timestamp (NaN when missing)
+ENTRY = struct.Struct('<QQ8sd')
+
+NO_MESSAGE_ID = b'\0' * 8
+
+
+def index_path(mbox_path):
+    """Returns the path of the sidecar index that belongs to an MBOX file."""
+    return mbox_path + INDEX_SUFFIX
+
+
+def message_id_hash(message_id):
+    """Returns the 8-byte hash stored in the index for a Message-ID header."""
+    if not message_id:
+        return NO_MESSAGE_ID
+    return hashlib.blake2b(message_id.strip().encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+
+
+def make_entry(offset, length, raw):
+    """Builds the packed index entry for one message from its header block only."""
+    headers = parse_headers(raw)
+
+    try:
+        date = parsedate_to_datetime(headers['Date']).timestamp()
+    except Exception:
+        date = math.nan
+
+    return ENTRY.pack(offset, length, message_id_hash(headers['Message-ID']), date)
+
+
+class MboxIndex:
+    """Byte offsets, lengths, Message-ID hashes and dates of every message in an MBOX file."""
+
+    def __init__(self, mbox_path, entries=b''):
+        self.mbox_path = mbox_path
+        self.entries = bytearray(entries)
+
+    def __len__(self):
+        return len(self.entries) // ENTRY.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return ENTRY.unpack_from(self.entries, i * ENTRY.size)
+
+    def __iter__(self):
+        return ENTRY.iter_unpack(self.entries)
+
+    def end(self):
+        """Returns the byte offset just after the last indexed message."""
+        if not self.entries:
+            return 0
+        offset, length, _, _ = self[-1]
+        return offset + length
+
+    def add(self, offset, length, raw):
+        self.entries += make_entry(offset, length, raw)
+
+    def iter_messages(self, start=0, stop=None):
+        """Yield (index, offset, length, raw bytes) for messages `start` to `stop` by seeking directly to them."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        with open(self.mbox_path, 'rb') as f:
+            for i in range(start, stop):
+                offset, length, _, _ = self[i]
+                f.seek(offset)
+                yield i, offset, length, f.read(length)
+
+    def get_message(self, i):
+        """Parse message `i` without scanning the file."""
+        for _, _, _, raw in self.iter_messages(i, i + 1):
+            return parse_message(raw)
+        raise KeyError(i)
+
+    def shards(self, shard_count, start=0):
+        """Split the messages from byte `start` on into at most `shard_count` (start, end) byte ranges of similar size."""
+        offsets = [offset for offset, _, _, _ in self if offset >= start]
+        if not offsets:
+            return []
+        first = offsets[0]
+        total = self.end() - first
+        shard_count = max(1, min(shard_count, len(offsets)))
+
+        shards = []
+        shard_start = first
+        target = total / shard_count
+        for offset in offsets:
+            if offset > shard_start and offset - first >= target * (len(shards) + 1):
+                shards.append((shard_start, offset))
+                shard_start = offset
+        shards.append((shard_start, self.end()))
+        return shards
+
+    def save(self):
+        """Write the index next to the MBOX file, replacing any previous one atomically."""
+        stat = os.stat(self.mbox_path)
+        path = index_path(self.mbox_path)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(self)))
+            f.write(self.entries)
+        os.replace(tmp_path, path)
+
+
+def read_index(mbox_path):
+    """Read the sidecar index.
+
+    Returns (index, mbox size, mbox mtime) as recorded in the index, or None when it is missing or unreadable.
+    """
+    path = index_path(mbox_path)
+    try:
+        with open(path, 'rb') as f:
+            magic, size, mtime_ns, count = HEADER.unpack(f.read(HEADER.size))
+            entries = f.read(count * ENTRY.size)
+    except (OSError, struct.error):
+        return None
+
+    if magic != INDEX_MAGIC or len(entries) != count * ENTRY.size:
+        logger.warning(f"Ignoring invalid MBOX index: {path}")
+        return None
+    return MboxIndex(mbox_path, entries), size, mtime_ns
+
+
+def build_index(mbox_path):
+    """Index every message of an MBOX file and save the result."""
+    index = MboxIndex(mbox_path)
+    for offset, length, raw in scan_mbox(mbox_path):
+        index.add(offset, length, raw)
+    index.save()
+    return index
+
+
+def extend_index(index):
+    """Index the messages appended after the end of `index` and append them to the sidecar file in place."""
+    known = len(index)
+    for offset, length, raw in scan_mbox(index.mbox_path, start=index.end()):
+        index.add(offset, length, raw)
+
+    stat = os.stat(index.mbox_path)
+    with open(index_path(index.mbox_path), 'r+b') as f:
+        f.seek(HEADER.size + known * ENTRY.size)
+        f.write(index.entries[known * ENTRY.size:])
+        f.truncate()
+        # The header is updated last, so an interrupted update leaves a valid (shorter) index
+        f.seek(0)
+        f.write(HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(index)))
+    return index
+
+
+def load_index(mbox_path):
+    """Return an up to date index for an MBOX file, building or extending the sidecar file as needed.
+
+    An index is reused as is when the MBOX size and mtime match, extended in place when the
+    file has only grown since it was written, and rebuilt otherwise.
+    """
+    stat = os.stat(mbox_path)
+    result = read_index(mbox_path)
+
+    if result is not None:
+        index, size, mtime_ns = result
+        if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+            return index
+        if size < stat.st_size and index.end() == size and is_message_start(mbox_path, size):
+            logger.info(f"MBOX file grew by {stat.st_size - size} bytes, extending index")
+            return extend_index(index)
+        logger.info("MBOX file changed since it was indexed, rebuilding index")
+    else:
+        logger.info(f"Building MBOX index: {index_path(mbox_path)}")
+
+    return build_index(mbox_path)
@@ -0,0 +1,157 @@
+import binascii
+import hashlib
+import quopri
+
+# Number of encoded characters decoded at a time
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+BASE64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='
+NOT_BASE64 = bytes(sorted(set(range(256)) - set(BASE64_ALPHABET)))
+
+UUENCODE = ('x-uuencode', 'uuencode', 'uue', 'x-uue')
+
+# Errors raised by the chunked decoders on malformed payloads
+DECODE_ERRORS = (binascii.Error, ValueError, UnicodeError)
+
+
+def transfer_encoding(part):
+    return str(part.get('content-transfer-encoding', '')).lower()
+
+
+def raw_payload(part):
+    """Return the payload of a non-multipart part as stored in the message, before transfer decoding.
+
+    Text that is not pure ASCII is returned as the bytes get_payload(decode=True) makes
+    of it instead, as get_payload() replaces the undecodable bytes it holds; callers
+    treat bytes payloads as already decoded.
+    """
+    if part.is_multipart():
+        return None
+    payload = part.get_payload()
+    if isinstance(payload, str) and not payload.isascii():
+        return part.get_payload(decode=True)
+    return payload
+
+
+def to_bytes(text):
+    """Convert stored payload text back to bytes the way email.message.Message.get_payload() does."""
+    try:
+        return text.encode('ascii', 'surrogateescape')
+    except UnicodeError:
+        return text.encode('raw-unicode-escape')
+
+
+def encoded_size(part):
+    """Return the decoded size of a part's payload, computed from its encoded form without decoding it.
+
+    The size is exact for base64 and unencoded payloads and a close estimate for
+    quoted-printable and uuencoded ones.
+    """
+    payload = raw_payload(part)
+    if not payload:
+        return 0
+    if isinstance(payload, bytes):
+        return len(payload)
+
+    cte = transfer_encoding(part)
+    if cte == 'base64':
+        length = len(payload) - sum(payload.count(c) for c in '\r\n\t ')
+        padding = payload[-100:].rstrip().count('=')
+        return max(0, length * 3 // 4 - padding)
+    if cte == 'quoted-printable':
+        # "=XX" escapes and soft line breaks shrink by two characters, CRLF line ends become LF
+        return max(0, len(payload) - 2 * payload.count('=') - payload.count('\r\n'))
+    if cte in UUENCODE:
+        return len(payload) * 3 // 4
+    return len(payload)
+
+
+def iter_base64(payload, chunk_size=DEFAULT_CHUNK_SIZE):
+    carry = b''
+    for start in range(0, len(payload), chunk_size):
+        data = carry + to_bytes(payload[start:start + chunk_size]).translate(None, NOT_BASE64)
+        if b'=' in data:
+            # Padding ends the data, anything after it is ignored
+            yield binascii.a2b_base64(data)
+            return
+        usable = len(data) - len(data) % 4
+        carry = data[usable:]
+        if usable:
+            yield binascii.a2b_base64(data[:usable])
+    # Like the email package, tolerate a last group that lacks its padding
+    if len(carry) > 1:
+        yield binascii.a2b_base64(carry + b'=' * (-len(carry) % 4))
+
+
+def iter_quoted_printable(payload, chunk_size=DEFAULT_CHUNK_SIZE):
+    start = 0
+    while start < len(payload):
+        # Cut after a line end, so that no escape sequence or soft line break is split
+        end = payload.find('\n', start + chunk_size)
+        end = len(payload) if end == -1 else end + 1
+        yield quopri.decodestring(to_bytes(payload[start:end]))
+        start = end
+
+
+def iter_decoded(part, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the transfer-decoded payload of a part in chunks of about `chunk_size` bytes.
+
+    Raises one of DECODE_ERRORS on payloads the chunked decoders cannot handle.
+    """
+    payload = raw_payload(part)
+    if not payload:
+        return
+    if isinstance(payload, bytes):
+        yield payload
+        return
+
+    cte = transfer_encoding(part)
+    if cte == 'base64':
+        yield from iter_base64(payload, chunk_size)
+    elif cte == 'quoted-printable':
+        yield from iter_quoted_printable(payload, chunk_size)
+    elif cte in UUENCODE:
+        yield part.get_payload(decode=True)
+    else:
+        for start in range(0, len(payload), chunk_size):
+            yield to_bytes(payload[start:start + chunk_size])
+
+
+def write_payload(part, f, digest=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Decode the payload of a part into the binary file `f` chunk by chunk.
+
+    Returns the number of bytes written and, with `digest`, the SHA-256 of the content.
+    Malformed payloads are written with the lenient decoder of the email package instead.
+    """
+    start = f.tell()
+    sha256 = hashlib.sha256() if digest else None
+    size = 0
+    try:
+        for chunk in iter_decoded(part, chunk_size):
+            f.write(chunk)
+            size += len(chunk)
+            if sha256 is not None:
+                sha256.update(chunk)
+    except DECODE_ERRORS:
+        f.seek(start)
+        f.truncate()
+        payload = part.get_payload(decode=True) or b''
+        f.write(payload)
+        size = len(payload)
+        sha256 = hashlib.sha256(payload) if digest else None
+    return size, sha256.hexdigest() if sha256 is not None else None
+
+
+def payload_digest(part, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Returns the decoded size and SHA-256 of a part's payload without holding it in memory."""
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in iter_decoded(part, chunk_size):
+            sha256.update(chunk)
+            size += len(chunk)
+    except DECODE_ERRORS:
+        payload = part.get_payload(decode=True) or b''
+        sha256 = hashlib.sha256(payload)
+        size = len(payload)
+    return size, sha256.hexdigest()
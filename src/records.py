@@ -0,0 +1,559 @@
+"""Builds plain dict records from MBOX messages.
+
+This is the library side of the converter: it has no pandas or progress bar dependency
+and configures no logging, so it can be embedded in other programs. iter_records() is
+the entry point; the command line tool in main.py builds on the same functions.
+"""
+import copy
+import logging
+import os
+import time
+from collections import deque
+from email.header import decode_header
+
+try:
+    from . import extract
+    from .charsets import get_decoder, sender_domain
+    from .compression import detect_compression
+    from .dedup import DEFAULT_MEMORY_KEYS, MessageTracker
+    from .payloads import encoded_size, payload_digest
+    from .scanner import compute_shards, parse_headers, parse_message, scan_mbox
+    from .stats import get_stats, profiled, reset_stats
+except ImportError:
+    import extract
+    from charsets import get_decoder, sender_domain
+    from compression import detect_compression
+    from dedup import DEFAULT_MEMORY_KEYS, MessageTracker
+    from payloads import encoded_size, payload_digest
+    from scanner import compute_shards, parse_headers, parse_message, scan_mbox
+    from stats import get_stats, profiled, reset_stats
+
+logger = logging.getLogger(__name__)
+
+# Target size of the byte ranges parsed by each parallel worker task
+DEFAULT_SHARD_SIZE_MB = 16
+
+# Number of shards kept in flight per worker in parallel mode
+INFLIGHT_SHARDS_PER_WORKER = 2
+
+
+def getBody(msg, max_payload_mb=10, max_body_part_mb=1, max_depth=50, charset_detection='auto'):
+    """Extracts the body from the email, handling different encodings and errors."""
+    body_parts = []
+    max_payload_bytes = max_payload_mb * 1000000
+    max_body_part_bytes = max_body_part_mb * 1000000
+    decoder = get_decoder(charset_detection)
+    sender_hint = sender_domain(msg)
+    
+    def extract_text_parts(part, depth=0):
+        """Recursively extract text parts from multipart messages."""
+        if depth > max_depth:
+            logger.warning(f"Maximum recursion depth reached ({max_depth}). Truncating email parsing.")
+            return
+        
+        if part.is_multipart():
+            try:
+                payload = part.get_payload()
+                if payload:
+                    for subpart in payload:
+                        extract_text_parts(subpart, depth + 1)
+            except (TypeError, AttributeError) as e:
+                logger.warning(f"Error processing multipart payload at depth {depth}: {e}")
+        else:
+            content_type = part.get_content_type()
+            # Extract text/plain and text/html parts
+            if content_type in ['text/plain', 'text/html']:
+                try:
+                    raw_payload = part.get_payload(decode=True)
+                    if raw_payload:
+                        decoded_body = decode_payload(raw_payload, part.get_content_charset())
+                        if decoded_body:
+                            # Limit body part size to prevent memory issues
+                            if len(decoded_body) > max_body_part_bytes:
+                                decoded_body = decoded_body[:max_body_part_bytes] + f"\n[TRUNCATED - Content too large (>{max_body_part_mb}MB)]"
+                            body_parts.append(f"[{content_type}]: {decoded_body}")
+                except Exception as e:
+                    logger.warning(f"Error extracting text part: {e}")
+    
+    def decode_payload(raw_payload, declared_charset=None):
+        """Helper function to decode payload, trusting the declared charset before running detection."""
+        if raw_payload is None:
+            return ""
+        
+        # Limit payload size to prevent memory issues
+        if len(raw_payload) > max_payload_bytes:
+            logger.warning(f"Payload too large ({len(raw_payload)} bytes), truncating to {max_payload_mb}MB")
+            raw_payload = raw_payload[:max_payload_bytes]
+        
+        return decoder.decode(raw_payload, declared_charset, sender_hint)
+    
+    # Handle both multipart and single part messages
+    try:
+        if msg.is_multipart():
+            extract_text_parts(msg)
+            return "\n\n".join(body_parts) if body_parts else ""
+        else:
+            # Single part message
+            raw_payload = msg.get_payload(decode=True)
+            if raw_payload is None:
+                logger.warning(f"No payload for message {msg}")
+                return ""
+            return decode_payload(raw_payload, msg.get_content_charset())
+    except RecursionError:
+        logger.error("Maximum recursion depth exceeded while parsing email body")
+        return "[ERROR: Email structure too complex to parse]"
+    except MemoryError:
+        logger.error("Out of memory while parsing email body")
+        return "[ERROR: Email too large to parse]"
+    except Exception as e:
+        logger.error(f"Unexpected error parsing email body: {e}")
+        return "[ERROR: Failed to parse email body]"
+
+
+def extract_attachments_info(msg, message_id, digests=False, blob_digests=None):
+    """Extract attachment information without saving files.
+    
+    Sizes are computed from the encoded payload, without decoding it. With `digests`
+    each entry also carries the SHA-256 of the decoded payload, which is the name of
+    the attachment in the deduplicated attachment store, and the size is exact. They
+    are taken from `blob_digests`, as returned by extract.process_message(), for the
+    parts already stored there; other payloads are decoded in chunks.
+    """
+    attachments = []
+    
+    def process_part(part):
+        if part.is_multipart():
+            for subpart in part.get_payload():
+                process_part(subpart)
+        else:
+            # Check if this part is an attachment
+            content_disposition = part.get_content_disposition()
+            content_type = part.get_content_type()
+            filename = part.get_filename()
+            
+            is_attachment = False
+            
+            # Determine if this is an attachment
+            if content_disposition == 'attachment':
+                is_attachment = True
+            elif filename is not None and content_disposition != 'inline':
+                is_attachment = True
+            elif (content_type.startswith('application/') and content_type != 'application/javascript') \
+                    or content_type.startswith('model/') \
+                    or content_type.startswith('audio/') \
+                    or content_type.startswith('video/'):
+                is_attachment = True
+            
+            if is_attachment and filename:
+                # Decode filename if needed
+                try:
+                    decoded_name = decode_header(filename)
+                    if isinstance(decoded_name[0][0], bytes):
+                        name_encoding = decoded_name[0][1] or 'utf-8'
+                        filename = decoded_name[0][0].decode(name_encoding)
+                    else:
+                        filename = decoded_name[0][0]
+                except:
+                    # Keep original filename if decoding fails
+                    pass
+                
+                # Get file size
+                digest = None
+                try:
+                    if digests:
+                        stored = blob_digests.get(id(part)) if blob_digests else None
+                        file_size, digest = stored or payload_digest(part)
+                    else:
+                        file_size = encoded_size(part)
+                except:
+                    file_size = 0
+                
+                attachment_info = {
+                    'filename': filename,
+                    'content_type': content_type,
+                    'content_disposition': content_disposition,
+                    'size_bytes': file_size,
+                    'message_id': message_id
+                }
+                if digests:
+                    attachment_info['sha256'] = digest
+                attachments.append(attachment_info)
+    
+    if msg.is_multipart():
+        process_part(msg)
+    
+    return attachments
+
+
+# Record fields computed from the message body rather than its headers
+BODY_FIELDS = ('Body', 'Attachments', 'Attachment_Count')
+
+
+def parse_fields(value):
+    """Split the comma separated --fields value into field names."""
+    return tuple(field.strip() for field in value.split(',') if field.strip())
+
+
+def message_to_record(msg, msg_index, extract_attachments=False, skip_metadata=False,
+                      max_payload_mb=10, max_body_part_mb=1, max_depth=50, charset_detection='auto',
+                      attachment_digests=False, fields=None, headers_only=False, blob_digests=None):
+    """Build the output record for a single parsed message.
+    
+    `fields` restricts the record to the named headers and body fields, and only those
+    headers are decoded. With `headers_only`, `msg` holds just the header block, as
+    returned by parse_headers(), and no body fields are produced. `blob_digests` are
+    the digests of the attachments already stored, see extract_attachments_info().
+    """
+    record = {}
+    stats = get_stats()
+    
+    # Extract headers with MIME decoding
+    headers = msg.keys() if fields is None else [field for field in fields if field not in BODY_FIELDS]
+    with stats.timer("header_decode"):
+        for header in headers:
+            raw_header_value = msg[header]
+            if raw_header_value is None:
+                continue
+            decoded_header_value = decode_mime_header(raw_header_value)
+            record[header] = decoded_header_value
+    
+    if headers_only:
+        return record
+    
+    try:
+        if fields is None or "Body" in fields:
+            with stats.timer("body_decode"):
+                record["Body"] = getBody(
+                    msg,
+                    max_payload_mb=max_payload_mb,
+                    max_body_part_mb=max_body_part_mb,
+                    max_depth=max_depth,
+                    charset_detection=charset_detection
+                )
+        
+        # Extract attachment information only if attachments flag is used and not skipping metadata.
+        # It is kept even when --fields leaves it out, as the attachments manifest is built from it
+        if extract_attachments and not skip_metadata:
+            with stats.timer("attachment_info"):
+                attachments = extract_attachments_info(msg, msg_index, digests=attachment_digests,
+                                                       blob_digests=blob_digests)
+            record["Attachments"] = attachments
+            record["Attachment_Count"] = len(attachments)
+            
+            # Add metadata to attachments
+            for att in attachments:
+                att["source_message_index"] = msg_index
+                att["extracted_with"] = "mbox-to-json v2.0.0"
+    
+    except Exception as e:
+        logger.error(f"Error occurred at message {msg_index}: {e}")
+        record["Body"] = ""  # Set empty body on error
+        if extract_attachments and not skip_metadata:
+            record["Attachments"] = []
+            record["Attachment_Count"] = 0
+    
+    return record
+
+
+def read_message(raw, headers_only=False, message_filter=None, tracker=None):
+    """Parse a raw message, returning (message, identity), or (None, None) when it does not pass `message_filter`.
+    
+    The filter only looks at the header block, so skipped messages are never fully
+    parsed. With `headers_only` just the header block is returned. With a `tracker`, a
+    dedup.MessageTracker, the messages that pass the filter are identified from their
+    header block as well, and the message of a duplicate is None as its body is not
+    parsed either. The identity is None without a tracker.
+    """
+    with get_stats().timer("parse"):
+        headers = None
+        identity = None
+        if message_filter or tracker is not None:
+            headers = parse_headers(raw)
+            if message_filter and not message_filter.matches(headers):
+                return None, None
+            if tracker is not None:
+                identity = tracker.identify(headers, raw)
+                if identity.duplicate:
+                    return None, identity
+        if headers_only:
+            return (headers if headers is not None else parse_headers(raw)), identity
+        return parse_message(raw), identity
+
+
+def process_shard_worker(args_tuple):
+    """Worker function that reads and parses one message-aligned byte range of the MBOX file.
+    
+    Returns a list of (length, record, identity) tuples in file order, with None records
+    for the messages `message_filter` skipped, plus the attachments the worker extracted
+    when `extract_options` is given. Records and attachment files are numbered by the
+    parent, which is the only process that knows how many messages precede the shard.
+    
+    `tracking` holds the dedup and threads options of dedup.MessageTracker. Duplicates
+    within the shard are dropped before their body is parsed, and the identity of every
+    message is returned for the parent to find duplicates across shards and resolve
+    threads, which takes all preceding messages.
+    
+    `instrumentation` holds the number of slowest messages to report when --stats is
+    given, and the folder the shard's profile is written to with --profile. The shard's
+    stats are returned for the parent to merge.
+    """
+    path, start, end, record_options, extract_options, message_filter, tracking, instrumentation = args_tuple
+    # Pool processes are reused, and forked ones inherit the parent's stats
+    stats = reset_stats(instrumentation["slowest"])
+    profile_dir = instrumentation["profile_dir"]
+    with profiled(os.path.join(profile_dir, f"shard-{start}.prof") if profile_dir else None):
+        results, extraction = process_shard(path, start, end, record_options, extract_options, message_filter,
+                                            tracking)
+    return results, extraction, stats.state()
+
+
+def process_shard(path, start, end, record_options, extract_options, message_filter, tracking=None):
+    extractor = None
+    if extract_options is not None:
+        # Attachments are written to a per-shard staging folder and moved into place by the parent
+        shard_options = copy.copy(extract_options)
+        shard_options.output = extract.shard_output_folder(extract_options.output, start)
+        shard_options.blob_folder = os.path.join(extract_options.output, extract.BLOB_FOLDER)
+        extractor = extract.Extractor(shard_options, defer_metadata=True)
+    
+    tracker = MessageTracker(**tracking) if tracking else None
+    try:
+        results = list(iter_messages(path, start, end, record_options, extractor, message_filter, tracker))
+    finally:
+        if tracker is not None:
+            tracker.close()
+    
+    extraction = None
+    if extractor is not None:
+        extractor.stop_writers()
+        extraction = {
+            "shard_output": extractor.options.output,
+            "records": extractor.get_extraction_records(),
+            "pending_metadata": extractor.get_pending_metadata(),
+            "total": extractor.get_total(),
+            "failed": extractor.get_failed(),
+            "blob_stats": extractor.get_blob_stats(),
+        }
+    
+    return results, extraction
+
+
+def iter_messages(path, start, end, record_options, extractor=None, message_filter=None, tracker=None):
+    """Yield (length, record, identity) for every message in a byte range of the MBOX file, in file order.
+    
+    See convert_messages(); messages are numbered from 0 at `start`.
+    """
+    for _, length, record, identity in convert_messages(scan_mbox(path, start, end), record_options, extractor,
+                                                        message_filter, tracker):
+        yield length, record, identity
+
+
+def convert_messages(messages, record_options, extractor=None, message_filter=None, tracker=None, first_index=0):
+    """Yield (offset, length, record, identity) for every (offset, length, raw) message of `messages`, in order.
+    
+    Records of the messages `message_filter` skips, and of the duplicates `tracker` finds,
+    are None; identities are those returned by read_message(). Messages are numbered from
+    `first_index`, and their attachments are extracted with `extractor` when one is given,
+    before the record is built so that it reuses the digests of the stored attachments.
+    A message that cannot be converted gets an error_record(), while one whose attachments
+    fail to extract keeps its record.
+    """
+    stats = get_stats()
+    for index, (offset, length, raw) in enumerate(stats.timed_iter("scan", messages), first_index):
+        started = time.perf_counter()
+        stats.count("messages")
+        stats.count("bytes_in", length)
+        identity = None
+        try:
+            msg, identity = read_message(raw, record_options["headers_only"], message_filter, tracker)
+            if msg is None:
+                if identity is None:
+                    stats.count("messages_skipped")
+                yield offset, length, None, identity
+                continue
+            blob_digests = None
+            if extractor is not None:
+                try:
+                    with stats.timer("attachment_extraction"):
+                        blob_digests = extract.process_message(extractor, index, msg)
+                except Exception as e:
+                    logger.error(f"Error extracting attachments from message at byte offset {offset}: {e}")
+            record = message_to_record(msg, index, blob_digests=blob_digests, **record_options)
+        except Exception as e:
+            logger.error(f"Error processing message at byte offset {offset}: {e}")
+            stats.count("messages_failed")
+            record = error_record(e)
+        stats.add_message(index, offset, length, time.perf_counter() - started)
+        yield offset, length, record, identity
+
+
+def error_record(error):
+    """The record written for a message that could not be converted."""
+    return {
+        "Body": "",
+        "Error": str(error)
+    }
+
+
+def imap_bounded(pool, func, tasks, window):
+    """Like pool.imap(), but with at most `window` tasks submitted ahead of the consumer.
+    
+    Results are yielded in task order. Workers pick up new tasks as soon as they finish
+    one, while finished-but-unconsumed results never pile up beyond the window.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def shard_duplicates(shard_results, tracker):
+    """Return the local indexes of the messages of a shard that are duplicates within the whole file.
+    
+    Call it once per shard, in file order, before its attachments are merged, so that the
+    attachments of duplicates are dropped as well.
+    """
+    if tracker is None:
+        return frozenset()
+    return {
+        local_index for local_index, (_, _, identity) in enumerate(shard_results)
+        if identity is not None and tracker.is_duplicate(identity)
+    }
+
+
+def renumber_record(record, msg_index):
+    """Point the attachment metadata of a worker-built record at its global message index."""
+    for att in record.get("Attachments") or []:
+        att["message_id"] = msg_index
+        att["source_message_index"] = msg_index
+    return record
+
+
+def decode_mime_header(header_value):
+    """Decode MIME-encoded email headers."""
+    if not header_value:
+        return header_value
+    
+    try:
+        decoded_parts = decode_header(header_value)
+        decoded_string = ""
+        
+        for part, encoding in decoded_parts:
+            if isinstance(part, bytes):
+                if encoding:
+                    try:
+                        decoded_string += part.decode(encoding, errors='replace')
+                    except (UnicodeDecodeError, LookupError):
+                        # Fallback to utf-8 if encoding fails
+                        decoded_string += part.decode('utf-8', errors='replace')
+                else:
+                    # No encoding specified, try utf-8
+                    decoded_string += part.decode('utf-8', errors='replace')
+            else:
+                # Already a string
+                decoded_string += part
+        
+        return decoded_string
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Failed to decode MIME header '{header_value[:50]}...': {e}")
+        return header_value  # Return original if decoding fails
+
+
+def iter_records(path, fields=None, workers=1, attachments=None, headers_only=False, message_filter=None,
+                 dedup_attachments=False, charset_detection='auto', max_payload_mb=10, max_body_part_mb=1,
+                 max_depth=50, shard_size_mb=DEFAULT_SHARD_SIZE_MB, dedup=False, threads=False,
+                 memory_keys=DEFAULT_MEMORY_KEYS):
+    """Yield the record of every message of an MBOX file as a plain dict, in file order.
+    
+    Records are the ones the command line tool writes, built lazily one message at a time.
+    `fields` restricts them to the named headers and body fields (see BODY_FIELDS), and
+    only the header block of each message is parsed when no body field is requested or
+    with `headers_only`. Messages rejected by `message_filter`, a filters.MessageFilter,
+    are not yielded.
+    
+    With `workers` > 1 message-aligned shards of the file are parsed by a pool of worker
+    processes; compressed files are always read serially. `attachments` is a folder to
+    extract attachment files to (with `dedup_attachments`, into its content-addressed
+    store), in which case records carry their attachment metadata like with the -a option.
+    
+    With `dedup` only the first of the messages sharing a Message-ID (or content, for
+    messages without one) is yielded, and with `threads` every record has a Thread_Id;
+    see dedup.MessageTracker, which keeps `memory_keys` keys in memory.
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    if attachments is not None and headers_only:
+        raise ValueError("headers_only cannot be combined with attachments, which need the message bodies")
+    
+    record_options = {
+        "extract_attachments": attachments is not None,
+        "skip_metadata": False,
+        "max_payload_mb": max_payload_mb,
+        "max_body_part_mb": max_body_part_mb,
+        "max_depth": max_depth,
+        "charset_detection": charset_detection,
+        "attachment_digests": dedup_attachments,
+        "fields": tuple(fields) if fields is not None else None,
+        "headers_only": attachments is None and (
+            headers_only or (fields is not None and not any(field in BODY_FIELDS for field in fields))
+        ),
+    }
+    
+    extract_options = None
+    extractor = None
+    if attachments is not None:
+        extract_args = ["-i", path, "-o", os.path.join(attachments, "")]
+        if dedup_attachments:
+            extract_args.append("--dedup")
+        extract_options = extract.parse_options(extract_args)
+        extractor = extract.Extractor(extract_options)
+    
+    tracker = MessageTracker(dedup, threads, memory_keys) if dedup or threads else None
+    workers = min(workers, os.cpu_count() or 1)
+    try:
+        if workers > 1 and not detect_compression(path):
+            yield from iter_parallel_records(path, workers, shard_size_mb, record_options, extract_options,
+                                             extractor, message_filter, tracker)
+        else:
+            for _, record, identity in iter_messages(path, 0, None, record_options, extractor, message_filter,
+                                                     tracker):
+                if record is not None:
+                    if threads and identity is not None:
+                        record["Thread_Id"] = tracker.thread_id(identity)
+                    yield record
+    finally:
+        if tracker is not None:
+            tracker.close()
+        if extractor is not None:
+            extractor.save_extraction_map()
+            extractor.save_metadata()
+
+
+def iter_parallel_records(path, workers, shard_size_mb, record_options, extract_options, extractor,
+                          message_filter, tracker):
+    import multiprocessing as mp
+    
+    window = workers * INFLIGHT_SHARDS_PER_WORKER
+    shard_count = max(window, -(-os.path.getsize(path) // (shard_size_mb * 1024 * 1024)))
+    tracking = {"dedup": tracker.dedup, "threads": tracker.threads} if tracker is not None else None
+    instrumentation = {"slowest": None, "profile_dir": None}
+    shards = [
+        (path, start, end, record_options, extract_options, message_filter, tracking, instrumentation)
+        for start, end in compute_shards(path, shard_count)
+    ]
+    
+    msg_idx = 0
+    with mp.Pool(processes=workers) as pool:
+        for shard_results, extraction, _ in imap_bounded(pool, process_shard_worker, shards, window):
+            duplicates = shard_duplicates(shard_results, tracker)
+            if extraction is not None:
+                extract.merge_shard_extraction(extractor, index_offset=msg_idx, dropped=duplicates, **extraction)
+            for local_index, (_, record, identity) in enumerate(shard_results):
+                if record is not None and local_index not in duplicates:
+                    if tracker is not None and tracker.threads and identity is not None:
+                        record["Thread_Id"] = tracker.thread_id(identity)
+                    yield renumber_record(record, msg_idx)
+                msg_idx += 1
@@ -0,0 +1,299 @@
+import codecs
+import mmap
+import os
+import re
+from email.parser import HeaderParser, Parser
+
+try:
+    from .compression import decompressing_reader, detect_compression, open_input
+except ImportError:
+    from compression import decompressing_reader, detect_compression, open_input
+
+# Size of each buffered read while scanning for message separators
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Amount of data read up front to estimate the number of messages
+DEFAULT_SAMPLE_SIZE = 4 * 1024 * 1024
+
+FROM_LINE = b'From '
+SEPARATOR = b'\nFrom '
+
+# How scan_mbox() reads the file: "mmap" maps uncompressed files and yields zero-copy
+# memoryview slices of the mapping, "stream" reads chunks and yields bytes copies
+READERS = ('mmap', 'stream')
+
+# Maildir subfolders holding delivered messages; tmp/ holds deliveries in progress
+MAILDIR_FOLDERS = ('new', 'cur')
+
+# The blank line that ends the header block
+HEADER_END = re.compile(rb'\n\r?\n')
+
+
+def scan_stream(stream, base_offset=0, chunk_size=DEFAULT_CHUNK_SIZE, limit=None):
+    """Yield (offset, length, raw bytes) for every message found in an open binary stream.
+
+    `base_offset` is the position of the stream's first byte in the file and must be
+    the start of a line. At most `limit` bytes are read when it is given. Anything
+    before the first "From " line is skipped, as mailbox.mbox does.
+    """
+    buf = bytearray()
+    buf_offset = base_offset
+    started = False
+    remaining = limit
+    search_pos = 1
+
+    while True:
+        if remaining is None:
+            chunk = stream.read(chunk_size)
+        else:
+            chunk = stream.read(min(chunk_size, remaining)) if remaining > 0 else b''
+            remaining -= len(chunk)
+        if chunk:
+            buf += chunk
+
+        if not started:
+            if buf.startswith(FROM_LINE):
+                started = True
+            else:
+                idx = buf.find(SEPARATOR)
+                if idx == -1:
+                    if not chunk:
+                        return
+                    # Keep the tail in case a separator spans two reads
+                    drop = max(0, len(buf) - len(SEPARATOR) + 1)
+                    del buf[:drop]
+                    buf_offset += drop
+                    continue
+                del buf[:idx + 1]
+                buf_offset += idx + 1
+                started = True
+
+        while True:
+            idx = buf.find(SEPARATOR, search_pos)
+            if idx == -1:
+                break
+            end = idx + 1
+            yield buf_offset, end, bytes(buf[:end])
+            del buf[:end]
+            buf_offset += end
+            search_pos = 1
+
+        if not chunk:
+            if buf:
+                yield buf_offset, len(buf), bytes(buf)
+            return
+
+        # Only the tail of the buffer needs to be searched again after the next read
+        search_pos = max(1, len(buf) - len(SEPARATOR) + 1)
+
+
+def scan_mapped(path, start=0, end=None):
+    """Yield (offset, length, memoryview) for every message of an uncompressed MBOX file, without copying it.
+
+    Each message is a slice of a read-only mapping of the file and is released when the
+    next message is requested, so it must not be kept; parse_headers() and
+    parse_message() decode it straight from the mapping. Worker processes that map the
+    same file share its pages in the OS page cache.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if end <= start:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        position = start
+        # Anything before the first "From " line is skipped, as in scan_stream()
+        if mapped[position:position + len(FROM_LINE)] != FROM_LINE:
+            idx = mapped.find(SEPARATOR, position, end)
+            if idx == -1:
+                return
+            position = idx + 1
+        while position < end:
+            idx = mapped.find(SEPARATOR, position + 1, end)
+            message_end = end if idx == -1 else idx + 1
+            message = view[position:message_end]
+            try:
+                yield position, message_end - position, message
+            finally:
+                message.release()
+            position = message_end
+    finally:
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            # A caller still holds a slice; the mapping is closed once it is freed
+            pass
+
+
+def scan_mbox(path, start=0, end=None, chunk_size=DEFAULT_CHUNK_SIZE, reader='mmap'):
+    """Yield (offset, length, raw) for every message in an MBOX file in a single pass.
+
+    `start` and `end` restrict the scan to a byte range whose boundaries are message
+    aligned, as returned by compute_shards(). Compressed files are decompressed on the
+    fly, and offsets then refer to the decompressed data. With the "mmap" reader, raw
+    messages of uncompressed files are memoryviews that are only valid until the next
+    message is requested (see scan_mapped()); otherwise they are bytes.
+    """
+    if reader not in READERS:
+        raise ValueError(f"Unknown reader: {reader}")
+    if reader == 'mmap' and detect_compression(path) is None:
+        yield from scan_mapped(path, start, end)
+        return
+    with open_input(path) as f:
+        if start:
+            f.seek(start)
+        limit = None if end is None else end - start
+        yield from scan_stream(f, start, chunk_size, limit)
+
+
+def find_message_start(stream, position, chunk_size=1024 * 1024):
+    """Return the offset of the first message that starts at or after `position`.
+
+    Returns None when there is no further message in the stream.
+    """
+    if position == 0:
+        return 0
+
+    # Start one byte early so a separator right at `position` is found
+    stream.seek(position - 1)
+    offset = position - 1
+    tail = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return None
+        data = tail + chunk
+        idx = data.find(SEPARATOR)
+        if idx != -1:
+            return offset - len(tail) + idx + 1
+        tail = data[-(len(SEPARATOR) - 1):]
+        offset += len(chunk)
+
+
+def is_message_start(path, position):
+    """Checks that a message starts exactly at `position` in an MBOX file."""
+    with open_input(path) as f:
+        f.seek(max(0, position - 1))
+        data = f.read(len(FROM_LINE) + 1)
+    if position == 0:
+        return data.startswith(FROM_LINE)
+    return data == b'\n' + FROM_LINE
+
+
+def compute_shards(path, shard_count, start=0):
+    """Split an MBOX file from `start` on into at most `shard_count` message-aligned (start, end) byte ranges."""
+    file_size = os.path.getsize(path)
+    size = file_size - start
+    shard_count = max(1, min(shard_count, size))
+
+    boundaries = [start]
+    with open(path, 'rb') as f:
+        for i in range(1, shard_count):
+            boundary = find_message_start(f, start + size * i // shard_count)
+            if boundary is None:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    boundaries.append(file_size)
+
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+
+
+def header_block(raw):
+    """Return the header block of a raw message, including the blank line that ends it."""
+    match = HEADER_END.search(raw)
+    return raw[:match.end()] if match else raw
+
+
+def decode_raw(raw):
+    """Decode raw message bytes or a memoryview to the text the email parser works on.
+
+    Like email.message_from_bytes(), non-ASCII bytes become surrogate escapes, which the
+    parser turns back into bytes when payloads are decoded.
+    """
+    return codecs.ascii_decode(raw, 'surrogateescape')[0]
+
+
+def parse_headers(raw):
+    """Parse only the header block of a raw MBOX message, leaving the body untouched."""
+    return HeaderParser().parsestr(decode_raw(header_block(raw)))
+
+
+def parse_message(raw):
+    """Parse the raw bytes of one MBOX message into an email.message.Message."""
+    # mailbox.mbox does not include the blank line that precedes the next "From " line
+    if raw[-4:] == b'\r\n\r\n':
+        raw = raw[:-2]
+    elif raw[-2:] == b'\n\n':
+        raw = raw[:-1]
+    return Parser().parsestr(decode_raw(raw))
+
+
+def is_maildir(path):
+    """Checks whether `path` is a Maildir folder, which holds one file per message in its cur/ and new/ folders."""
+    return os.path.isdir(os.path.join(path, 'cur')) and os.path.isdir(os.path.join(path, 'new'))
+
+
+def maildir_messages(path):
+    """Return the message files of a Maildir folder in name order, which starts with the delivery time."""
+    messages = []
+    for folder in MAILDIR_FOLDERS:
+        directory = os.path.join(path, folder)
+        messages.extend(
+            (name, os.path.join(directory, name)) for name in os.listdir(directory) if not name.startswith('.')
+        )
+    return [message for _, message in sorted(messages)]
+
+
+def maildir_size(path):
+    """Returns the total size of the messages of a Maildir folder."""
+    return sum(os.path.getsize(message) for message in maildir_messages(path))
+
+
+def scan_maildir(path):
+    """Yield (position, length, raw bytes) for every message of a Maildir folder.
+
+    Maildir messages have no byte offset, so they are identified by their position in
+    maildir_messages(). Messages moved or deleted by a mail client while the folder
+    is read are skipped.
+    """
+    for position, message in enumerate(maildir_messages(path)):
+        try:
+            with open(message, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            continue
+        yield position, len(raw), raw
+
+
+def input_size(path):
+    """Returns the size of the MBOX data, decompressing the whole file when it is compressed."""
+    if detect_compression(path) is None:
+        return os.path.getsize(path)
+    with open_input(path) as f:
+        return f.seek(0, os.SEEK_END)
+
+
+def estimate_message_count(path, sample_size=DEFAULT_SAMPLE_SIZE):
+    """Estimate the number of messages from the first `sample_size` bytes of the file.
+
+    The count is exact when the whole file fits in the sample. For compressed files the
+    sample is decompressed and scaled by the share of the compressed file it came from.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as raw:
+        f = decompressing_reader(raw, detect_compression(path))
+        sample = f.read(sample_size)
+        exhausted = len(sample) < sample_size or not f.read(1)
+        consumed = raw.tell() if f is not raw else len(sample)
+
+    count = sample.count(SEPARATOR)
+    if sample.startswith(FROM_LINE):
+        count += 1
+
+    if exhausted or not sample:
+        return count
+    return max(1, round(count * file_size / max(1, consumed)))
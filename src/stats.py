@@ -0,0 +1,218 @@
+import heapq
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Number of slowest messages listed in the --stats report
+DEFAULT_SLOWEST = 10
+
+
+class _Timer:
+    __slots__ = ('stats', 'stage', 'started')
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class RunStats:
+    """Cumulative per-stage timers and counters of a conversion, plus its slowest messages.
+
+    Stages nest: charset_detection is part of body_decode, and dataframe_build, sanitize
+    and serialize are part of finalize. Stage times of parallel runs are the sum over
+    all worker processes, so they can exceed the wall time.
+    """
+
+    enabled = True
+
+    def __init__(self, slowest=DEFAULT_SLOWEST):
+        self.slowest_count = slowest
+        self.timers = {}
+        self.counters = {}
+        self.slowest = []  # Min-heap of (seconds, index, offset, size)
+        self.info = {}
+        # Attachment writer threads update the counters concurrently
+        self.lock = threading.Lock()
+
+    def describe(self, **info):
+        """Add fields describing the run, such as its input and mode, to the report."""
+        self.info.update(info)
+
+    def timer(self, stage):
+        """Context manager that adds the time spent in its block to `stage`."""
+        return _Timer(self, stage)
+
+    def add_time(self, stage, seconds, calls=1):
+        with self.lock:
+            timer = self.timers.get(stage)
+            if timer is None:
+                self.timers[stage] = [seconds, calls]
+            else:
+                timer[0] += seconds
+                timer[1] += calls
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timed_iter(self, stage, iterable):
+        """Yield from `iterable`, adding the time spent producing each item to `stage`."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - started, 0)
+                return
+            self.add_time(stage, time.perf_counter() - started)
+            yield item
+
+    def add_message(self, index, offset, size, seconds):
+        entry = (seconds, index, offset, size)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def merge(self, data, index_offset=0):
+        """Add the stats of a worker, whose message indices start at `index_offset`."""
+        for stage, (seconds, calls) in data['timers'].items():
+            self.add_time(stage, seconds, calls)
+        for name, amount in data['counters'].items():
+            self.count(name, amount)
+        for seconds, index, offset, size in data['slowest']:
+            self.add_message(index + index_offset, offset, size, seconds)
+
+    def state(self):
+        """Returns the raw stats, as sent from a worker to the parent for merge()."""
+        return {'timers': self.timers, 'counters': self.counters, 'slowest': self.slowest}
+
+    def to_dict(self):
+        return {
+            **self.info,
+            'stages': {
+                stage: {'seconds': round(seconds, 6), 'calls': calls}
+                for stage, (seconds, calls) in sorted(self.timers.items(), key=lambda item: -item[1][0])
+            },
+            'counters': dict(sorted(self.counters.items())),
+            'slowest_messages': [
+                {'index': index, 'offset': offset, 'bytes': size, 'seconds': round(seconds, 6)}
+                for seconds, index, offset, size in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+
+class NullStats:
+    """Stands in for RunStats when no --stats report is requested, at next to no cost."""
+
+    enabled = False
+
+    def describe(self, **info):
+        pass
+
+    def timer(self, stage):
+        return NULL_TIMER
+
+    def add_time(self, stage, seconds, calls=1):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def timed_iter(self, stage, iterable):
+        return iterable
+
+    def add_message(self, index, offset, size, seconds):
+        pass
+
+    def merge(self, data, index_offset=0):
+        pass
+
+    def state(self):
+        return None
+
+
+_stats = NullStats()
+
+# Profiler running in this process, if any
+_profiler = None
+
+
+def get_stats():
+    """Return the stats collector of this process."""
+    return _stats
+
+
+def reset_stats(slowest=None):
+    """Start collecting stats in this process, keeping `slowest` messages, or stop collecting with None."""
+    global _stats
+    _stats = RunStats(slowest) if slowest is not None else NullStats()
+    return _stats
+
+
+def save_stats(path, stats):
+    """Write the --stats JSON report."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stats.to_dict(), f, indent=2)
+
+
+@contextmanager
+def profiled(path):
+    """Run the block under cProfile and write its profile to `path`, or just run it when `path` is None."""
+    global _profiler
+    if path is None:
+        yield
+        return
+    import cProfile
+
+    if _profiler is not None:
+        # Worker processes forked while the parent is profiled inherit its active profiler
+        _profiler.disable()
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+    try:
+        yield
+    finally:
+        _profiler.disable()
+        _profiler.dump_stats(path)
+        _profiler = None
+
+
+def merge_profiles(output, paths):
+    """Merge profile files into `output` and delete them."""
+    import pstats
+
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        return
+    merged = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        merged.add(path)
+    merged.dump_stats(output)
+    for path in paths:
+        if path != output:
+            os.remove(path)
@@ -0,0 +1,164 @@
+"""Chooses serial or parallel conversion, the worker count and the shard size from a measured sample.
+
+The first messages of a run are converted and written serially, while Sample measures
+how long parsing a byte of the file takes and how long the records take to be sent back
+from a worker. When the rest is large enough for workers to possibly pay off, a
+one-process pool is started to measure what starting a worker costs. The run time of
+both modes is then estimated for the bytes left to convert, which follows the file's
+real mix of message sizes and content instead of its message count.
+"""
+import argparse
+import pickle
+import time
+from collections import namedtuple
+
+# Value of --workers that lets the sample choose the worker count, up to the CPU count
+AUTO = 'auto'
+
+# Messages converted to measure the costs of a file
+DEFAULT_SAMPLE_MESSAGES = 200
+
+# The sample ends early once it has taken this long, for files of very large messages
+MAX_SAMPLE_SECONDS = 2.0
+
+# Parallel processing must be estimated to be at least this much faster than serial processing
+MIN_SPEEDUP = 1.25
+
+# Least time a worker process takes to start; below twice this, the rest is not worth sampling startup for
+MIN_STARTUP_SECONDS = 0.01
+
+# Each further worker must cut the estimated run time by at least this fraction
+MIN_WORKER_GAIN = 0.05
+
+# Parsing time of a shard, long enough for the cost of submitting it to be negligible
+TARGET_SHARD_SECONDS = 0.5
+
+# Shards per worker, so that workers finishing early still find work to pick up
+MIN_SHARDS_PER_WORKER = 4
+
+MIN_SHARD_BYTES = 64 * 1024
+
+# Seconds measured on the sample: `parse` to convert it in a worker, `send` and `receive`
+# to pickle its records there and unpickle them in the main process, and `startup` to
+# start one worker process, or None when parallel processing cannot pay off anyway.
+SampleCosts = namedtuple('SampleCosts', 'messages bytes parse send receive startup')
+
+# The estimates behind a decision are in seconds for the bytes left to convert.
+ParallelPlan = namedtuple('ParallelPlan', 'parallel workers shard_bytes serial_seconds parallel_seconds')
+
+
+def worker_count(arg):
+    """argparse type for --workers: a number of at least 1, or "auto"."""
+    if arg == AUTO:
+        return arg
+    try:
+        value = int(arg)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"Expected a number of at least 1 or {AUTO}: {arg}")
+    return value
+
+
+class Sample:
+    """Times the conversion of the first messages of a run, whose results are used like all others.
+
+    Iterating yields the (offset, length, record, identity) tuples of `results`, as from
+    records.convert_messages(), unchanged. The time spent converting is taken until
+    `messages` results were yielded or MAX_SAMPLE_SECONDS have passed, when full()
+    becomes true; later results are passed through without being timed.
+    """
+
+    def __init__(self, results, messages=DEFAULT_SAMPLE_MESSAGES):
+        self.source = results
+        self.messages = messages
+        self.results = []
+        self.bytes = 0
+        self.seconds = 0.0
+        self.started = time.perf_counter()
+
+    def full(self):
+        return len(self.results) >= self.messages or time.perf_counter() - self.started >= MAX_SAMPLE_SECONDS
+
+    def __iter__(self):
+        while not self.full():
+            started = time.perf_counter()
+            result = next(self.source, None)
+            self.seconds += time.perf_counter() - started
+            if result is None:
+                return
+            self.results.append(result)
+            self.bytes += result[1]
+            yield result
+        yield from self.source
+
+    def costs(self, remaining_bytes):
+        """Return the SampleCosts of the sample, for `remaining_bytes` left to convert after it."""
+        # Workers send (length, record, identity) tuples
+        payload = [result[1:] for result in self.results]
+        self.results = []
+        started = time.perf_counter()
+        data = pickle.dumps(payload, pickle.HIGHEST_PROTOCOL)
+        send = time.perf_counter() - started
+        started = time.perf_counter()
+        pickle.loads(data)
+        receive = time.perf_counter() - started
+
+        # Parallel processing takes at least two worker starts
+        serial_seconds = remaining_bytes * self.seconds / self.bytes if self.bytes else 0.0
+        startup = measure_startup() if serial_seconds >= 2 * MIN_STARTUP_SECONDS * MIN_SPEEDUP else None
+        return SampleCosts(len(payload), self.bytes, self.seconds, send, receive, startup)
+
+
+def measure_startup():
+    """Seconds to start a one-process pool, run an empty task on it and shut it down."""
+    import multiprocessing as mp
+
+    started = time.perf_counter()
+    with mp.Pool(processes=1) as pool:
+        pool.apply(int)
+    return time.perf_counter() - started
+
+
+def plan_parallelism(costs, remaining_bytes, max_workers):
+    """Estimate the run time of both modes from `costs` and choose between them.
+
+    Workers parse and pickle their shards side by side while the main process unpickles
+    the records one shard at a time, so parallel processing takes the longer of the two,
+    plus the start of every worker. Writing takes the same time in both modes and is left
+    out. Workers are added while each one cuts the estimate by MIN_WORKER_GAIN, and
+    shards are sized to take TARGET_SHARD_SECONDS to parse. Without a measured worker
+    start the rest is too small for parallel processing.
+    """
+    if not costs.bytes:
+        return ParallelPlan(False, 1, None, 0.0, None)
+    parse = costs.parse / costs.bytes
+    worker = (costs.parse + costs.send) / costs.bytes
+    receive = costs.receive / costs.bytes
+
+    def parallel_seconds(workers):
+        return workers * costs.startup + remaining_bytes * max(worker / workers, receive)
+
+    serial_seconds = remaining_bytes * parse
+    if max_workers < 2 or costs.startup is None:
+        return ParallelPlan(False, 1, None, serial_seconds, None)
+    workers = 2
+    for candidate in range(3, max_workers + 1):
+        if parallel_seconds(candidate) <= parallel_seconds(workers) * (1 - MIN_WORKER_GAIN):
+            workers = candidate
+
+    shard_bytes = int(TARGET_SHARD_SECONDS / worker) if worker else remaining_bytes
+    shard_bytes = max(MIN_SHARD_BYTES, min(shard_bytes, -(-remaining_bytes // (workers * MIN_SHARDS_PER_WORKER))))
+
+    estimate = parallel_seconds(workers)
+    return ParallelPlan(estimate * MIN_SPEEDUP <= serial_seconds, workers, shard_bytes, serial_seconds, estimate)
+
+
+def describe_costs(costs):
+    """One log line with the per-message costs measured on a sample."""
+    messages = max(costs.messages, 1)
+    return (f"Sampled {costs.messages} messages ({costs.bytes / (1024 * 1024):.1f}MB) in {costs.parse:.2f}s: "
+            f"{costs.parse / messages * 1000:.2f}ms to convert a message, "
+            f"{(costs.send + costs.receive) / messages * 1000:.3f}ms to pass its record between processes, "
+            + (f"{costs.startup * 1000:.0f}ms to start a worker" if costs.startup is not None
+               else "worker start not measured"))
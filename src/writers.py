@@ -0,0 +1,531 @@
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+from functools import partial
+
+try:
+    from .compression import open_output, split_compression_suffix
+    from .stats import get_stats
+except ImportError:
+    from compression import open_output, split_compression_suffix
+    from stats import get_stats
+
+logger = logging.getLogger(__name__)
+
+# Columnar output formats, written with the optional pyarrow package
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
+# Output formats that can be written without holding every record in memory
+STREAMING_FORMATS = ('ndjson', 'sqlite') + COLUMNAR_FORMATS
+
+# Binary output formats, which cannot be compressed, split or resumed
+BINARY_FORMATS = COLUMNAR_FORMATS + ('sqlite',)
+
+# Records buffered per Parquet row group / Arrow record batch
+DEFAULT_ROW_GROUP_SIZE = 5000
+
+# Headers stored in their own columns; every other header goes to the Other_Headers map
+COLUMNAR_HEADERS = (
+    'Message-ID', 'Date', 'From', 'To', 'Cc', 'Bcc', 'Reply-To', 'Subject',
+    'In-Reply-To', 'References', 'Content-Type',
+)
+
+# Record keys produced by the converter rather than taken from the message headers
+COLUMNAR_FIELDS = ('Body', 'Attachments', 'Attachment_Count', 'Error', 'Thread_Id')
+
+# Header names are case-insensitive, and records keep the case each message uses
+COLUMNAR_HEADER_NAMES = {header.lower(): header for header in COLUMNAR_HEADERS}
+
+
+def sanitize_string(value):
+    """Sanitize the string to avoid potential encoding issues."""
+    if isinstance(value, str):
+        return value.replace('\x00', '')  # Remove null byte
+    return value
+
+
+def sanitize_record(record):
+    """Sanitize every string value of a record."""
+    return {key: sanitize_string(value) for key, value in record.items()}
+
+
+def split_dataframe(df, num_splits):
+    """Splits the DataFrame into a given number of parts."""
+    chunk_size = max(1, len(df) // num_splits)  # Ensure at least 1 row per chunk
+    chunks = []
+    for i in range(0, len(df), chunk_size):
+        chunk = df.iloc[i:i + chunk_size].copy()  # Use copy to free memory
+        chunks.append(chunk)
+    return chunks
+
+
+def split_output_path(output, part_number):
+    """Returns the file name used for one part of a split output."""
+    name, compression_suffix = split_compression_suffix(output)
+    base, extension = os.path.splitext(name)
+    return f"{base}_part{part_number}{extension}{compression_suffix}"
+
+
+def open_for_append(output, resume_state):
+    """Open an output file after truncating it to the last committed byte offset."""
+    f = open(output, 'r+b')
+    f.truncate(resume_state['offset'])
+    f.seek(resume_state['offset'])
+    return f
+
+
+def json_array_end(path):
+    """Returns the byte offset of the closing bracket of the JSON array in a file."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+    return size - len(tail) + tail.rindex(b']')
+
+
+class DataFrameWriter:
+    """Collects records in memory and writes them through a pandas DataFrame on close.
+    
+    With `resume_state` the records are added to an existing CSV file, using its header row,
+    after truncating it to the offset of the last checkpoint.
+    """
+
+    # Records are only written on close, so there is nothing to checkpoint before that
+    resumable = False
+
+    def __init__(self, output, csv=False, split=1, resume_state=None, compression=None):
+        self.output = output
+        self.csv = csv
+        self.split = split
+        self.compression = compression
+        self.resume_state = resume_state if os.path.exists(output) else None
+        self.records = {}
+        self.count = 0
+
+    def write(self, index, record):
+        self.records[index] = record
+
+    def flush(self):
+        pass
+
+    def state(self):
+        """Returns the committed output position once the file has been written."""
+        if self.csv:
+            return {'offset': os.path.getsize(self.output)}
+        return {'offset': json_array_end(self.output), 'count': self.count}
+
+    def close(self):
+        # pandas is only needed by this writer, so it is not loaded by library users of iter_records()
+        import pandas as pd
+
+        stats = get_stats()
+        with stats.timer('dataframe_build'):
+            df = pd.DataFrame.from_dict(self.records, orient="index")
+        self.count = len(df)
+        self.records = {}
+
+        # Sanitize the DataFrame values - apply to all elements
+        try:
+            with stats.timer('sanitize'):
+                for col in df.columns:
+                    df[col] = df[col].apply(lambda x: sanitize_string(x) if isinstance(x, str) else x)
+            logger.info("DataFrame sanitization completed")
+        except Exception as e:
+            logger.error(f"Error during DataFrame sanitization: {e}")
+            # Continue without sanitization if it fails
+
+        if self.split > 1:
+            for idx, chunk in enumerate(split_dataframe(df, self.split)):
+                chunk_output = split_output_path(self.output, idx + 1)
+                try:
+                    self._save(chunk, chunk_output)
+                    logger.info(f"Saved: {chunk_output}")
+                except Exception as e:
+                    logger.error(f"Failed to save chunk {idx + 1}: {e}")
+        elif self.resume_state:
+            self._append_csv(df)
+        else:
+            self._save(df, self.output)
+
+    def _save(self, df, path):
+        if self.compression:
+            with io.TextIOWrapper(open_output(path, self.compression), encoding='utf-8', newline='') as f:
+                self._write(df, f)
+        else:
+            self._write(df, path)
+
+    def _write(self, df, path_or_buf):
+        with get_stats().timer('serialize'):
+            if self.csv:
+                df.to_csv(path_or_buf, index=False)
+            else:
+                df.to_json(path_or_buf, orient="records", index=False, force_ascii=False)
+
+    def _append_csv(self, df):
+        with open(self.output, newline='', encoding='utf-8') as f:
+            header = next(csv.reader(f), [])
+        dropped = [col for col in df.columns if col not in header]
+        if dropped:
+            logger.warning(f"Columns not present in {self.output} are dropped when appending: {', '.join(dropped)}")
+        # Rows appended by a run that stopped before its checkpoint are written again
+        with io.TextIOWrapper(open_for_append(self.output, self.resume_state), encoding='utf-8', newline='') as f:
+            df.reindex(columns=header).to_csv(f, header=False, index=False)
+
+
+class JsonLinesWriter:
+    """Writes one JSON object per line as soon as each record is available."""
+
+    resumable = True
+
+    def __init__(self, output, resume_state=None, compression=None):
+        self.output = output
+        if resume_state:
+            self.file = open_for_append(output, resume_state)
+        else:
+            self.file = open_output(output, compression)
+
+    def write(self, index, record):
+        self.file.write(json.dumps(sanitize_record(record), ensure_ascii=False).encode('utf-8'))
+        self.file.write(b'\n')
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def state(self):
+        return {'offset': self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+
+class JsonArrayWriter:
+    """Writes a JSON array incrementally, one element at a time."""
+
+    resumable = True
+
+    def __init__(self, output, indent=None, sanitize=True, resume_state=None, compression=None):
+        self.output = output
+        self.indent = indent
+        self.sanitize = sanitize
+        if resume_state:
+            # Continue right before the closing bracket of the previous run
+            self.file = open_for_append(output, resume_state)
+            self.count = resume_state['count']
+        else:
+            self.file = open_output(output, compression)
+            self.file.write(b'[')
+            self.count = 0
+
+    def write(self, index, record):
+        if self.sanitize:
+            record = sanitize_record(record)
+        self.file.write(b',\n' if self.count else b'\n')
+        self.file.write(json.dumps(record, indent=self.indent, ensure_ascii=False).encode('utf-8'))
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def state(self):
+        return {'offset': self.file.tell(), 'count': self.count}
+
+    def close(self):
+        self.file.write(b'\n]\n' if self.count else b']\n')
+        self.file.close()
+
+
+class LazyJsonArrayWriter:
+    """Streams items to a JSON array file that is only created once the first item arrives.
+    
+    Used for the attachments manifest and the extraction map.
+    """
+
+    def __init__(self, output, resume_state=None, compression=None):
+        self.output = output
+        self.compression = compression
+        self.writer = None
+        if resume_state:
+            self.writer = JsonArrayWriter(output, indent=2, sanitize=False, resume_state=resume_state)
+
+    def write(self, items):
+        if not items:
+            return
+        if self.writer is None:
+            self.writer = JsonArrayWriter(self.output, indent=2, sanitize=False, compression=self.compression)
+        for item in items:
+            self.writer.write(None, item)
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def state(self):
+        return self.writer.state() if self.writer is not None else None
+
+    def close(self):
+        """Closes the file, returning False when nothing was ever written."""
+        if self.writer is None:
+            return False
+        self.writer.close()
+        return True
+
+
+def import_pyarrow():
+    """Import pyarrow on first use, so it stays an optional dependency."""
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet and Arrow output require pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def columnar_schema(pa):
+    """Returns the fixed schema of Parquet and Arrow outputs."""
+    attachment = pa.struct([
+        ('filename', pa.string()),
+        ('content_type', pa.string()),
+        ('content_disposition', pa.string()),
+        ('size_bytes', pa.int64()),
+        ('message_id', pa.int64()),
+        ('source_message_index', pa.int64()),
+        ('sha256', pa.string()),
+        ('extracted_with', pa.string()),
+    ])
+    return pa.schema(
+        [(header, pa.string()) for header in COLUMNAR_HEADERS]
+        + [
+            ('Other_Headers', pa.map_(pa.string(), pa.string())),
+            ('Body', pa.string()),
+            ('Attachments', pa.list_(attachment)),
+            ('Attachment_Count', pa.int32()),
+            ('Error', pa.string()),
+            ('Thread_Id', pa.string()),
+        ]
+    )
+
+
+def columnar_row(record):
+    """Maps a record onto the columnar schema, moving uncommon headers to Other_Headers.
+    
+    Headers fill their column whatever their case; when a message repeats one in another
+    case, the later copy goes to Other_Headers.
+    """
+    record = sanitize_record(record)
+    row = dict.fromkeys(COLUMNAR_HEADERS + COLUMNAR_FIELDS)
+    filled = set()
+    other_headers = []
+    for key, value in record.items():
+        column = key if key in COLUMNAR_FIELDS else COLUMNAR_HEADER_NAMES.get(key.lower())
+        if column is None or column in filled:
+            other_headers.append((key, None if value is None else str(value)))
+        else:
+            row[column] = value
+            filled.add(column)
+    row['Other_Headers'] = other_headers
+    return row
+
+
+class ColumnarWriter:
+    """Writes records to a Parquet or Arrow IPC file, one row group per `row_group_size` records.
+    
+    Only the records of the current row group are held in memory, and readers can load
+    single columns without reading the message bodies.
+    """
+
+    # Parquet and Arrow files cannot be appended to, so they are never checkpointed
+    resumable = False
+
+    def __init__(self, output, output_format='parquet', row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        pa = import_pyarrow()
+        self.output = output
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.count = 0
+        self.schema = columnar_schema(pa)
+        self.table_from_rows = partial(pa.Table.from_pylist, schema=self.schema)
+        self.sink = None
+        if output_format == 'parquet':
+            import pyarrow.parquet as pq
+            self.file = pq.ParquetWriter(output, self.schema, compression='zstd')
+        else:
+            import pyarrow.ipc
+            self.sink = pa.OSFile(output, 'wb')
+            self.file = pyarrow.ipc.new_file(self.sink, self.schema)
+
+    def write(self, index, record):
+        self.rows.append(columnar_row(record))
+        if len(self.rows) >= self.row_group_size:
+            self._write_row_group()
+
+    def flush(self):
+        pass
+
+    def state(self):
+        return {'offset': os.path.getsize(self.output), 'count': self.count}
+
+    def close(self):
+        self._write_row_group()
+        self.file.close()
+        if self.sink is not None:
+            self.sink.close()
+
+    def _write_row_group(self):
+        if not self.rows:
+            return
+        self.file.write_table(self.table_from_rows(self.rows))
+        self.count += len(self.rows)
+        self.rows = []
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE messages (
+    id INTEGER PRIMARY KEY,
+    message_id TEXT,
+    date TEXT,
+    sender TEXT,
+    subject TEXT,
+    body TEXT,
+    attachment_count INTEGER,
+    error TEXT,
+    thread_id TEXT
+);
+CREATE TABLE headers (
+    message INTEGER NOT NULL REFERENCES messages(id),
+    name TEXT NOT NULL,
+    value TEXT
+);
+CREATE TABLE attachments (
+    message INTEGER NOT NULL REFERENCES messages(id),
+    filename TEXT,
+    content_type TEXT,
+    content_disposition TEXT,
+    size_bytes INTEGER,
+    sha256 TEXT
+);
+'''
+
+# Built once all rows are loaded, which is much faster than maintaining them row by row
+SQLITE_INDEXES = '''
+CREATE INDEX messages_message_id ON messages(message_id);
+CREATE INDEX messages_thread_id ON messages(thread_id);
+CREATE INDEX headers_message ON headers(message);
+CREATE INDEX headers_name ON headers(name, value);
+CREATE INDEX attachments_message ON attachments(message);
+CREATE INDEX attachments_sha256 ON attachments(sha256);
+'''
+
+SQLITE_FTS = '''
+CREATE VIRTUAL TABLE messages_fts USING fts5(subject, body, content='messages', content_rowid='id');
+INSERT INTO messages_fts(messages_fts) VALUES ('rebuild');
+'''
+
+
+class SqliteWriter:
+    """Writes records to normalized SQLite tables: messages, headers and attachments.
+    
+    Rows are inserted with executemany() in one transaction per `batch_size` records.
+    The secondary indexes and an FTS5 full-text index over the subject and body (the
+    external content table messages_fts) are built once loading is done, e.g.
+    SELECT rowid, subject FROM messages_fts WHERE messages_fts MATCH 'invoice'.
+    """
+
+    # The database is built in one go, like the columnar formats
+    resumable = False
+
+    def __init__(self, output, batch_size=DEFAULT_ROW_GROUP_SIZE):
+        self.output = output
+        self.batch_size = batch_size
+        if os.path.exists(output):
+            os.remove(output)
+        self.connection = sqlite3.connect(output)
+        # The output is rebuilt from scratch on failure, so durability is traded for load speed
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.executescript(SQLITE_SCHEMA)
+        self.messages = []
+        self.headers = []
+        self.attachments = []
+        self.count = 0
+
+    def write(self, index, record):
+        record = sanitize_record(record)
+        # Header names are case-insensitive; the first of repeated headers fills the column
+        headers = {}
+        for key, value in record.items():
+            if key not in COLUMNAR_FIELDS:
+                headers.setdefault(key.lower(), value)
+                self.headers.append((index, key, None if value is None else str(value)))
+        self.messages.append((
+            index, headers.get('message-id'), headers.get('date'), headers.get('from'), headers.get('subject'),
+            record.get('Body'), record.get('Attachment_Count'), record.get('Error'), record.get('Thread_Id'),
+        ))
+        self.attachments.extend(
+            (index, att.get('filename'), att.get('content_type'), att.get('content_disposition'),
+             att.get('size_bytes'), att.get('sha256'))
+            for att in record.get('Attachments') or []
+        )
+        if len(self.messages) >= self.batch_size:
+            self._write_batch()
+
+    def flush(self):
+        pass
+
+    def state(self):
+        return {'offset': os.path.getsize(self.output), 'count': self.count}
+
+    def close(self):
+        self._write_batch()
+        with get_stats().timer('sqlite_index'):
+            self.connection.executescript(SQLITE_INDEXES)
+            try:
+                self.connection.executescript(SQLITE_FTS)
+            except sqlite3.OperationalError as e:
+                logger.warning(f"SQLite was built without FTS5, no full-text index is created: {e}")
+        self.connection.close()
+
+    def _write_batch(self):
+        if not self.messages:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', self.messages)
+            self.connection.executemany('INSERT INTO headers VALUES (?, ?, ?)', self.headers)
+            self.connection.executemany('INSERT INTO attachments VALUES (?, ?, ?, ?, ?, ?)', self.attachments)
+        self.count += len(self.messages)
+        self.messages = []
+        self.headers = []
+        self.attachments = []
+
+
+def create_writer(output, output_format, stream=False, split=1, resume_state=None,
+                  row_group_size=DEFAULT_ROW_GROUP_SIZE, compression=None):
+    """Returns the record writer for the requested output format.
+    
+    `resume_state` is the writer state saved in a checkpoint; the writer then appends to
+    the existing output instead of replacing it. `compression` compresses JSON, NDJSON
+    and CSV outputs on a background thread.
+    """
+    if output_format in COLUMNAR_FORMATS:
+        return ColumnarWriter(output, output_format, row_group_size)
+    if output_format == 'sqlite':
+        return SqliteWriter(output, row_group_size)
+    if output_format == 'ndjson':
+        return JsonLinesWriter(output, resume_state, compression)
+    if output_format == 'json' and (stream or resume_state):
+        return JsonArrayWriter(output, resume_state=resume_state, compression=compression)
+    return DataFrameWriter(output, csv=(output_format == 'csv'), split=split, resume_state=resume_state,
+                           compression=compression)
+
+
+def manifest_path(output):
+    """Returns the attachments manifest path that belongs to an output file.
+    
+    The manifest of a compressed output gets the same compression suffix.
+    """
+    name, compression_suffix = split_compression_suffix(output)
+    return f"{os.path.splitext(name)[0]}_attachments_manifest.json{compression_suffix}"
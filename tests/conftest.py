@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules are imported the way main.py and the benchmarks import them
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+from generate_mbox import generate_mbox  # noqa: E402
+
+# Small enough for the suite to stay fast, large enough for several shards and a full tuning sample
+TEST_MESSAGES = 300
+TEST_ATTACHMENT_SIZE = 2048
+TEST_NESTING_DEPTH = 3
+
+
+@pytest.fixture(scope='session')
+def mbox_path(tmp_path_factory):
+    """A synthetic MBOX file with plain, multilingual, nested, attachment and malformed messages."""
+    path = str(tmp_path_factory.mktemp('mbox') / 'test.mbox')
+    generate_mbox(path, TEST_MESSAGES, attachment_size=TEST_ATTACHMENT_SIZE, nesting_depth=TEST_NESTING_DEPTH)
+    return path
+
+
+@pytest.fixture
+def four_cpus(monkeypatch):
+    """Let parallel code paths use four workers on machines with fewer CPUs."""
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from checkpoint import checkpoint_path
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'main.py')
+
+# Runs main.py as a script with os.cpu_count() raised, as parallel runs need several CPUs
+WITH_CPUS = (
+    "import os, runpy, sys; cpus = int(sys.argv.pop(1)); os.cpu_count = lambda: cpus; sys.argv[0] = {main!r}; "
+    "sys.path.insert(0, os.path.dirname({main!r})); runpy.run_path({main!r}, run_name='__main__')"
+).format(main=MAIN)
+
+
+def run_main(*args, cwd, cpus=None):
+    """Run the command line tool in `cwd`, where it writes its log file, and return its output."""
+    command = [sys.executable, MAIN] if cpus is None else [sys.executable, '-c', WITH_CPUS, str(cpus)]
+    result = subprocess.run(command + [str(arg) for arg in args], cwd=cwd, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def json_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [{key: value for key, value in record.items() if value is not None} for record in json.load(f)]
+
+
+def message_aligned_prefix(path, share):
+    """Return the messages in the first `share` of an MBOX file."""
+    data = read_bytes(path)
+    return data[:data.index(b'\nFrom ', int(len(data) * share)) + 1]
+
+
+@pytest.mark.parametrize('output_format', ['ndjson', 'json'])
+def test_parallel_output_matches_serial(mbox_path, tmp_path, output_format):
+    outputs = {}
+    for mode, options in (('serial', ['--workers', '1']), ('parallel', ['--workers', '4', '--enable-parallel'])):
+        folder = tmp_path / mode
+        folder.mkdir()
+        output = folder / f'out.{output_format}'
+        log = run_main(mbox_path, '-o', output, '-f', output_format, '-a', *options, cwd=folder, cpus=4)
+        assert ('Parallel processing force-enabled' in log) == (mode == 'parallel')
+        outputs[mode] = (
+            read_bytes(output),
+            read_bytes(folder / 'out_attachments_manifest.json'),
+            sorted(os.listdir(folder / 'attachments')),
+        )
+    assert outputs['parallel'] == outputs['serial']
+
+
+@pytest.mark.parametrize('output_format', ['ndjson', 'json', 'csv'])
+def test_resume_after_interrupted_write(mbox_path, tmp_path, output_format):
+    """A resumed run drops what an interrupted run wrote after its last checkpoint."""
+    expected = tmp_path / f'expected.{output_format}'
+    run_main(mbox_path, '-o', expected, '-f', output_format, cwd=tmp_path)
+
+    # The MBOX file grows between runs, like an append-only export
+    growing = tmp_path / 'growing.mbox'
+    growing.write_bytes(message_aligned_prefix(mbox_path, 0.5))
+    output = tmp_path / f'out.{output_format}'
+    run_main(growing, '-o', output, '-f', output_format, '--resume', '--checkpoint-every', '10', cwd=tmp_path)
+    assert os.path.exists(checkpoint_path(str(output)))
+
+    # A run stopped between writing records and saving its checkpoint leaves them behind
+    with open(output, 'ab') as f:
+        f.write(b'{"Subject": "written after the last checkpoint"')
+    growing.write_bytes(read_bytes(mbox_path))
+    log = run_main(growing, '-o', output, '-f', output_format, '--resume', cwd=tmp_path)
+
+    assert 'Resuming at message' in log
+    if output_format == 'json':
+        # Resumed JSON arrays are written by the streaming writer, which leaves out missing headers
+        # instead of writing them as null
+        assert json_records(output) == json_records(expected)
+    else:
+        assert read_bytes(output) == read_bytes(expected)
+
+
+def test_checkpoints_need_resume(mbox_path, tmp_path):
+    output = tmp_path / 'out.ndjson'
+    run_main(mbox_path, '-o', output, '-f', 'ndjson', cwd=tmp_path)
+    assert not os.path.exists(checkpoint_path(str(output)))
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from records import iter_records
+
+
+def extracted_files(folder):
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), folder)
+        for directory, _, names in os.walk(folder)
+        for name in names
+        if name != 'extraction_map.json'
+    )
+
+
+def test_parallel_records_match_serial(mbox_path, four_cpus):
+    serial = list(iter_records(mbox_path))
+    assert len(serial) > 0
+    assert list(iter_records(mbox_path, workers=4)) == serial
+
+
+@pytest.mark.parametrize('dedup_attachments', [False, True])
+def test_parallel_attachments_match_serial(mbox_path, tmp_path, four_cpus, dedup_attachments):
+    serial_folder = str(tmp_path / 'serial')
+    parallel_folder = str(tmp_path / 'parallel')
+    serial = list(iter_records(mbox_path, attachments=serial_folder, dedup_attachments=dedup_attachments))
+    parallel = list(iter_records(mbox_path, workers=4, attachments=parallel_folder,
+                                 dedup_attachments=dedup_attachments))
+    assert parallel == serial
+    assert any(record["Attachment_Count"] for record in serial)
+    assert extracted_files(parallel_folder) == extracted_files(serial_folder)
+
+
+def test_parallel_dedup_matches_serial(tmp_path, mbox_path, four_cpus):
+    # Every message twice, so that copies end up in other shards than the first message
+    with open(mbox_path, 'rb') as f:
+        data = f.read()
+    path = str(tmp_path / 'twice.mbox')
+    with open(path, 'wb') as f:
+        f.write(data + data)
+    serial = list(iter_records(path, dedup=True, threads=True))
+    assert list(iter_records(path, workers=4, dedup=True, threads=True)) == serial
+    assert serial == list(iter_records(mbox_path, threads=True))
@@ -0,0 +1,81 @@
+import io
+import mailbox
+import time
+
+import pytest
+
+from scanner import SEPARATOR, compute_shards, parse_message, scan_mbox, scan_stream
+
+# Text before the first "From " line, an unquoted "From " body line, which starts a new
+# message for mailbox.mbox as well, and a last message without a final line end
+EDGE_CASES = (
+    b'garbage before the first message\n'
+    b'From a@example.com Mon Jan  1 00:00:00 2024\nSubject: first\n\nFrom here on\n>From quoted\n\n'
+    b'From b@example.com Mon Jan  1 00:00:00 2024\nSubject: empty body\n\n\n'
+    b'From c@example.com Mon Jan  1 00:00:00 2024\nSubject: last\n\nno line end'
+)
+
+
+@pytest.fixture
+def edge_case_path(tmp_path):
+    path = tmp_path / 'edge.mbox'
+    path.write_bytes(EDGE_CASES)
+    return str(path)
+
+
+def mailbox_messages(path):
+    return [message.as_bytes() for message in mailbox.mbox(path)]
+
+
+def scanned_messages(path, reader):
+    return [parse_message(raw).as_bytes() for _, _, raw in scan_mbox(path, reader=reader)]
+
+
+@pytest.mark.parametrize('reader', ['mmap', 'stream'])
+def test_messages_match_mailbox(mbox_path, reader):
+    assert scanned_messages(mbox_path, reader) == mailbox_messages(mbox_path)
+
+
+@pytest.mark.parametrize('reader', ['mmap', 'stream'])
+def test_edge_cases_match_mailbox(edge_case_path, reader):
+    assert scanned_messages(edge_case_path, reader) == mailbox_messages(edge_case_path)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, len(SEPARATOR) - 1, len(SEPARATOR), len(SEPARATOR) + 1, 7, 4096])
+def test_separators_across_reads(chunk_size):
+    """Separators split between two reads are found, whatever the read size."""
+    expected = [(offset, length, bytes(raw)) for offset, length, raw in scan_stream(io.BytesIO(EDGE_CASES))]
+    assert list(scan_stream(io.BytesIO(EDGE_CASES), chunk_size=chunk_size)) == expected
+    assert len(expected) == 4
+
+
+@pytest.mark.parametrize('chunk_size', [5, 64, 1024 * 1024])
+def test_stream_matches_mapped_reader(mbox_path, chunk_size):
+    with open(mbox_path, 'rb') as f:
+        streamed = [(offset, length, raw) for offset, length, raw in scan_stream(f, chunk_size=chunk_size)]
+    mapped = [(offset, length, bytes(raw)) for offset, length, raw in scan_mbox(mbox_path, reader='mmap')]
+    assert streamed == mapped
+
+
+def test_large_message_is_scanned_in_linear_time():
+    """Only the tail of the buffer is searched again after each read."""
+    body = (b'x' * 63 + b'\n') * (8 * 1024 * 1024 // 64)
+    data = b'From a\n\n' + body + b'From b\n\nlast\n'
+    started = time.perf_counter()
+    messages = list(scan_stream(io.BytesIO(data), chunk_size=4096))
+    # Searching the whole buffer after every read takes several seconds
+    assert time.perf_counter() - started < 1.0
+    assert [length for _, length, _ in messages] == [len(data) - 13, 13]
+
+
+@pytest.mark.parametrize('reader', ['mmap', 'stream'])
+@pytest.mark.parametrize('shard_count', [2, 7])
+def test_shards_cover_every_message(mbox_path, reader, shard_count):
+    shards = compute_shards(mbox_path, shard_count)
+    sharded = [
+        (offset, length)
+        for start, end in shards
+        for offset, length, _ in scan_mbox(mbox_path, start, end, reader=reader)
+    ]
+    assert len(shards) == shard_count
+    assert sharded == [(offset, length) for offset, length, _ in scan_mbox(mbox_path, reader=reader)]